@@ -1,66 +1,260 @@
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, datetime
+from functools import partial
 
 import click
 import click_log
 
 from .actions import compute
-from .exports import generate_head_results_from, write_results_on
-from .intercommunalities import load_intercommunalities
+from .columnar import require_pyarrow, write_intercommunalities_columnar_on
+from .columnar import write_towns_columnar_on
+from .compressed import write_compressed_results_on
+from .exports import generate_head_results_from, head_filename_for
+from .exports import write_results_on, write_town_versions_on
+from .intercommunalities import join_intercommunalities, load_fusions
+from .intercommunalities import submit_intercommunalities_parsing
 from .intercommunalities import write_intercommunalities_on
+from .intercommunalities import write_intercommunality_versions_on
 from .loaders import load_counties, load_history, load_populations, load_towns
+from .manifests import Manifest, partition_by_county, write_incrementally
 from .parents import compute_parents
-from .populations import compute_populations
+from .populations import CENSUS_NAMES, compute_populations
+from .populations import compute_census_populations, resolve_populations
+from .populations import set_census_populations
+from .redirects import build_redirects, write_redirects_binary_on
+from .redirects import write_redirects_on
+from .resolver import CHUNK_SIZE, Resolver, stream_resolve
+from .snapshots import FREQUENCIES, iter_dates, sweep
 from .specials import compute_specials
+from .sqlite import write_sqlite_on
 from .utils import compute_ancestors
 
+TOWNS_FILENAME = 'exports/communes/communes.csv'
+INTERCOMMUNALITIES_FILENAME = 'exports/epci/epci.csv'
+REDIRECTS_FILENAME = 'exports/communes/redirects.csv'
+
+
+class StderrClickHandler(click_log.ClickHandler):
+    """A click_log handler echoing all records to stderr."""
+
+    def emit(self, record):
+        try:
+            click.echo(self.format(record), err=True)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+STDERR_HANDLER = StderrClickHandler()
+STDERR_HANDLER.formatter = click_log.ColorFormatter()
+
+
+def to_date(string):
+    """Convert '2016-01-01' to a Python `datetime.date` object."""
+    return date(*[int(part) for part in string.split('-')])
 
-@click.command()
+
+@click.group(invoke_without_command=True)
 @click.option('--at-date', default=None, multiple=True,
               help='Filter only towns valid at that `YYYY-MM-DD` date.')
+@click.option('--every', type=click.Choice(FREQUENCIES), default=None,
+              help='Generate snapshots every year or month, '
+                   'requires `--from` and `--to`.')
+@click.option('--from', 'from_date', default=None,
+              help='First `YYYY-MM-DD` date of snapshots.')
+@click.option('--to', 'to_date_', default=None,
+              help='Last `YYYY-MM-DD` date of snapshots.')
 @click.option('-i', '--intercommunalities', is_flag=True,
               help='Process intercommunalities')
+@click.option('--columnar', is_flag=True,
+              help='Also export Parquet and Arrow files (requires pyarrow).')
+@click.option('--compressed', is_flag=True,
+              help='Also export towns as randomly accessible gzip blocks.')
+@click.option('--sqlite', default=None, type=click.Path(dir_okay=False),
+              help='Also export an indexed SQLite database to that path.')
+@click.option('--incremental', is_flag=True,
+              help='Only replace changed CSV files, with deltas and manifest.')
+@click.option('--census', type=click.Choice(CENSUS_NAMES), default=None,
+              help='Export populations of that census, only for towns '
+                   'valid at that time.')
+@click.option('--censuses', 'all_censuses', is_flag=True,
+              help='Also export populations of all censuses performed '
+                   'while each town was valid.')
+@click.option('--yearly-populations', is_flag=True,
+              help='Also export yearly populations of towns, '
+                   'requires `-i`.')
+@click.option('--redirects', is_flag=True,
+              help='Also export redirects of all towns to current ones.')
+@click.option('--redirects-at', default=None,
+              help='Redirect to towns valid at that `YYYY-MM-DD` date '
+                   'instead, requires `--redirects`.')
 @click_log.simple_verbosity_option()
 @click_log.init('geohisto')
-def main(at_date, intercommunalities):
-    # Load data from files.
-    towns = load_towns()
-    history_list = load_history()
-    populations = load_populations()
-    counties = load_counties()
-
-    # The order of the different computations is important:
-    # ancestors before populations in order to fallback on
-    # ancestors' populations sum.
-    compute(towns, history_list)
-    compute_specials(towns)
-    compute_ancestors(towns)
-    compute_populations(populations, towns)
-    compute_parents(counties, towns)
-
-    # Intercommunalitite should be processed after the whole towns process
+@click.pass_context
+def main(context, at_date, every, from_date, to_date_, intercommunalities,
+         columnar, compressed, sqlite, incremental, census, all_censuses,
+         yearly_populations, redirects, redirects_at):
+    # Towns are not computed when running a subcommand.
+    if context.invoked_subcommand is not None:
+        return
+    dates = set(to_date(date_) for date_ in at_date)
+    if every:
+        if not (from_date and to_date_):
+            raise click.UsageError('`--every` requires `--from` and `--to`.')
+        dates.update(iter_dates(to_date(from_date), to_date(to_date_), every))
+    if yearly_populations and not intercommunalities:
+        raise click.UsageError('`--yearly-populations` requires `-i`.')
+    if redirects_at and not redirects:
+        raise click.UsageError('`--redirects-at` requires `--redirects`.')
+    if columnar:
+        try:
+            require_pyarrow()
+        except ImportError as e:
+            raise click.UsageError(str(e))
+
+    # Intercommunalities parsing does not depend on towns,
+    # it is performed in background processes meanwhile.
+    executor = None
     if intercommunalities:
-        intercommunalities = load_intercommunalities(towns)
+        executor = ProcessPoolExecutor()
+        parsing = submit_intercommunalities_parsing(executor)
+
+    # Workers are shut down even if the towns process fails.
+    try:
+        # Load data from files.
+        towns = load_towns()
+        history_list = load_history()
+        populations = load_populations()
+        counties = load_counties()
+
+        # The order of the different computations is important:
+        # ancestors before populations in order to fallback on
+        # ancestors' populations sum.
+        compute(towns, history_list)
+        compute_specials(towns)
+        compute_ancestors(towns)
+        # All censuses are resolved once, for all populations.
+        resolved = resolve_populations(towns, populations)
+        compute_populations(populations, towns, resolved=resolved)
+        compute_parents(counties, towns)
+        if census or all_censuses:
+            compute_census_populations(populations, towns, resolved)
+        if census:
+            set_census_populations(populations, towns, census)
 
-    # Finally write files.
-    write_results_on('exports/communes/communes.csv', towns)
-    generate_head_results_from('exports/communes/communes.csv')
+        # Intercommunalities are attached once the whole towns process
+        # is done.
+        if intercommunalities:
+            intercommunalities = join_intercommunalities(towns, parsing,
+                                                         load_fusions())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    # Yearly populations are collected from intercommunalities files.
+    town_populations = None
+    if yearly_populations:
+        town_populations = intercommunalities.town_populations
+
+    # Finally write files, only replacing changed ones if incremental.
+    manifest = Manifest.load() if incremental else None
+    write_incrementally(TOWNS_FILENAME,
+                        partial(write_results_on, towns=towns,
+                                town_populations=town_populations,
+                                censuses=all_censuses),
+                        manifest, partition_by_county)
+    write_incrementally(head_filename_for(TOWNS_FILENAME),
+                        lambda filename: generate_head_results_from(
+                            TOWNS_FILENAME, filename_out=filename),
+                        manifest, partition_by_county, delta=False)
     if intercommunalities:
-        write_intercommunalities_on('exports/epci/epci.csv',
-                                    intercommunalities)
-        generate_head_results_from('exports/epci/epci.csv')
-    if at_date:
-        for date_ in at_date:
-            date_ = date(*[int(part) for part in date_.split('-')])
-            datetime_ = datetime.combine(date_, datetime.min.time())
+        write_incrementally(INTERCOMMUNALITIES_FILENAME,
+                            partial(write_intercommunalities_on,
+                                    intercommunalities=intercommunalities),
+                            manifest)
+        write_incrementally(head_filename_for(INTERCOMMUNALITIES_FILENAME),
+                            lambda filename: generate_head_results_from(
+                                INTERCOMMUNALITIES_FILENAME,
+                                filename_out=filename),
+                            manifest, delta=False)
+    if columnar:
+        write_towns_columnar_on('exports/communes/communes', towns)
+        if intercommunalities:
+            write_intercommunalities_columnar_on('exports/epci/epci',
+                                                 intercommunalities)
+    if compressed:
+        write_compressed_results_on('exports/communes/communes.csv.gz', towns)
+    if sqlite:
+        write_sqlite_on(sqlite, towns, intercommunalities or None)
+    if redirects:
+        if redirects_at:
+            table = build_redirects(towns, to_date(redirects_at))
+        else:
+            table = build_redirects(towns)
+        write_incrementally(REDIRECTS_FILENAME,
+                            partial(write_redirects_on, towns=towns,
+                                    table=table),
+                            manifest, partition_by_county)
+        write_redirects_binary_on('exports/communes/redirects.bin', table)
+
+    # Snapshots are computed with a single sweep whatever the number of dates.
+    if dates:
+        datetimes = [datetime.combine(date_, datetime.min.time())
+                     for date_ in dates]
+        for datetime_, valid_towns in sweep(towns.values(), datetimes):
             export_path = 'exports/communes/communes_{date_}.csv'.format(
+                date_=datetime_.date().isoformat())
+            write_incrementally(export_path,
+                                partial(write_town_versions_on,
+                                        towns=valid_towns,
+                                        town_populations=town_populations,
+                                        censuses=all_censuses),
+                                manifest, partition_by_county)
+    if dates and intercommunalities:
+        for date_, valid_intercommunalities in sweep(
+                intercommunalities.values(), dates):
+            export_path = 'exports/epci/epci_{date_}.csv'.format(
                 date_=date_.isoformat())
-            write_results_on(export_path, towns, datetime_)
-            if intercommunalities:
-                export_path = 'exports/epci/epci_{date_}.csv'.format(
-                    date_=date_.isoformat())
-                write_intercommunalities_on(export_path,
-                                            intercommunalities,
-                                            date_)
+            write_incrementally(export_path,
+                                partial(write_intercommunality_versions_on,
+                                        intercommunalities=(
+                                            valid_intercommunalities)),
+                                manifest)
+    if manifest is not None:
+        manifest.save()
+
+
+@main.command()
+@click.option('--towns', 'towns_filename', default=TOWNS_FILENAME,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Exported towns to resolve against.')
+@click.option('--code-column', default='insee_code',
+              help='Column of INSEE codes in the input.')
+@click.option('--date-column', default='date',
+              help='Column of `YYYY-MM-DD` dates in the input.')
+@click.option('--id-column', default='town_id',
+              help='Column of resolved towns ids added to the output.')
+@click.option('--workers', type=int, default=None,
+              help='Number of processes, one per CPU by default.')
+@click.option('--chunk-size', type=int, default=CHUNK_SIZE,
+              help='Number of lines resolved at once by each process.')
+def resolve(towns_filename, code_column, date_column, id_column, workers,
+            chunk_size):
+    """Add ids of towns valid at each (INSEE code, date) of a CSV."""
+    # Logs are written to stderr, stdout being the resolved CSV: only
+    # the stdout handler of click_log is swapped for the stderr one.
+    logger = click_log.get_logger()
+    logger.handlers = [
+        STDERR_HANDLER if isinstance(handler, click_log.ClickHandler)
+        else handler for handler in logger.handlers]
+    resolver = Resolver.from_csv(towns_filename)
+    try:
+        stream_resolve(resolver, sys.stdin, sys.stdout, code_column,
+                       date_column, id_column, workers, chunk_size)
+    except ValueError as e:
+        raise click.UsageError(str(e))
 
 
 main()
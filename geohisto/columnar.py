@@ -0,0 +1,157 @@
+"""
+Export towns and intercommunalities as typed columnar files.
+
+Both Parquet and Arrow IPC files are generated, with proper timestamps,
+nullable integers, dictionary-encoded strings and list columns.
+Towns are sorted by county and each county is written as its own
+row group (or record batch) to allow predicate pushdown.
+
+It requires the optional `pyarrow` dependency, the rest of the project
+works without it.
+"""
+import logging
+
+from itertools import groupby
+from operator import attrgetter
+
+from .utils import depcom_to_dep, split_ids, to_nullable_int
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # Optional dependency.
+    pyarrow = None
+
+log = logging.getLogger(__name__)
+
+
+def require_pyarrow():
+    """Raise an explicit error if `pyarrow` is not installed."""
+    if pyarrow is None:
+        raise ImportError('Columnar exports require `pyarrow`, '
+                          'install it with `pip install pyarrow`.')
+
+
+def to_modifications(value):
+    """Convert a `;`-joined list of INSEE modifications to integers."""
+    return [int(mod) for mod in str(value).split(';') if int(mod)]
+
+
+def towns_schema():
+    dictionary = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.schema([
+        ('id', pyarrow.string()),
+        ('insee_code', pyarrow.string()),
+        ('dep', dictionary),
+        ('start_datetime', pyarrow.timestamp('us')),
+        ('end_datetime', pyarrow.timestamp('us')),
+        ('name', pyarrow.string()),
+        ('successors', pyarrow.list_(pyarrow.string())),
+        ('ancestors', pyarrow.list_(pyarrow.string())),
+        ('parents', pyarrow.list_(dictionary)),
+        ('population', pyarrow.int64()),
+        ('insee_modification', pyarrow.list_(pyarrow.int16())),
+    ])
+
+
+def intercommunalities_schema():
+    dictionary = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.schema([
+        ('id', pyarrow.string()),
+        ('siren', pyarrow.string()),
+        ('name', dictionary),
+        ('acronym', dictionary),
+        ('kind', dictionary),
+        ('taxmodel', dictionary),
+        ('towns', pyarrow.list_(pyarrow.string())),
+        ('start_date', pyarrow.date32()),
+        ('end_date', pyarrow.date32()),
+        ('end_reason', dictionary),
+        ('successors', pyarrow.list_(pyarrow.string())),
+        ('ancestors', pyarrow.list_(pyarrow.string())),
+        ('population', pyarrow.int64()),
+        ('overlaps', pyarrow.list_(pyarrow.float64())),
+    ])
+
+
+def write_table_on(basename, table, partitions=None):
+    """
+    Write the `table` to both `basename.parquet` and `basename.arrow`.
+
+    The optional `partitions` is a list of `(offset, length)` tuples,
+    each one written as a distinct row group/record batch.
+    """
+    if partitions is None:
+        partitions = [(0, table.num_rows)]
+    parquet_filename = basename + '.parquet'
+    arrow_filename = basename + '.arrow'
+    log.info('Writing columnar files to %s and %s',
+             parquet_filename, arrow_filename)
+    with pyarrow.parquet.ParquetWriter(parquet_filename,
+                                       table.schema) as parquet_writer, \
+            pyarrow.OSFile(arrow_filename, 'wb') as sink, \
+            pyarrow.ipc.new_file(sink, table.schema) as arrow_writer:
+        # Slices share the same dictionaries, which is mandatory
+        # for the Arrow IPC file format.
+        for offset, length in partitions:
+            partition = table.slice(offset, length)
+            parquet_writer.write_table(partition)
+            arrow_writer.write_table(partition)
+
+
+def write_towns_columnar_on(basename, towns):
+    """
+    Write `towns` as Parquet and Arrow IPC files, one row group per county.
+    """
+    require_pyarrow()
+    towns = sorted(towns.values(),
+                   key=lambda town: depcom_to_dep(town.depcom))
+    deps = [depcom_to_dep(town.depcom) for town in towns]
+    columns = {
+        'id': [town.id for town in towns],
+        'insee_code': [town.depcom for town in towns],
+        'dep': deps,
+        'start_datetime': [town.start_datetime for town in towns],
+        'end_datetime': [town.end_datetime for town in towns],
+        'name': [town.nccenr for town in towns],
+        'successors': [split_ids(town.successors) for town in towns],
+        'ancestors': [split_ids(town.ancestors) for town in towns],
+        'parents': [split_ids(town.parents) for town in towns],
+        'population': [to_nullable_int(town.population) for town in towns],
+        'insee_modification': [to_modifications(town.modification)
+                               for town in towns],
+    }
+    table = pyarrow.Table.from_pydict(columns, schema=towns_schema())
+    partitions = []
+    offset = 0
+    for dep, group in groupby(deps):
+        length = len(list(group))
+        partitions.append((offset, length))
+        offset += length
+    write_table_on(basename, table, partitions)
+
+
+def write_intercommunalities_columnar_on(basename, intercommunalities):
+    """Write `intercommunalities` as Parquet and Arrow IPC files."""
+    require_pyarrow()
+    items = sorted(intercommunalities.values(), key=attrgetter('id'))
+    columns = {
+        'id': [item.id for item in items],
+        'siren': [item.siren for item in items],
+        'name': [item.name for item in items],
+        'acronym': [item.acronym for item in items],
+        'kind': [item.kind for item in items],
+        'taxmodel': [item.taxmodel for item in items],
+        'towns': [sorted(item.towns) for item in items],
+        'start_date': [item.start_date for item in items],
+        'end_date': [item.end_date for item in items],
+        'end_reason': [item.end_reason for item in items],
+        'successors': [split_ids(item.successors) for item in items],
+        'ancestors': [split_ids(item.ancestors) for item in items],
+        'population': [to_nullable_int(item.population) for item in items],
+        'overlaps': [item.overlaps for item in items],
+    }
+    table = pyarrow.Table.from_pydict(columns,
+                                      schema=intercommunalities_schema())
+    write_table_on(basename, table)
@@ -0,0 +1,168 @@
+"""
+Block-compressed and randomly accessible towns export.
+
+Towns are grouped by county, ordered by id and written as independently
+gzipped blocks (a la BGZF). The concatenation of gzip members being
+a valid gzip file, the whole export can still be read with `zcat`.
+
+A sidecar CSV index maps each block to its county, first and last INSEE
+codes and byte range, allowing to seek straight to the relevant blocks.
+"""
+import csv
+import gzip
+import io
+import logging
+import os
+
+from collections import namedtuple
+from functools import lru_cache
+from itertools import groupby
+
+from .exports import TOWN_FIELDS, town_to_row
+from .utils import depcom_to_dep
+
+log = logging.getLogger(__name__)
+
+INDEX_FIELDS = ('dep', 'first_insee_code', 'last_insee_code',
+                'offset', 'length', 'rows')
+
+# A block of the sidecar index, immutable to be shared by the cache.
+Block = namedtuple('Block', INDEX_FIELDS)
+
+# The header block is indexed with an empty county code.
+HEADER_DEP = ''
+
+
+def compress_rows(rows, header=False):
+    """Return gzipped CSV content for the given `rows` (dicts)."""
+    content = io.StringIO()
+    writer = csv.DictWriter(content, fieldnames=TOWN_FIELDS, delimiter=',')
+    if header:
+        writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+    block = io.BytesIO()
+    # A null modification time makes blocks reproducible.
+    with gzip.GzipFile(fileobj=block, mode='wb', mtime=0) as gzipped:
+        gzipped.write(content.getvalue().encode('utf-8'))
+    return block.getvalue()
+
+
+def iter_blocks(towns, rows_per_block):
+    """Generate `(dep, towns)` blocks grouped by county, sorted by id."""
+    towns = sorted(towns, key=lambda town: (depcom_to_dep(town.depcom),
+                                            town.id))
+    for dep, dep_towns in groupby(towns,
+                                  key=lambda town: depcom_to_dep(town.depcom)):
+        dep_towns = list(dep_towns)
+        for start in range(0, len(dep_towns), rows_per_block):
+            yield dep, dep_towns[start:start + rows_per_block]
+
+
+def index_filename_for(filename):
+    """Return the sidecar index filename of a compressed export."""
+    return filename + '.idx'
+
+
+def write_compressed_results_on(filename, towns, rows_per_block=1000):
+    """
+    Write towns to `filename` as gzipped blocks plus a sidecar index.
+
+    Each block contains at most `rows_per_block` towns of a single county.
+    """
+    index_filename = index_filename_for(filename)
+    log.info('Writing compressed towns file to %s (index: %s)',
+             filename, index_filename)
+    with open(filename, 'wb') as compressed, \
+            open(index_filename, 'w') as index_file:
+        index = csv.DictWriter(index_file, fieldnames=INDEX_FIELDS)
+        index.writeheader()
+        block = compress_rows([], header=True)
+        index.writerow({
+            'dep': HEADER_DEP, 'first_insee_code': '', 'last_insee_code': '',
+            'offset': 0, 'length': len(block), 'rows': 0
+        })
+        compressed.write(block)
+        offset = len(block)
+        for dep, block_towns in iter_blocks(towns.values(), rows_per_block):
+            block = compress_rows(town_to_row(town) for town in block_towns)
+            index.writerow({
+                'dep': dep,
+                'first_insee_code': min(town.depcom for town in block_towns),
+                'last_insee_code': max(town.depcom for town in block_towns),
+                'offset': offset,
+                'length': len(block),
+                'rows': len(block_towns),
+            })
+            compressed.write(block)
+            offset += len(block)
+
+
+def load_block_index(filename):
+    """
+    Load the sidecar index of the `filename` compressed export.
+
+    The parsed index is a tuple of `Block`, cached until the index file
+    changes (size or modification time).
+    """
+    stat = os.stat(index_filename_for(filename))
+    return cached_block_index(filename, stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=32)
+def cached_block_index(filename, size, mtime):
+    """Parse the sidecar index, `size` and `mtime` being cache keys."""
+    with open(index_filename_for(filename)) as index_file:
+        return tuple(Block(**dict(block, offset=int(block['offset']),
+                                  length=int(block['length']),
+                                  rows=int(block['rows'])))
+                     for block in csv.DictReader(index_file))
+
+
+def read_blocks(filename, blocks):
+    """Decompress the given `blocks` of `filename` into a list of dicts."""
+    with open(filename, 'rb') as compressed:
+        header = read_block(compressed, blocks[0])
+        fieldnames = next(csv.reader(io.StringIO(header)))
+        rows = []
+        for block in blocks[1:]:
+            content = io.StringIO(read_block(compressed, block))
+            rows.extend(csv.DictReader(content, fieldnames=fieldnames))
+        return rows
+
+
+def read_block(compressed, block):
+    """Read and decompress a single `block` from the `compressed` file."""
+    compressed.seek(block.offset)
+    return gzip.decompress(compressed.read(block.length)).decode('utf-8')
+
+
+def read_department(filename, dep, index=None):
+    """
+    Return the rows (as dicts) of the given county `dep`.
+
+    Only the relevant blocks are decompressed. The index is only
+    parsed once per file (see `load_block_index`) unless given.
+    """
+    index = index or load_block_index(filename)
+    header = index[0]
+    return read_blocks(filename, [header] + [
+        block for block in index[1:] if block.dep == dep])
+
+
+def read_insee_code(filename, insee_code, index=None):
+    """
+    Return the rows (as dicts) of all towns with the given `insee_code`.
+
+    Only blocks with a range of INSEE codes containing the given one
+    are decompressed, usually one. The index is only parsed once per
+    file (see `load_block_index`) unless given.
+    """
+    index = index or load_block_index(filename)
+    header = index[0]
+    blocks = [block for block in index[1:]
+              if (block.dep == depcom_to_dep(insee_code) and
+                  block.first_insee_code <= insee_code <=
+                  block.last_insee_code)]
+    return [row for row in read_blocks(filename, [header] + blocks)
+            if row['insee_code'] == insee_code]
@@ -0,0 +1,213 @@
+"""
+Unified temporal store of towns, counties, regions, overseas
+collectivities and intercommunalities.
+
+All levels share a single registry of ids (integer indexes), a single
+interval index of validities by level and code and a single parent/child
+adjacency, cross-level queries are answered through these indexes:
+
+    store = build_store(towns, counties, regions, collectivites,
+                        intercommunalities)
+    store.parents_at('fr:commune:01001@1942-01-01', REGION, date(2017, 1, 1))
+    # [<Entity fr:region:84@2016-01-01>]
+    store.children_at('fr:departement:01@1860-07-01', TOWN, date(1950, 1, 1))
+    store.chef_lieu_at('fr:departement:01@1860-07-01', date(1950, 1, 1))
+
+Parents are counties and collectivities of towns, regions of counties
+(including successors of their listed regions) and collectivities,
+intercommunalities of their member towns.
+"""
+import logging
+
+from bisect import bisect_right
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from .constants import END_DATETIME
+from .parents import CountyIndex, validity_of
+from .utils import depcom_to_dep, split_ids, to_datetime
+
+log = logging.getLogger(__name__)
+
+TOWN = 'commune'
+COUNTY = 'departement'
+REGION = 'region'
+COLLECTIVITY = 'collectivite'
+INTERCOMMUNALITY = 'epci'
+LEVELS = (TOWN, COUNTY, REGION, COLLECTIVITY, INTERCOMMUNALITY)
+
+Entity = namedtuple('Entity', [
+    'id', 'level', 'code', 'name', 'start_datetime', 'end_datetime',
+    'chef_lieu'
+])
+
+
+class EntityStore:
+    """
+    Entities of all levels with their validity and relations.
+
+    Entities are registered with `add` and related with `link`, `build`
+    has to be called once before querying (see `build_store`).
+    """
+
+    def __init__(self):
+        self.entities = []
+        self.indexes = {}
+        self.parents = defaultdict(list)
+        self.children = defaultdict(list)
+        self.intervals = defaultdict(list)
+        self.starts = {}
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __contains__(self, id_):
+        return id_ in self.indexes
+
+    def __getitem__(self, id_):
+        return self.entities[self.indexes[id_]]
+
+    def add(self, entity):
+        """Register an `entity`, return its integer index."""
+        index = self.indexes.setdefault(entity.id, len(self.entities))
+        if index == len(self.entities):
+            self.entities.append(entity)
+            self.intervals[(entity.level, entity.code)].append(
+                (entity.start_datetime, index))
+        return index
+
+    def link(self, child_id, parent_id):
+        """Relate the `child_id` entity to its `parent_id` one."""
+        child, parent = self.indexes[child_id], self.indexes[parent_id]
+        self.parents[child].append(parent)
+        self.children[parent].append(child)
+
+    def build(self):
+        """Sort intervals by start to allow binary searches."""
+        for intervals in self.intervals.values():
+            intervals.sort()
+        self.starts = {key: [start for start, _ in intervals]
+                       for key, intervals in self.intervals.items()}
+        log.info('Built a store of %s entities', len(self.entities))
+        return self
+
+    def get(self, id_):
+        """Return the entity of `id_`, `None` if unknown."""
+        index = self.indexes.get(id_)
+        return None if index is None else self.entities[index]
+
+    def at(self, level, code, date_):
+        """Return the entity of `level` with `code` valid at `date_`."""
+        datetime_ = to_datetime(date_)
+        key = (level, code)
+        if key not in self.starts:
+            return None
+        # Versions of a given code do not overlap.
+        position = bisect_right(self.starts[key], datetime_) - 1
+        if position < 0:
+            return None
+        entity = self.entities[self.intervals[key][position][1]]
+        return entity if datetime_ <= entity.end_datetime else None
+
+    def walk_at(self, id_, level, date_, adjacency):
+        """Return entities of `level` reachable from `id_` at `date_`."""
+        datetime_ = to_datetime(date_)
+        found = []
+        seen = set()
+        stack = [self.indexes[id_]]
+        while stack:
+            for related in adjacency.get(stack.pop(), ()):
+                entity = self.entities[related]
+                if (related in seen or not
+                        entity.start_datetime <= datetime_ <=
+                        entity.end_datetime):
+                    continue
+                seen.add(related)
+                if entity.level == level:
+                    found.append(entity)
+                else:
+                    stack.append(related)
+        return found
+
+    def parents_at(self, id_, level, date_):
+        """Return parents (even indirect) of `level` of `id_` at `date_`."""
+        return self.walk_at(id_, level, date_, self.parents)
+
+    def children_at(self, id_, level, date_):
+        """Return children (even indirect) of `level` of `id_` at `date_`."""
+        return self.walk_at(id_, level, date_, self.children)
+
+    def chef_lieu_at(self, id_, date_):
+        """Return the chef-lieu town of `id_` valid at `date_` if any."""
+        datetime_ = to_datetime(date_)
+        for town_id in self[id_].chef_lieu:
+            town = self.get(town_id)
+            if (town is not None and
+                    town.start_datetime <= datetime_ <= town.end_datetime):
+                return town
+        return None
+
+
+def entity_from_line(level, line):
+    """Return an `Entity` from a county, region or collectivity line."""
+    start, end = validity_of(line)
+    return Entity(id=line['id'], level=level, code=line['insee_code'],
+                  name=line['name'], start_datetime=start, end_datetime=end,
+                  chef_lieu=tuple(split_ids(line['chef_lieu'])))
+
+
+def build_store(towns, counties, regions, collectivites,
+                intercommunalities=None):
+    """
+    Return an `EntityStore` of all levels.
+
+    `counties`, `regions` and `collectivites` are the ones returned by
+    `load_counties`, `load_regions` and `load_collectivites`. Towns are
+    related to counties overlapping their validity (see `CountyIndex`)
+    and to collectivities with the same code. Counties are related to
+    every version of their regions, successors included.
+    """
+    log.info('Building entities store')
+    store = EntityStore()
+    index = CountyIndex(counties, regions)
+    for line in regions.values():
+        store.add(entity_from_line(REGION, line))
+    for lines in counties.values():
+        for line in lines:
+            store.add(entity_from_line(COUNTY, line))
+            for region_id in index.regions_of(line['id'],
+                                              *index.validities[line['id']]):
+                store.link(line['id'], region_id)
+    collectivities = defaultdict(list)
+    for line in collectivites.values():
+        entity = entity_from_line(COLLECTIVITY, line)
+        store.add(entity)
+        collectivities[entity.code].append(entity)
+        for region_id in split_ids(line['parents']):
+            if region_id in store:
+                store.link(line['id'], region_id)
+    for town in towns.values():
+        store.add(Entity(
+            id=town.id, level=TOWN, code=town.depcom, name=town.nccenr,
+            start_datetime=town.start_datetime,
+            end_datetime=town.end_datetime, chef_lieu=()))
+        code = depcom_to_dep(town.depcom)
+        for county_id in index.parents_of(code, town.start_datetime,
+                                          town.end_datetime):
+            store.link(town.id, county_id)
+        for collectivity in collectivities.get(code, ()):
+            if (collectivity.start_datetime <= town.end_datetime and
+                    town.start_datetime <= collectivity.end_datetime):
+                store.link(town.id, collectivity.id)
+    for intercommunality in (intercommunalities or {}).values():
+        store.add(Entity(
+            id=intercommunality.id, level=INTERCOMMUNALITY,
+            code=intercommunality.siren, name=intercommunality.name,
+            start_datetime=to_datetime(intercommunality.start_date),
+            end_datetime=datetime.combine(intercommunality.end_date,
+                                          END_DATETIME.time()),
+            chef_lieu=()))
+        for town_id in intercommunality.towns:
+            if town_id in store:
+                store.link(town_id, intercommunality.id)
+    return store.build()
@@ -3,10 +3,56 @@ import logging
 
 from itertools import islice
 
+from .populations import CENSUS_DATES
+
 log = logging.getLogger(__name__)
 
+TOWN_FIELDS = (
+    'id', 'insee_code',
+    'start_datetime', 'end_datetime',
+    'name',
+    'successors', 'ancestors', 'parents',
+    'population', 'insee_modification'
+)
+# Optional column of yearly populations from intercommunalities files.
+YEARLY_POPULATIONS_FIELD = 'yearly_populations'
+# Optional column of populations of all censuses within validity.
+CENSUSES_FIELD = 'censuses'
+
+
+def town_to_row(town):
+    """Convert a `town` to a dict ready to be written as a CSV row."""
+    return {
+        'id': town.id,
+        'insee_code': town.depcom,
+        'start_datetime': town.start_datetime,
+        'end_datetime': town.end_datetime.replace(microsecond=0),
+        'name': town.nccenr,
+        'successors': town.successors,
+        'ancestors': town.ancestors,
+        'parents': town.parents,
+        'population': ('NULL' if town.population is None
+                       else town.population),
+        'insee_modification': town.modification
+    }
+
+
+def format_yearly_populations(town_populations, town_id):
+    """Return the known `YYYY:pmun` populations of a town, `;`-joined."""
+    return ';'.join('{0}:{1}'.format(year, population) for year, population
+                    in town_populations.series(town_id))
 
-def write_results_on(filename, towns, at_datetime=None):
+
+def format_censuses(town):
+    """Return the known `CENSUS:population` of a town by date, `;`-joined."""
+    return ';'.join(
+        '{0}:{1}'.format(census, town.censuses[census])
+        for census in sorted(town.censuses or (), key=CENSUS_DATES.get)
+        if town.censuses[census] is not None)
+
+
+def write_results_on(filename, towns, at_datetime=None,
+                     town_populations=None, censuses=False):
     """
     Write the `filename` with CSV formatted informations.
 
@@ -18,49 +64,63 @@ def write_results_on(filename, towns, at_datetime=None):
 
     The `at_datetime` parameter allows you to only filter valid towns at
     that given datetime.
+
+    If `town_populations` (see `TownPopulations`) are given, an extra
+    column lists yearly municipal populations of each town. If
+    `censuses` is true, another one lists populations of censuses
+    within the validity of each town (see `compute_census_populations`).
+    """
+    if at_datetime:
+        towns = towns.valid_at(at_datetime)
+    else:
+        towns = towns.values()
+    write_town_versions_on(filename, towns, town_populations, censuses)
+
+
+def write_town_versions_on(filename, towns, town_populations=None,
+                           censuses=False):
+    """
+    Write the `filename` with CSV formatted informations.
+
+    Contrary to `write_results_on`, `towns` is any iterable of `Town`s,
+    useful to write snapshots computed elsewhere.
     """
     log.info('Writing towns file to %s', filename)
+    fieldnames = TOWN_FIELDS
+    if town_populations is not None:
+        fieldnames += (YEARLY_POPULATIONS_FIELD,)
+    if censuses:
+        fieldnames += (CENSUSES_FIELD,)
     with open(filename, 'w') as csvfile:
-        fieldnames = [
-            'id', 'insee_code',
-            'start_datetime', 'end_datetime',
-            'name',
-            'successors', 'ancestors', 'parents',
-            'population', 'insee_modification'
-        ]
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter=',')
         writer.writeheader()
         write = writer.writerow
 
-        if at_datetime:
-            towns = towns.valid_at(at_datetime)
-        else:
-            towns = towns.values()
-
         for town in towns:
-            write({
-                'id': town.id,
-                'insee_code': town.depcom,
-                'start_datetime': town.start_datetime,
-                'end_datetime': town.end_datetime.replace(microsecond=0),
-                'name': town.nccenr,
-                'successors': town.successors,
-                'ancestors': town.ancestors,
-                'parents': town.parents,
-                'population': town.population,
-                'insee_modification': town.modification
-            })
-
-
-def generate_head_results_from(filename_in, nb_of_lines=100):
+            row = town_to_row(town)
+            if town_populations is not None:
+                row[YEARLY_POPULATIONS_FIELD] = format_yearly_populations(
+                    town_populations, town.id)
+            if censuses:
+                row[CENSUSES_FIELD] = format_censuses(town)
+            write(row)
+
+
+def head_filename_for(filename):
+    """Add a `_head` suffix to the given `filename`."""
+    filepath, extension = filename.split('.')
+    return filepath + '_head.' + extension
+
+
+def generate_head_results_from(filename_in, nb_of_lines=100,
+                               filename_out=None):
     """
     Equivalent of `head` shell command using Python.
 
     The passed `filename_in` will have a `_head` suffix added for the
-    newly generated extract.
+    newly generated extract, unless a custom `filename_out` is given.
     """
-    filepath, extension = filename_in.split('.')
-    filename_out = filepath + '_head.' + extension
+    filename_out = filename_out or head_filename_for(filename_in)
     log.info('Writing %s head file to %s', filename_in, filename_out)
     with open(filename_in) as file_in, open(filename_out, 'w') as file_out:
         head = islice(file_in, nb_of_lines)
@@ -0,0 +1,143 @@
+"""
+Bounded-memory grouping of CSV rows, even if the file is not sorted.
+
+Sources are expected to be sorted by their grouping key. When they are
+not, rows are sorted with an external merge sort: chunks of at most
+`buffer_size` rows are sorted in memory and spilled to temporary files,
+which are then lazily merged, at most `fan_in` at once. If there are
+more spill files, consecutive ones are merged into intermediate spill
+files first. Whatever the size of the file, only one chunk (or one row
+per merged spill file) is kept in memory and at most `fan_in` spill
+files are read at once.
+
+Grouping is verified: a key appearing in two distinct groups raises
+a `ValueError` instead of silently splitting a group.
+"""
+import csv
+import heapq
+import logging
+import tempfile
+
+from itertools import groupby, islice
+from operator import itemgetter
+
+log = logging.getLogger(__name__)
+
+BUFFER_SIZE = 100000
+
+# Maximum number of spill files merged at once.
+FAN_IN = 64
+
+
+def read_rows(filename, **reader_options):
+    """Return `(fieldnames, rows)` of the `filename` CSV file."""
+    csv_file = open(filename)
+    rows = csv.DictReader(csv_file, **reader_options)
+    return rows.fieldnames, iter_and_close(rows, csv_file)
+
+
+def iter_and_close(rows, csv_file):
+    with csv_file:
+        yield from rows
+
+
+def is_sorted(filename, key, **reader_options):
+    """Check in a streaming pass that `filename` is sorted by `key`."""
+    _, rows = read_rows(filename, **reader_options)
+    previous = None
+    for row in rows:
+        if previous is not None and row[key] < previous:
+            rows.close()
+            return False
+        previous = row[key]
+    return True
+
+
+def spill(rows, fieldnames, directory):
+    """Write `rows` to a temporary file, returned ready to be read."""
+    spill_file = tempfile.TemporaryFile('w+', dir=directory)
+    writer = csv.DictWriter(spill_file, fieldnames=fieldnames)
+    writer.writerows(rows)
+    spill_file.seek(0)
+    return spill_file
+
+
+def merge(spill_files, fieldnames, key):
+    """Generate rows of sorted `spill_files` merged by `key`."""
+    # `heapq.merge` is stable too, files are merged in the given order.
+    return heapq.merge(*(csv.DictReader(spill_file, fieldnames=fieldnames)
+                         for spill_file in spill_files),
+                       key=itemgetter(key))
+
+
+def external_sort(filename, key, buffer_size=BUFFER_SIZE, directory=None,
+                  fan_in=FAN_IN, **reader_options):
+    """
+    Generate rows of `filename` sorted by `key` with bounded memory.
+
+    Rows with the same `key` keep their original relative order.
+    Spill files are created within `directory` (defaults to the
+    system temporary directory), merged by `fan_in` consecutive files
+    and closed (thus removed) once merged.
+    """
+    if fan_in < 2:
+        raise ValueError('Cannot merge less than two files at once')
+    fieldnames, rows = read_rows(filename, **reader_options)
+    spill_files = []
+    # Spill files of the current pass, closed at the end (even merged).
+    opened = []
+    try:
+        while True:
+            chunk = list(islice(rows, buffer_size))
+            if not chunk:
+                break
+            chunk.sort(key=itemgetter(key))  # Stable, keeps the order.
+            spill_files.append(spill(chunk, fieldnames, directory))
+            opened.append(spill_files[-1])
+        while len(spill_files) > fan_in:
+            log.debug('Merging %s sorted chunks of %s by %s',
+                      len(spill_files), filename, fan_in)
+            merged_files = []
+            for start in range(0, len(spill_files), fan_in):
+                group = spill_files[start:start + fan_in]
+                if len(group) > 1:
+                    merged_files.append(spill(merge(group, fieldnames, key),
+                                              fieldnames, directory))
+                    opened.append(merged_files[-1])
+                    for spill_file in group:
+                        spill_file.close()
+                else:
+                    merged_files.extend(group)
+            spill_files = merged_files
+            opened = list(spill_files)
+        log.debug('Merging %s sorted chunks of %s', len(spill_files),
+                  filename)
+        yield from merge(spill_files, fieldnames, key)
+    finally:
+        for spill_file in opened:
+            spill_file.close()
+
+
+def iter_groups(filename, key, buffer_size=BUFFER_SIZE, directory=None,
+                **reader_options):
+    """
+    Generate `(value, rows)` groups of `filename` rows by `key`.
+
+    Unsorted files are sorted externally first (see `external_sort`).
+    Groups are verified to be contiguous, a `ValueError` is raised
+    otherwise.
+    """
+    if is_sorted(filename, key, **reader_options):
+        _, rows = read_rows(filename, **reader_options)
+    else:
+        log.warning('%s is not sorted by %s, sorting it', filename, key)
+        rows = external_sort(filename, key, buffer_size, directory,
+                             **reader_options)
+    previous = None
+    for value, group in groupby(rows, key=itemgetter(key)):
+        if previous is not None and value <= previous:
+            raise ValueError('{filename}: {key} {value} is not contiguous'
+                             .format(filename=filename, key=key,
+                                     value=value))
+        previous = value
+        yield value, group
@@ -3,11 +3,23 @@ import logging
 import re
 import os
 
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from itertools import groupby
+from functools import lru_cache
+from hashlib import sha1
+from collections import Counter, defaultdict
 
-from .constants import INTERCOMMUNALITY_REMOVED, INTERCOMMUNALITY_START_DATE
-from .models import Intercommunality, Intercommunalities, Towns
+from .constants import INTERCOMMUNALITY_MERGED, INTERCOMMUNALITY_REMOVED
+from .constants import END_DATETIME, DELTA, INTERCOMMUNALITY_START_DATE
+from .external_sort import iter_groups
+from .models import Intercommunality, Intercommunalities
+from .models import IntercommunalityRecord
+from .offsets import read_rows
+from .utils import split_ids, to_nullable_int
+
+KINDS_FILENAME = 'sources/epci/natures-judicieres.csv'
+TAXMODELS_FILENAME = 'sources/epci/fiscalites.csv'
 
 
 log = logging.getLogger(__name__)
@@ -15,9 +27,6 @@ log = logging.getLogger(__name__)
 '''
 TODO:
     - handle more rules (see tests)
-    - handle merges from `sources/epci/fusions.csv`
-    - generate intermediate states (ie. town changes during the year)
-    - recompute population from `pmun` instead of the current `ptot`
 '''
 
 
@@ -87,6 +96,32 @@ POST_REPLACEMENTS = {
 }
 
 
+# Precompiled tables, names normalization runs for each SIREN of each year.
+PRE_TRANSLATIONS = str.maketrans(PRE_REPLACEMENTS)
+RE_TYPOS = re.compile('|'.join(re.escape(typo) for typo in TYPOS))
+RE_POST_REPLACEMENTS = re.compile(
+    '|'.join(re.escape(char) for char in POST_REPLACEMENTS))
+
+# Distinct (name, kind) couples are about 10k for all years.
+NAMES_CACHE_SIZE = 16384
+
+
+@lru_cache(maxsize=None)
+def kind_prefixes(kind):
+    """
+    Return `(prefixes, lower_prefixes)` tuples for a given `kind`.
+
+    The first one contains '{kind code} {preposition}' combinations,
+    the second one lowercased '{kind code} {common prefix} {preposition}'.
+    """
+    prefixes = tuple(' '.join((kind, prep)) for prep in PREPOSITIONS)
+    lower_prefixes = tuple(
+        ' '.join((kind.lower(), prefix, prep)) for prep in PREPOSITIONS
+        for prefix in COMMON_PREFIXES
+    )
+    return prefixes, lower_prefixes
+
+
 def should_replace_kind(name, kind):
     """
     Tells wether a kind code should be inlined or not.
@@ -100,21 +135,32 @@ def should_replace_kind(name, kind):
     DI Urbain de Mouy should be inlined
     DI Urbain Montrevel should not
     """
-    return name.startswith(tuple(
-        ' '.join((kind, prep)) for prep in PREPOSITIONS
-    )) or name.lower().startswith(tuple(
-        ' '.join((kind.lower(), prefix, prep)) for prep in PREPOSITIONS
-        for prefix in COMMON_PREFIXES
-    ))
+    prefixes, lower_prefixes = kind_prefixes(kind)
+    return (name.startswith(prefixes) or
+            name.lower().startswith(lower_prefixes))
 
 
 def fix_typos(name):
     """
     Replace some common kind code typos in names.
     """
-    for typo, fix in TYPOS.items():
-        if typo in name:
-            name = name.replace(typo, fix)
+    # Replacements are applied in order (a fix can create another typo),
+    # the combined regex only allows to skip most names quickly.
+    if RE_TYPOS.search(name):
+        for typo, fix in TYPOS.items():
+            if typo in name:
+                name = name.replace(typo, fix)
+    return name
+
+
+def fix_post_replacements(name):
+    """
+    Apply replacements once the name is normalized.
+    """
+    # Same as typos, replacements are chained (Saone-Chalaronne).
+    if RE_POST_REPLACEMENTS.search(name):
+        for char, replacement in POST_REPLACEMENTS.items():
+            name = name.replace(char, replacement)
     return name
 
 
@@ -122,11 +168,12 @@ def fix_word_casing(word):
     """
     Fix casing for an upper case word (old school DB style).
     """
-    if any(word.lower().startswith(prefix) for prefix in WITH_APOSTROPHE):
+    lower_word = word.lower()
+    if lower_word.startswith(WITH_APOSTROPHE):
         prefix, suffix = word.split('\'', 1)
         return '\''.join((prefix.lower(), suffix.capitalize()))
-    elif word.lower() in ALWAYS_LOWER:
-        return word.lower()
+    elif lower_word in ALWAYS_LOWER:
+        return lower_word
     elif word in NAME_RULES:
         return word.upper()
     else:
@@ -135,16 +182,24 @@ def fix_word_casing(word):
 
 def extract_name(line):
     """Extract and normalize an intercommunality name"""
-    name = line['nom'].strip('\' ')
-    for char, replacement in PRE_REPLACEMENTS.items():
-        name = name.replace(char, replacement)
-    kind = line['nature']
+    return normalize_name(line['nom'], line['nature'])
+
+
+@lru_cache(maxsize=NAMES_CACHE_SIZE)
+def normalize_name(name, kind):
+    """
+    Normalize an intercommunality `name` given its `kind`.
+
+    Results are cached given that a SIREN keeps the same name for most
+    years, see `normalize_name.cache_info()` for statistics.
+    """
+    name = name.strip('\' ').translate(PRE_TRANSLATIONS)
     name = fix_typos(name)
     parts = name.split()
     if name.isupper():
         parts = (fix_word_casing(p) for p in parts)
     name = ' '.join(parts)  # replace multiple spaces
-    if line['nature'] == 'DISTRICT':
+    if kind == 'DISTRICT':
         for prefix, replacement in DISTRICT_PREFIXES:
             if name.startswith(prefix):
                 name = name.replace(prefix, replacement, 1)
@@ -156,17 +211,14 @@ def extract_name(line):
             name = name.replace('{0} '.format(kind), '')
     elif name.startswith(PREPOSITIONS):
         name = ' '.join((NAME_RULES[kind], name))
-    elif name.lower().startswith(tuple(
-            ' '.join((kind.lower(), prefix, prep)) for prep in PREPOSITIONS
-            for prefix in COMMON_PREFIXES)):
+    elif name.lower().startswith(kind_prefixes(kind)[1]):
         name = ' '.join((NAME_RULES[kind], name))
     if name.lower().startswith(COMMON_PREFIXES):
         name = ' '.join(name.split(' ')[1:])
-    for char, replacement in POST_REPLACEMENTS.items():
-        name = name.replace(char, replacement)
+    name = fix_post_replacements(name)
     # Removes acronyms except from Tours
     if not name.startswith('Tour'):
-        name = re.sub(RE_WITH_PRENTHESIS, '', name).strip()
+        name = RE_WITH_PRENTHESIS.sub('', name).strip()
     # First char is always upper
     return name[0].upper() + name[1:]
 
@@ -175,71 +227,417 @@ def extract_acronym(line):
     """Extract acronym from parenthesis in name if present"""
     name = line['nom']
     if not name.startswith('Tour'):
-        match = re.search(RE_IN_PRENTHESIS, name)
+        match = RE_IN_PRENTHESIS.search(name)
         return match.group(1).strip().upper() if match else None
 
 
-def load_intercommunalities_from(filename, year, towns):
+def compute_fingerprint(name, kind, taxmodel, insees):
+    """
+    Return a digest of everything that can change an intercommunality.
+
+    Population is not part of it because it does not create a new version.
+    Note that the digest is stable across processes, contrary to `hash`.
+    """
+    content = '\x1f'.join([name, kind, taxmodel] + sorted(insees))
+    return sha1(content.encode('utf-8')).digest()[:16]
+
+
+def build_record(siren, lines):
+    """Return an `IntercommunalityRecord` from the `lines` of a SIREN."""
+    line = next(lines)
+    lines = [line] + list(lines)
+    insees = [other['insee'].zfill(5) for other in lines]
+    name = extract_name(line)
+    return IntercommunalityRecord(
+        siren=siren,
+        name=name,
+        acronym=extract_acronym(line),
+        kind=line['nature'],
+        taxmodel=line['fiscalite'],
+        population=line['ptot'],
+        insees=tuple(insees),
+        ptots=tuple(to_nullable_int(other.get('ptot_com'))
+                    for other in lines),
+        pmuns=tuple(to_nullable_int(other.get('pmun_com'))
+                    for other in lines),
+        fingerprint=compute_fingerprint(
+            name, line['nature'], line['fiscalite'], insees)
+    )
+
+
+def parse_intercommunalities_from(filename):
+    """
+    Parse EPCIs from a CSV file given its filename.
+
+    Names are normalized and rows are grouped by SIREN into compact
+    `IntercommunalityRecord`s. This step does not depend on towns
+    and can be performed in a separate process.
+
+    Files are expected to be sorted by SIREN, unsorted ones are
+    sorted externally with bounded memory (see `external_sort`).
+    """
+    log.debug('Parse intercommunalities from %s', filename)
+    groups = iter_groups(filename, 'siren', delimiter=';', quotechar='"')
+    records = [build_record(siren, lines) for siren, lines in groups]
+    log.debug('Names cache for %s: %s', filename, normalize_name.cache_info())
+    return records
+
+
+def read_intercommunality_records(filename, sirens, offsets=None):
+    """
+    Return `{siren: IntercommunalityRecord}` of some `sirens` only.
+
+    Only rows of requested SIRENs are decoded thanks to the offsets
+    index of `filename` (see `offsets`), built on first use.
+    """
+    rows = read_rows(filename, sirens, offsets, delimiter=';',
+                     quotechar='"')
+    return {siren: build_record(siren, iter(lines))
+            for siren, lines in rows.items()}
+
+
+def index_towns_at(towns, validity):
+    """Return a dict of towns valid at `validity` indexed by INSEE code."""
+    towns_by_insee = {}
+    for town in towns.valid_at(validity):
+        towns_by_insee.setdefault(town.depcom, town)
+    return towns_by_insee
+
+
+def changed_insees_between(previous_towns, towns_by_insee):
+    """
+    Return the INSEE codes resolved to another town than the previous time.
+
+    Both parameters are dicts returned by `index_towns_at`.
+    """
+    changed = set(previous_towns).symmetric_difference(towns_by_insee)
+    changed.update(insee for insee, town in towns_by_insee.items()
+                   if insee in previous_towns and
+                   previous_towns[insee] is not town)
+    return changed
+
+
+def load_fusions(filename='sources/epci/fusions.csv'):
+    """
+    Load declared merges as a `{(year, source SIREN): target SIRENs}` dict.
+
+    Merges are only effective on January 1st, hence indexed by year.
+    """
+    fusions = {}
+    with open(filename) as fusions_csv:
+        for line in csv.DictReader(fusions_csv, delimiter=';'):
+            key = (int(line['date'][:4]), line['siren_source'])
+            fusions.setdefault(key, set()).add(line['siren_cible'])
+    return fusions
+
+
+def index_members(records):
+    """Return the inverted index of member INSEE codes to EPCI SIRENs."""
+    return {insee: record.siren
+            for record in records for insee in record.insees}
+
+
+def find_absorbers(insees, members, towns, previous_towns):
+    """
+    Return `{siren: overlap}` of EPCIs absorbing the former `insees`.
+
+    The overlap is the share of former members now in each EPCI.
+    Towns merged in between are followed through their successors.
+    Lookups are performed with the `members` inverted index, in time
+    proportional to the number of former members.
     """
-    Load EPCIs for a given year from a CSV file given its filename.
+    counts = Counter()
+    for insee in insees:
+        siren = members.get(insee)
+        if siren is None and insee in previous_towns:
+            for successor_id in split_ids(previous_towns[insee].successors):
+                successor = towns.get(successor_id)
+                if successor is not None and successor.depcom in members:
+                    siren = members[successor.depcom]
+                    break
+        if siren is not None:
+            counts[siren] += 1
+    return {siren: round(count / len(insees), 4)
+            for siren, count in counts.items()}
+
+
+def index_town_changes(towns):
     """
-    log.debug('Load intercommunalities from %s', filename)
-    validity = datetime(year, 1, 1)
-    intercommunality = Intercommunality()
-    # Filter towns only valid on the first of the year to speed up the lookup
-    towns = Towns((town.id, town) for town in towns.valid_at(validity))
-    with open(filename) as epci_csv:
-        all_lines = csv.DictReader(epci_csv, delimiter=';', quotechar='"')
-        # No need to sort CSV are already sorted by SIREN
+    Return `(datetimes, depcoms)` sorted lists of towns validity changes.
+
+    A change is either the start of a town version or the moment
+    following its end, allowing to retrieve all changes within
+    a period with a binary search.
+    """
+    changes = []
+    for town in towns.values():
+        changes.append((town.start_datetime, town.depcom))
+        if town.end_datetime != END_DATETIME:
+            changes.append((town.end_datetime + DELTA, town.depcom))
+    changes.sort()
+    return ([changed_at for changed_at, _ in changes],
+            [depcom for _, depcom in changes])
+
+
+def changes_within(changes, year):
+    """
+    Generate `(datetime, depcom)` changes of towns within a `year`.
+
+    Changes on January 1st are excluded, they are already taken
+    into account by year files.
+    """
+    datetimes, depcoms = changes
+    first = bisect_right(datetimes, datetime(year, 1, 1))
+    last = bisect_left(datetimes, datetime(year + 1, 1, 1))
+    return zip(datetimes[first:last], depcoms[first:last])
+
+
+def index_town_versions(towns):
+    """Return a dict of lists of town versions indexed by INSEE code."""
+    versions = defaultdict(list)
+    for town in towns.values():
+        versions[town.depcom].append(town)
+    return versions
+
+
+def town_ids_at(insees, versions, valid_datetime):
+    """Return ids of towns with given `insees` valid at `valid_datetime`."""
+    town_ids = []
+    for insee in insees:
+        for town in versions.get(insee, ()):
+            if town.valid_at(valid_datetime):
+                town_ids.append(town.id)
+                break
+    return town_ids
+
 
-        for siren, lines in groupby(all_lines, lambda l: l['siren']):
-            for line in lines:
-                if siren != intercommunality.siren:
-                    intercommunality = Intercommunality(
-                        siren=siren,
-                        name=extract_name(line),
-                        acronym=extract_acronym(line),
-                        kind=line['nature'],
-                        taxmodel=line['fiscalite'],
-                        population=line['ptot']
-                    )
-                insee = line['insee'].zfill(5)
-                attach_town(intercommunality, insee, validity, towns)
-            yield intercommunality
+def check_fusions(year, merges, fusions):
+    """Warn about `merges` of a given year not matching declared `fusions`."""
+    for (fusion_year, source), targets in sorted(fusions.items()):
+        if fusion_year != year:
+            continue
+        if source not in merges:
+            log.warning('Declared merge of %s into %s in %s not detected',
+                        source, ', '.join(sorted(targets)), year)
+        elif not targets.issubset(merges[source]):
+            log.warning('Merge of %s detected into %s instead of %s in %s',
+                        source, ', '.join(sorted(merges[source])),
+                        ', '.join(sorted(targets)), year)
+
+
+class Codes(dict):
+    """
+    Reference codes (legal forms, tax models) indexed by themselves.
+
+    Codes read from year files are replaced by the reference instances,
+    shared by all versions. Unknown codes are reported once and kept.
+    """
+
+    @classmethod
+    def load(cls, filename):
+        codes = cls()
+        codes.filename = filename
+        with open(filename) as codes_csv:
+            for line in csv.DictReader(codes_csv, delimiter=';'):
+                codes[line['Code']] = line['Code']
+        return codes
+
+    def canonical(self, code):
+        try:
+            return self[code]
+        except KeyError:
+            log.warning('Unknown code %s (see %s)', code, self.filename)
+            self[code] = code
+            return code
+
+
+def build_intercommunality(record, validity, towns_by_insee,
+                           town_table=None, kinds=None, taxmodels=None,
+                           town_populations=None):
+    """
+    Create an `Intercommunality` from a `record` and attach its towns.
+
+    If a `town_table` is given, towns are stored as compact (and shared)
+    `Members`. If `kinds` and `taxmodels` `Codes` are given, the
+    reference codes are used. If `town_populations` are given too, the
+    population is the sum of municipal populations (`pmun`) of members
+    that year instead of the total population (`ptot`) of the file.
+    """
+    intercommunality = Intercommunality(
+        siren=record.siren,
+        name=record.name,
+        acronym=record.acronym,
+        kind=kinds.canonical(record.kind) if kinds else record.kind,
+        taxmodel=(taxmodels.canonical(record.taxmodel)
+                  if taxmodels else record.taxmodel),
+        population=record.population
+    )
+    for insee in record.insees:
+        attach_town(intercommunality, insee, validity, towns_by_insee)
+    if town_table is not None:
+        intercommunality = intercommunality._replace(
+            towns=town_table.members(intercommunality.towns))
+        if town_populations is not None:
+            intercommunality = intercommunality.set_population(
+                town_populations.sum(intercommunality.towns, validity.year))
+    return intercommunality
+
+
+def submit_intercommunalities_parsing(
+        executor, directory='sources/epci',
+        start=INTERCOMMUNALITY_START_DATE.year, end=2017):
+    """
+    Submit the parsing of year files from start to end to the `executor`.
+
+    Return a list of `(year, future)` tuples to be passed to
+    `join_intercommunalities` once towns are computed. Parsing does
+    not depend on towns, it can be performed concurrently.
+    """
+    log.info('Parsing intercommunalities from %s (%s-%s)',
+             directory, start, end)
+    return [
+        (year, executor.submit(parse_intercommunalities_from,
+                               os.path.join(directory,
+                                            '{0}.csv'.format(year))))
+        for year in range(start, end + 1)
+    ]
 
 
 def load_intercommunalities(towns, directory='sources/epci',
-                            start=INTERCOMMUNALITY_START_DATE.year, end=2017):
+                            start=INTERCOMMUNALITY_START_DATE.year, end=2017,
+                            workers=None):
     """
     Load all intercommunalities from directory for the years from start to end
+
+    Year files are parsed in parallel by a pool of `workers` processes
+    (defaults to the number of CPUs), the fold is performed year by year.
     """
-    log.info('Processing intercommunalities from %s (%s-%s)',
-             directory, start, end)
+    fusions_filename = os.path.join(directory, 'fusions.csv')
+    fusions = None
+    if os.path.exists(fusions_filename):
+        fusions = load_fusions(fusions_filename)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parsing = submit_intercommunalities_parsing(
+            executor, directory, start, end)
+        return join_intercommunalities(towns, parsing, fusions)
+
+
+def join_intercommunalities(towns, parsing, fusions=None,
+                            kinds_filename=KINDS_FILENAME,
+                            taxmodels_filename=TAXMODELS_FILENAME):
+    """
+    Fold parsed year files into intercommunalities attached to `towns`.
+
+    The `parsing` is a list of `(year, future)` tuples as returned by
+    `submit_intercommunalities_parsing`, each year waits for its own file.
+
+    Removed SIRENs whose towns are now members of other EPCIs are merged
+    into them, detected merges are checked against declared `fusions`
+    (as returned by `load_fusions`) if any.
+
+    Member towns changing within a year lead to intermediate versions,
+    only towns changes of that year are considered.
+
+    Towns members are stored as `Members` over a single town table
+    and legal forms and tax models are checked against reference codes.
+
+    Yearly populations of member towns are collected over the same
+    table (see `TownPopulations`), populations of intercommunalities
+    are the sums of their members' municipal populations.
+    """
+    log.info('Processing intercommunalities')
     intercommunalities = Intercommunalities()
-    for year in range(start, end + 1):
+    town_table = intercommunalities.town_table
+    town_populations = intercommunalities.town_populations
+    kinds = Codes.load(kinds_filename)
+    taxmodels = Codes.load(taxmodels_filename)
+    changes = index_town_changes(towns)
+    versions = index_town_versions(towns)
+    # Fingerprints of the last record of each SIREN, useful to skip
+    # intercommunalities unchanged from the previous year.
+    fingerprints = {}
+    # Member INSEE codes of the last record of each SIREN.
+    previous_insees = {}
+    previous_towns = {}
+    for year, future in parsing:
+        records = future.result()
+        validity = datetime(year, 1, 1)
+        towns_by_insee = index_towns_at(towns, validity)
+        changed_insees = changed_insees_between(previous_towns,
+                                                towns_by_insee)
+        for record in records:
+            for insee, ptot, pmun in zip(record.insees, record.ptots,
+                                         record.pmuns):
+                if insee in towns_by_insee:
+                    town_populations.set(towns_by_insee[insee].id, year,
+                                         ptot, pmun)
         open_sirens = intercommunalities.open_sirens
-        filename = os.path.join(directory, '{0}.csv'.format(year))
-        for intercommunality in load_intercommunalities_from(filename,
-                                                             year,
-                                                             towns):
-            if intercommunality.siren in open_sirens:
-                # This is either the same or an update
-                intercommunalities.update(intercommunality, year)
-            else:
+        unchanged = 0
+        for record in records:
+            if record.siren not in open_sirens:
                 # This is a creation
-                intercommunalities.upsert(intercommunality.create_on(year))
-            open_sirens.discard(intercommunality.siren)
-
-        # All remaining SIRENs are now obsolete intercommunalities
-        for siren in open_sirens:
-            intercommunalities.ends(siren, year - 1, INTERCOMMUNALITY_REMOVED)
+                intercommunalities.upsert(build_intercommunality(
+                    record, validity, towns_by_insee, town_table, kinds,
+                    taxmodels, town_populations).create_on(year))
+            elif (fingerprints.get(record.siren) == record.fingerprint and
+                    changed_insees.isdisjoint(record.insees)):
+                # Same as previous year, even for member towns.
+                unchanged += 1
+            else:
+                # This is either the same or an update
+                intercommunalities.update(build_intercommunality(
+                    record, validity, towns_by_insee, town_table, kinds,
+                    taxmodels, town_populations), year)
+            fingerprints[record.siren] = record.fingerprint
+            previous_insees[record.siren] = record.insees
+            open_sirens.discard(record.siren)
+        log.debug('%s: %s unchanged intercommunalities out of %s',
+                  year, unchanged, len(records))
+
+        # All remaining SIRENs are now obsolete intercommunalities,
+        # merged if their towns have been absorbed by other ones.
+        members = index_members(records)
+        merges = {}
+        for siren in sorted(open_sirens):
+            absorbers = find_absorbers(previous_insees[siren], members,
+                                       towns, previous_towns)
+            if not absorbers:
+                intercommunalities.ends(siren, year - 1,
+                                        INTERCOMMUNALITY_REMOVED)
+                continue
+            merges[siren] = sorted(absorbers)
+            successors = [intercommunalities.latest(absorber).id
+                          for absorber in merges[siren]]
+            merged = intercommunalities.ends(
+                siren, year - 1, INTERCOMMUNALITY_MERGED, successors,
+                [absorbers[absorber] for absorber in merges[siren]])
+            for successor_id in successors:
+                intercommunalities.add_ancestor(successor_id, merged.id)
+        log.debug('%s: %s intercommunalities merged', year, len(merges))
+        if fusions:
+            check_fusions(year, merges, fusions)
+
+        # Intermediate states of intercommunalities with changing towns.
+        changed_sirens = defaultdict(set)
+        for changed_at, insee in changes_within(changes, year):
+            if insee in members:
+                changed_sirens[members[insee]].add(changed_at)
+        intermediates = 0
+        for siren, datetimes in sorted(changed_sirens.items()):
+            for changed_at in sorted(datetimes):
+                town_ids = town_ids_at(previous_insees[siren], versions,
+                                       changed_at)
+                intermediates += intercommunalities.update_towns(
+                    siren, changed_at.date(), town_table.members(town_ids))
+        log.debug('%s: %s intermediate states', year, intermediates)
+        previous_towns = towns_by_insee
     return intercommunalities
 
 
-def attach_town(intercommunality, insee, validity, towns):
+def attach_town(intercommunality, insee, validity, towns_by_insee):
     try:
-        intercommunality.towns.add(towns.get_current(insee, validity).id)
-    except Exception:
+        intercommunality.towns.add(towns_by_insee[insee].id)
+    except KeyError:
         log.error('Failed for %s on %s@%s',
                   intercommunality.name, insee, validity.isoformat())
         intercommunality.missing_towns.add((insee, validity))
@@ -250,7 +648,7 @@ INTERCOMMUNALITY_FIELDS = (
     'kind', 'taxmodel', 'towns',
     'start_date', 'end_date', 'end_reason',
     'successors', 'ancestors',
-    'population',
+    'population', 'overlaps',
 )
 
 
@@ -268,6 +666,21 @@ def write_intercommunalities_on(filename, intercommunalities,
     The `at_date` parameter allows you to only filter
     valid intercommunalities at that given date.
     """
+    if at_date:
+        intercommunalities = intercommunalities.valid_at(at_date)
+    else:
+        intercommunalities = intercommunalities.values()
+    write_intercommunality_versions_on(filename, intercommunalities)
+
+
+def write_intercommunality_versions_on(filename, intercommunalities):
+    """
+    Write the `filename` with CSV formatted informations.
+
+    Contrary to `write_intercommunalities_on`, `intercommunalities`
+    is any iterable of `Intercommunality`, useful to write snapshots
+    computed elsewhere.
+    """
     log.info('Writing intercommunalities file to %s', filename)
     with open(filename, 'w') as csvfile:
         writer = csv.DictWriter(csvfile,
@@ -275,11 +688,6 @@ def write_intercommunalities_on(filename, intercommunalities,
                                 delimiter=',')
         writer.writeheader()
 
-        if at_date:
-            intercommunalities = intercommunalities.valid_at(at_date)
-        else:
-            intercommunalities = intercommunalities.values()
-
         for intercommunality in intercommunalities:
             writer.writerow({
                 'id': intercommunality.id,
@@ -295,4 +703,6 @@ def write_intercommunalities_on(filename, intercommunalities,
                 'successors': ';'.join(intercommunality.successors),
                 'ancestors': ';'.join(intercommunality.ancestors),
                 'population': intercommunality.population,
+                'overlaps': ';'.join(str(overlap) for overlap
+                                     in intercommunality.overlaps),
             })
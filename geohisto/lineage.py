@@ -0,0 +1,205 @@
+"""
+Lineage of towns: transitive successors and ancestors.
+
+Successors of computed towns are stored once as CSR arrays (successors
+of the town at index `i` being `targets[offsets[i]:offsets[i + 1]]`),
+ancestors being the transposed arrays. Transitive queries are memoized
+in a bounded cache:
+
+    lineage = Lineage(towns)
+    lineage.current('fr:commune:14475@1942-01-01')
+    # All the towns valid today it ended up in.
+    lineage.ancestors('fr:commune:49092@2015-12-15')
+    # Everything that merged into it since 1942.
+"""
+import logging
+
+from array import array
+from collections import deque
+from functools import lru_cache
+
+from .constants import END_DATETIME
+from .utils import split_ids, to_datetime
+
+log = logging.getLogger(__name__)
+
+# Number of memoized transitive queries.
+CACHE_SIZE = 16384
+
+# Colors of the depth-first search detecting cycles.
+WHITE, GREY, BLACK = 0, 1, 2
+
+
+def to_csr(size, edges):
+    """Return `(offsets, targets)` arrays of `(source, target)` edges."""
+    offsets = array('l', [0]) * (size + 1)
+    for source, _ in edges:
+        offsets[source + 1] += 1
+    for index in range(size):
+        offsets[index + 1] += offsets[index]
+    targets = array('l', [0]) * len(edges)
+    filled = offsets[:-1]
+    # Stable: targets keep the order of edges for each source.
+    for source, target in edges:
+        targets[filled[source]] = target
+        filled[source] += 1
+    return offsets, targets
+
+
+class Lineage:
+    """
+    Successors and ancestors of `towns` as CSR adjacency arrays.
+
+    Unknown successors are ignored. Each instance memoizes at most
+    `cache_size` transitive queries.
+    """
+
+    def __init__(self, towns, cache_size=CACHE_SIZE):
+        self.ids = list(towns)
+        self.indexes = {id_: index for index, id_ in enumerate(self.ids)}
+        self.starts = [town.start_datetime for town in towns.values()]
+        self.ends = [town.end_datetime for town in towns.values()]
+        edges = [(self.indexes[town.id], self.indexes[successor_id])
+                 for town in towns.with_successors()
+                 for successor_id in split_ids(town.successors)
+                 if successor_id in self.indexes]
+        self.forward = to_csr(len(self.ids), edges)
+        self.backward = to_csr(len(self.ids), [
+            (target, source) for source, target in edges])
+        self.walk = lru_cache(maxsize=cache_size)(self._walk)
+        log.info('Indexed lineage of %s towns (%s edges)',
+                 len(self.ids), len(edges))
+
+    def __contains__(self, town_id):
+        return town_id in self.indexes
+
+    def _neighbours(self, adjacency, index):
+        offsets, targets = adjacency
+        return targets[offsets[index]:offsets[index + 1]]
+
+    def _walk(self, index, forward, bound):
+        """
+        Return indexes reachable from `index`, breadth-first.
+
+        Forward, only successors starting before `bound` are followed,
+        backward, only ancestors ending after `bound`.
+        """
+        adjacency = self.forward if forward else self.backward
+        seen = {index}
+        queue = deque([index])
+        found = []
+        while queue:
+            for neighbour in self._neighbours(adjacency, queue.popleft()):
+                if neighbour in seen:
+                    continue
+                seen.add(neighbour)
+                if bound is not None and (
+                        self.starts[neighbour] > bound if forward
+                        else self.ends[neighbour] < bound):
+                    continue
+                found.append(neighbour)
+                queue.append(neighbour)
+        return tuple(found)
+
+    def descendants(self, town_id, until=None):
+        """
+        Return ids of all (transitive) successors of `town_id`.
+
+        With `until`, only successors starting until that date are kept.
+        """
+        bound = None if until is None else to_datetime(until)
+        return [self.ids[index] for index
+                in self.walk(self.indexes[town_id], True, bound)]
+
+    def ancestors(self, town_id, since=None):
+        """
+        Return ids of all (transitive) ancestors of `town_id`.
+
+        With `since`, only ancestors ending since that date are kept.
+        """
+        bound = None if since is None else to_datetime(since)
+        return [self.ids[index] for index
+                in self.walk(self.indexes[town_id], False, bound)]
+
+    def current(self, town_id, at=END_DATETIME):
+        """
+        Return ids of the towns valid `at` that `town_id` ended up in.
+
+        Defaults to currently valid towns, a town valid at that date
+        is its own current town.
+        """
+        at = to_datetime(at)
+        index = self.indexes[town_id]
+        if self.starts[index] <= at <= self.ends[index]:
+            return [town_id]
+        return [self.ids[descendant] for descendant
+                in self.walk(index, True, at)
+                if self.starts[descendant] <= at <= self.ends[descendant]]
+
+    def path(self, from_id, to_id):
+        """
+        Return the shortest list of ids from `from_id` to `to_id`
+        following successors, `None` if there is none.
+        """
+        source, target = self.indexes[from_id], self.indexes[to_id]
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            index = queue.popleft()
+            if index == target:
+                path = []
+                while index is not None:
+                    path.append(self.ids[index])
+                    index = previous[index]
+                return path[::-1]
+            for neighbour in self._neighbours(self.forward, index):
+                if neighbour not in previous:
+                    previous[neighbour] = index
+                    queue.append(neighbour)
+        return None
+
+    def cycles(self):
+        """
+        Return cycles of successors as lists of ids.
+
+        Uses an iterative depth-first search, each cycle is reported
+        once from the first town of the cycle to be reached.
+        """
+        colors = bytearray(len(self.ids))
+        cycles = []
+        for root in range(len(self.ids)):
+            if colors[root] != WHITE:
+                continue
+            colors[root] = GREY
+            stack = [(root, iter(self._neighbours(self.forward, root)))]
+            while stack:
+                index, neighbours = stack[-1]
+                for neighbour in neighbours:
+                    if colors[neighbour] == WHITE:
+                        colors[neighbour] = GREY
+                        stack.append((neighbour, iter(self._neighbours(
+                            self.forward, neighbour))))
+                        break
+                    if colors[neighbour] == GREY:
+                        path = [item for item, _ in stack]
+                        cycles.append([
+                            self.ids[item]
+                            for item in path[path.index(neighbour):]])
+                else:
+                    colors[index] = BLACK
+                    stack.pop()
+        return cycles
+
+    def bulk_descendants(self, town_ids, until=None):
+        """Return a `{town id: descendants ids}` dict of many towns."""
+        return {town_id: self.descendants(town_id, until)
+                for town_id in town_ids}
+
+    def bulk_ancestors(self, town_ids, since=None):
+        """Return a `{town id: ancestors ids}` dict of many towns."""
+        return {town_id: self.ancestors(town_id, since)
+                for town_id in town_ids}
+
+    def bulk_current(self, town_ids, at=END_DATETIME):
+        """Return a `{town id: current ids}` dict of many towns."""
+        return {town_id: self.current(town_id, at) for town_id in town_ids}
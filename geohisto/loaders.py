@@ -8,6 +8,7 @@ from .constants import (
     END_DATETIME, START_DATE, START_DATETIME
 )
 from .models import Record, Town, Towns
+from .populations import CENSUS_NAMES, DEFAULT_CENSUS, index_populations
 from .utils import (
     compute_id, convert_date, convert_datetime, convert_name_with_article,
     iter_over_insee_csv_file
@@ -42,8 +43,9 @@ def load_towns(filename='sources/France2017.txt'):
             dep=line['DEP'],
             com=line['COM'],
             nccenr=convert_name_with_article(line),
-            population='NULL',
-            parents=''
+            population=None,
+            parents='',
+            censuses=None
         )
         towns[town.id] = town
     return towns
@@ -89,23 +91,38 @@ def load_population_from(filename):
     We use the name `DEPCOM` + `LIBMIN` as key because we cannot rely on
     `DEPCOM` only, it is not unique (recycled on towns' merges).
     """
-    populations = {}
+    return {key: censuses[DEFAULT_CENSUS]
+            for key, censuses in load_censuses_from(filename).items()}
+
+
+def load_censuses_from(filename):
+    """
+    Load populations of all censuses from `filename` into a dict.
+
+    Keys are the same as `load_population_from`, values are dicts
+    of populations indexed by census for available census columns.
+    """
     with open(filename) as population:
-        for item in csv.DictReader(population, delimiter=';'):
-            populations[item['DEPCOM'] + item['LIBMIN']] = item['PMUN13']
-    return populations
+        reader = csv.DictReader(population, delimiter=';')
+        censuses = [census for census in reader.fieldnames
+                    if census in CENSUS_NAMES]
+        return {
+            item['DEPCOM'] + item['LIBMIN']: {
+                census: item[census] for census in censuses}
+            for item in reader
+        }
 
 
 def load_populations():
-    """Load all populations into a dedicated dict."""
+    """Load all populations into a `PopulationStore`."""
     log.info('Loading populations')
-    return {
-        'metropole': load_population_from('sources/population_metropole.csv'),
-        'arrondissements': load_population_from(
+    return index_populations({
+        'metropole': load_censuses_from('sources/population_metropole.csv'),
+        'arrondissements': load_censuses_from(
             'sources/population_arrondissements.csv'),
-        'dom': load_population_from('sources/population_dom.csv'),
-        'mortes': load_population_from('sources/population_mortes.csv')
-    }
+        'dom': load_censuses_from('sources/population_dom.csv'),
+        'mortes': load_censuses_from('sources/population_mortes.csv')
+    })
 
 
 def load_counties(filename='exports/departements/departements.csv'):
@@ -116,3 +133,19 @@ def load_counties(filename='exports/departements/departements.csv'):
         for line in csv.DictReader(counties_csv):
             counties[line['insee_code']].append(line)
     return counties
+
+
+def load_regions(filename='exports/regions/regions.csv'):
+    """Load regions from `filename` into a dict indexed by id."""
+    log.info('Loading regions')
+    with open(filename) as regions_csv:
+        return {line['id']: line for line in csv.DictReader(regions_csv)}
+
+
+def load_collectivites(
+        filename='exports/collectivites/collectivites.csv'):
+    """Load overseas collectivities from `filename` into a dict by id."""
+    log.info('Loading collectivities')
+    with open(filename) as collectivites_csv:
+        return {line['id']: line
+                for line in csv.DictReader(collectivites_csv)}
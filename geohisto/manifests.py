@@ -0,0 +1,145 @@
+"""
+Incremental exports based on content hashes.
+
+Each export is first written to a temporary file and compared with the
+existing one: unchanged files are left untouched (keeping their mtime),
+changed files are replaced and a delta file lists added, removed and
+modified rows by `id`.
+
+A JSON manifest keeps the content hash of each file and of each county
+partition, allowing downstream consumers to only sync what changed.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+
+from .utils import depcom_to_dep
+
+log = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = 'exports/manifest.json'
+DELTA_FIELDS = ('id', 'change')
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+
+
+def partition_by_county(row):
+    """Partition towns rows by county code."""
+    return depcom_to_dep(row['insee_code'])
+
+
+class Manifest(dict):
+    """Content hashes of exported files, indexed by filename."""
+
+    @classmethod
+    def load(cls, filename=MANIFEST_FILENAME):
+        """Load the manifest from `filename`, empty if it does not exist."""
+        manifest = cls()
+        manifest.filename = filename
+        if os.path.exists(filename):
+            with open(filename) as manifest_file:
+                manifest.update(json.load(manifest_file))
+        return manifest
+
+    def save(self):
+        """Write the manifest back, keys are sorted for stable diffs."""
+        log.info('Writing manifest to %s', self.filename)
+        with open(self.filename, 'w') as manifest_file:
+            json.dump(self, manifest_file, indent=2, sort_keys=True)
+            manifest_file.write('\n')
+
+
+def hash_rows(filename, partition_by=None):
+    """
+    Return `(file_hash, partitions_hashes, rows_hashes)` of a CSV file.
+
+    Rows hashes are indexed by `id`, partitions hashes by the result of
+    the `partition_by` function applied to each row (if any).
+    """
+    file_hash = hashlib.sha256()
+    partitions = {}
+    rows = {}
+    with open(filename, 'rb') as csv_file:
+        for line in csv_file:
+            file_hash.update(line)
+    with open(filename) as csv_file:
+        reader = csv.DictReader(csv_file)
+        for row in reader:
+            # Explicit order of columns, whatever the type of `row`.
+            content = '\x1f'.join(
+                row[field] for field in reader.fieldnames).encode('utf-8')
+            rows[row['id']] = hashlib.sha256(content).hexdigest()
+            if partition_by is not None:
+                key = partition_by(row)
+                if key not in partitions:
+                    partitions[key] = hashlib.sha256()
+                partitions[key].update(content)
+    partitions = {key: partition.hexdigest()
+                  for key, partition in sorted(partitions.items())}
+    return file_hash.hexdigest(), partitions, rows
+
+
+def delta_filename_for(filename):
+    """Return the delta filename of a given export `filename`."""
+    filepath, extension = os.path.splitext(filename)
+    return filepath + '.delta' + extension
+
+
+def write_delta_on(filename, previous_rows, rows):
+    """Write the `filename` listing added, removed and modified ids."""
+    log.info('Writing delta file to %s', filename)
+    with open(filename, 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=DELTA_FIELDS)
+        writer.writeheader()
+        for id_, row_hash in rows.items():
+            if id_ not in previous_rows:
+                writer.writerow({'id': id_, 'change': ADDED})
+            elif previous_rows[id_] != row_hash:
+                writer.writerow({'id': id_, 'change': MODIFIED})
+        for id_ in previous_rows:
+            if id_ not in rows:
+                writer.writerow({'id': id_, 'change': REMOVED})
+
+
+def write_incrementally(filename, write, manifest=None, partition_by=None,
+                        delta=True):
+    """
+    Call `write(filename)` only replacing the file if its content changed.
+
+    Without `manifest`, the file is written directly. Otherwise the delta
+    (unless `delta` is false, e.g. for previews) and the manifest entry
+    are updated for changed files, the manifest entry of a file also
+    references the hash of the file the delta was computed from
+    (`delta_from`).
+    """
+    if manifest is None:
+        write(filename)
+        return
+    temporary_filename = filename + '.tmp'
+    write(temporary_filename)
+    file_hash, partitions, rows = hash_rows(temporary_filename, partition_by)
+    previous_hash, previous_rows = None, {}
+    if os.path.exists(filename):
+        previous_hash, _, previous_rows = hash_rows(filename)
+    if previous_hash == file_hash:
+        log.info('Unchanged file %s, keeping the previous one', filename)
+        os.remove(temporary_filename)
+        if filename in manifest:
+            return
+        delta_filename = previous_hash = None
+    else:
+        if delta:
+            delta_filename = delta_filename_for(filename)
+            write_delta_on(delta_filename, previous_rows, rows)
+        else:
+            delta_filename = previous_hash = None
+        os.replace(temporary_filename, filename)
+    manifest[filename] = {
+        'sha256': file_hash,
+        'partitions': partitions,
+        'delta': delta_filename,
+        'delta_from': previous_hash,
+    }
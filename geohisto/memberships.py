@@ -0,0 +1,102 @@
+"""
+Temporal index of towns memberships to intercommunalities.
+
+For each town id and each INSEE code, membership intervals are stored
+as sorted arrays of start and end ordinals (intercommunalities' dates
+are inclusive), allowing point and range queries with a binary search
+instead of scanning all versions and their towns:
+
+    memberships = MembershipIndex(intercommunalities)
+    memberships.at('01001', date(2010, 1, 1))
+    # 'fr:epci:240100883@2010-01-01'
+
+A town belongs to at most one intercommunality at a time.
+"""
+import logging
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
+
+from .utils import depcom_from_id
+
+log = logging.getLogger(__name__)
+
+
+def to_ordinal(date_):
+    """Convert a `date` (or a `datetime`) to its proleptic ordinal."""
+    if isinstance(date_, datetime):
+        date_ = date_.date()
+    return date_.toordinal()
+
+
+class MembershipIndex:
+    """
+    Membership intervals indexed by town id and by INSEE code.
+
+    Keys are either town ids (`fr:commune:01001@1942-01-01`) or INSEE
+    codes (`01001`), values are intercommunalities ids.
+    """
+
+    def __init__(self, intercommunalities):
+        intervals = defaultdict(list)
+        for item in intercommunalities.values():
+            interval = (item.start_date.toordinal(),
+                        item.end_date.toordinal(), item.id)
+            for town_id in item.towns:
+                intervals[town_id].append(interval)
+                intervals[depcom_from_id(town_id)].append(interval)
+        self.starts = {}
+        self.ends = {}
+        self.ids = {}
+        for key, key_intervals in intervals.items():
+            key_intervals.sort()
+            self.starts[key] = array('l', (start for start, _, _
+                                           in key_intervals))
+            self.ends[key] = array('l', (end for _, end, _
+                                         in key_intervals))
+            self.ids[key] = tuple(id_ for _, _, id_ in key_intervals)
+        log.info('Indexed memberships of %s towns and INSEE codes',
+                 len(self.ids))
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def at(self, key, date_):
+        """
+        Return the intercommunality id the town was member of at `date_`.
+
+        Return `None` if the town was not member of any intercommunality.
+        """
+        return self._at(key, to_ordinal(date_))
+
+    def _at(self, key, ordinal):
+        starts = self.starts.get(key)
+        if starts is None:
+            return None
+        index = bisect_right(starts, ordinal) - 1
+        if index >= 0 and self.ends[key][index] >= ordinal:
+            return self.ids[key][index]
+        return None
+
+    def between(self, key, from_date, to_date):
+        """
+        Return the intercommunalities ids the town was member of
+        between `from_date` and `to_date` (included), chronologically.
+        """
+        if key not in self.ids:
+            return []
+        # Intervals do not overlap so ends are sorted too.
+        first = bisect_left(self.ends[key], to_ordinal(from_date))
+        last = bisect_right(self.starts[key], to_ordinal(to_date))
+        return list(self.ids[key][first:last])
+
+    def bulk_at(self, keys, date_):
+        """Return a `{key: intercommunality id}` dict of many towns."""
+        ordinal = to_ordinal(date_)
+        return {key: self._at(key, ordinal) for key in keys}
+
+    def bulk_between(self, keys, from_date, to_date):
+        """Return a `{key: [intercommunalities ids]}` dict of many towns."""
+        return {key: self.between(key, from_date, to_date) for key in keys}
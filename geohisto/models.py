@@ -1,7 +1,10 @@
 import logging
 
-from datetime import date
+from array import array
+from bisect import bisect_left
+from datetime import date, timedelta
 from collections import OrderedDict, namedtuple, defaultdict
+from operator import attrgetter
 
 from .constants import DELTA, START_DATETIME, END_DATE
 from .constants import INTERCOMMUNALITY_INNER_CHANGE
@@ -9,6 +12,7 @@ from .constants import INTERCOMMUNALITY_KIND_CHANGE
 from .constants import INTERCOMMUNALITY_RENAMED
 from .constants import INTERCOMMUNALITY_START_DATE
 from .constants import INTERCOMMUNALITY_TAXMODEL_CHANGE
+from .populations import NULL_POPULATION
 
 log = logging.getLogger(__name__)
 
@@ -56,12 +60,15 @@ class CollectionMixin:
         """
         Return a list of items with the given filters applied.
 
-        Useful to look up by `depcom`, `nccenr` and so on.
+        Useful to look up by `depcom`, `nccenr` and so on, items
+        have to match all the given filters. Filters are applied in
+        turn, most look ups being a single `depcom` over all towns.
         """
-        return (item
-                for item in self.values()
-                for k, v in filters.items()
-                if getattr(item, k) == v)
+        items = self.values()
+        for key, value in filters.items():
+            get = attrgetter(key)
+            items = [item for item in items if get(item) == value]
+        return iter(items)
 
     def with_successors(self):
         """Return a generator of Towns having successors."""
@@ -120,6 +127,10 @@ class Item:
         """Update the parents."""
         return self._replace(**{'parents': parents})
 
+    def set_censuses(self, censuses):
+        """Update the `{census: population}` of censuses."""
+        return self._replace(**{'censuses': censuses})
+
     def add_ancestor(self, ancestor):
         """Append the given ancestor to the current list if any."""
         if self.ancestors:
@@ -167,7 +178,7 @@ class Town(Item,
                       'id', 'actual', 'modification', 'successors',
                       'ancestors', 'start_date', 'end_date', 'start_datetime',
                       'end_datetime', 'dep', 'com', 'nccenr', 'depcom',
-                      'population', 'parents'])):
+                      'population', 'parents', 'censuses'])):
     """Inherit from a namedtuple with empty slots for performances."""
     __slots__ = ()
 
@@ -246,12 +257,184 @@ Record = namedtuple('Record', [
 ])
 
 
+# Compact representation of an EPCI parsed from a year file,
+# independent from towns (only INSEE codes of members are kept).
+# The `fingerprint` is a digest of name, kind, tax model and members.
+IntercommunalityRecord = namedtuple('IntercommunalityRecord', [
+    'siren', 'name', 'acronym', 'kind', 'taxmodel', 'population', 'insees',
+    'ptots', 'pmuns', 'fingerprint'
+])
+
+
+class TownTable:
+    """
+    Integer indexes of towns ids shared by intercommunalities members.
+
+    Identical members are interned: consecutive versions of a SIREN
+    with the same towns share the very same `Members` instance.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.indexes = {}
+        self.interned = {}
+
+    def index(self, town_id):
+        """Return the integer index of `town_id`, registering it if new."""
+        try:
+            return self.indexes[town_id]
+        except KeyError:
+            self.indexes[town_id] = len(self.ids)
+            self.ids.append(town_id)
+            return self.indexes[town_id]
+
+    def members(self, town_ids):
+        """Return the (interned) `Members` of the given `town_ids`."""
+        members = Members(self, array('l', sorted(set(
+            self.index(town_id) for town_id in town_ids))))
+        return self.interned.setdefault(members, members)
+
+
+class Members:
+    """
+    Immutable set of towns ids stored as a sorted array of integers.
+
+    It behaves like a set of ids (iteration, length, membership and
+    comparison with other sets) but comparing two members of the same
+    table is only a comparison of two integer arrays.
+    """
+    __slots__ = ('table', 'indexes')
+
+    def __init__(self, table, indexes):
+        self.table = table
+        self.indexes = indexes
+
+    def __iter__(self):
+        ids = self.table.ids
+        return (ids[index] for index in self.indexes)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __contains__(self, town_id):
+        index = self.table.indexes.get(town_id)
+        if index is None:
+            return False
+        position = bisect_left(self.indexes, index)
+        return (position < len(self.indexes) and
+                self.indexes[position] == index)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, Members) and other.table is self.table:
+            return self.indexes == other.indexes
+        if isinstance(other, (Members, set, frozenset)):
+            return set(self) == set(other)
+        return NotImplemented
+
+    def __hash__(self):
+        # Consistent with `__eq__`: equal to members of another table
+        # or to a frozenset of the same ids.
+        return hash(frozenset(self))
+
+    def __repr__(self):
+        return '<Members {0}>'.format(sorted(self))
+
+
+class TownPopulations:
+    """
+    Yearly populations of towns as given by intercommunalities files.
+
+    It is a (town × year) matrix whose rows are the towns of a
+    `TownTable`: there is one array of integers per kind (`ptot` or
+    `pmun`) and year, unknown populations being `NULL_POPULATION`.
+    """
+    KINDS = ('ptot', 'pmun')
+
+    def __init__(self, table):
+        self.table = table
+        self.columns = {}
+
+    @property
+    def years(self):
+        return sorted(set(year for _, year in self.columns))
+
+    def column(self, year, kind='pmun'):
+        """Return the column of `kind` for `year`, sized to the table."""
+        column = self.columns.setdefault((kind, year), array('l'))
+        missing = len(self.table.ids) - len(column)
+        if missing > 0:
+            column.extend([NULL_POPULATION] * missing)
+        return column
+
+    def set(self, town_id, year, ptot, pmun):
+        """
+        Set both populations of `town_id` for the given `year`.
+
+        Unknown (`None`) populations are stored as `NULL_POPULATION`.
+        """
+        index = self.table.index(town_id)
+        self.column(year, 'ptot')[index] = (
+            NULL_POPULATION if ptot is None else ptot)
+        self.column(year, 'pmun')[index] = (
+            NULL_POPULATION if pmun is None else pmun)
+
+    def get(self, town_id, year, kind='pmun'):
+        """Return the population of `town_id` in `year`, `None` if unknown."""
+        index = self.table.indexes.get(town_id)
+        column = self.columns.get((kind, year), ())
+        if index is None or index >= len(column):
+            return None
+        population = column[index]
+        return None if population == NULL_POPULATION else population
+
+    def series(self, town_id, kind='pmun'):
+        """Return the known `(year, population)` of `town_id` by year."""
+        series = ((year, self.get(town_id, year, kind)) for year in self.years)
+        return [(year, population) for year, population in series
+                if population is not None]
+
+    def sum(self, members, year, kind='pmun'):
+        """
+        Return the total population of `members` in `year`.
+
+        Only known populations are summed, `None` if none is known.
+        """
+        column = self.column(year, kind)
+        populations = [column[index] for index in members.indexes]
+        known = [population for population in populations
+                 if population != NULL_POPULATION]
+        return sum(known) if known else None
+
+
 class Intercommunalities(CollectionMixin, defaultdict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Members of all versions are indexed over a single table.
+        self.town_table = TownTable()
+        # Yearly populations of member towns over the same table.
+        self.town_populations = TownPopulations(self.town_table)
+        # Ids of currently valid intercommunalities indexed by SIREN.
+        self.current_ids = {}
+
+    def __setitem__(self, id, item):
+        """Keep track of current intercommunalities on insertion."""
+        if item.end_date == END_DATE:
+            self.current_ids[item.siren] = id
+        elif self.current_ids.get(item.siren) == id:
+            del self.current_ids[item.siren]
+        super().__setitem__(id, item)
+
+    def __delitem__(self, id):
+        if self.current_ids.get(self[id].siren) == id:
+            del self.current_ids[self[id].siren]
+        super().__delitem__(id)
+
     def latest(self, siren):
         """Get the latest valid intercommunality for a given `siren`."""
-        # No need to sort, there is theoricaly only one town
-        # with a given siren at a time
-        return next(self.filter(siren=siren, end_date=END_DATE))
+        # There is only one intercommunality with a given siren at a time.
+        return self[self.current_ids[siren]]
 
     def valid_at(self, valid_date, siren=None):
         """
@@ -266,11 +449,38 @@ class Intercommunalities(CollectionMixin, defaultdict):
 
     @property
     def open_sirens(self):
-        return set(item.siren for item in self.filter(end_date=END_DATE))
+        return set(self.current_ids)
 
-    def ends(self, siren, year, reason):
+    def ends(self, siren, year, reason, successors=None, overlaps=None):
         intercommunality = self.latest(siren)
-        self.upsert(intercommunality.end_on(year, reason))
+        intercommunality = intercommunality.end_on(year, reason, successors,
+                                                   overlaps)
+        self.upsert(intercommunality)
+        return intercommunality
+
+    def add_ancestor(self, id, ancestor_id):
+        intercommunality = self[id]
+        self.upsert(intercommunality._replace(
+            ancestors=intercommunality.ancestors + [ancestor_id]))
+
+    def update_towns(self, siren, start_date, towns):
+        """
+        Create an intermediate version of `siren` with new `towns`.
+
+        Useful when member towns change within a year, the current
+        version ends the day before `start_date`.
+        """
+        current = self.latest(siren)
+        if towns == current.towns:
+            return False
+        intercommunality = current._replace(
+            towns=towns, successors=[], overlaps=[], end_date=END_DATE,
+            end_reason=None).create_at(start_date, [current.id])
+        self.upsert(current.end_at(start_date - timedelta(days=1),
+                                   INTERCOMMUNALITY_INNER_CHANGE,
+                                   [intercommunality.id]))
+        self.upsert(intercommunality)
+        return True
 
     def update(self, intercommunality, year):
         current = self.latest(intercommunality.siren)
@@ -291,7 +501,10 @@ class Intercommunalities(CollectionMixin, defaultdict):
         if changes:
             changes = ';'.join(changes)
             intercommunality = intercommunality.create_on(year, [current.id])
-            self.upsert(current.end_on(year, changes, [intercommunality.id]))
+            # The current version ends on December 31st of the previous
+            # year, the day before its successor, they do not overlap.
+            self.upsert(current.end_on(year - 1, changes,
+                                       [intercommunality.id]))
             self.upsert(intercommunality)
             return True
         return False
@@ -306,13 +519,14 @@ class Intercommunality(Item, namedtuple(
             'kind',  # One of CC, CA, CU, CV, DISTRICT, METRO, METRO69, SAN
             'successors',  # List of successors identifiers
             'ancestors',  # List of ancestors identifiers
-            'towns',  # Set of components towns identifiers
+            'towns',  # Set or `Members` of components towns identifiers
             'missing_towns',  # Set of towns INSEE code not matched to a town
             'start_date',  # Start validity date
             'end_date',  # End validity date
             'end_reason',  # Reason this intercommunality is ended. See above
             'taxmodel',  # One of 4TX, TPU, FA, FPU
             'population',  # Known population from last census
+            'overlaps',  # Share of member towns absorbed by each successor
         ])):
     """
     Represents a French intercommunality or EPCI in French
@@ -334,6 +548,7 @@ class Intercommunality(Item, namedtuple(
         kwargs.setdefault('population', None)
         # Don't use setdefault on values which are mutable
         kwargs['successors'] = kwargs.get('successors', [])
+        kwargs['overlaps'] = kwargs.get('overlaps', [])
         kwargs['ancestors'] = kwargs.get('ancestors', [])
         kwargs['towns'] = kwargs.get('towns', set([]))
         kwargs['missing_towns'] = kwargs.get('missing_towns', set([]))
@@ -347,23 +562,36 @@ class Intercommunality(Item, namedtuple(
         (intercommunalities are only created or modified on the 1st january)
         Optionnal ancestors can be provided in case of change.
         """
-        start_date = date(year, 1, 1)
+        return self.create_at(date(year, 1, 1), ancestors)
+
+    def create_at(self, start_date, ancestors=None):
+        """
+        Same as `create_on` but from any `start_date`.
+
+        Useful for intermediate states due to towns changes within a year.
+        """
         id = 'fr:epci:{0}@{1}'.format(self.siren, start_date)
         return self._replace(id=id, start_date=start_date,
                              ancestors=ancestors or [])
 
-    def end_on(self, year, reason, successors=None):
+    def end_on(self, year, reason, successors=None, overlaps=None):
         """
         Instanciate a new intercommunality with end date and reason defined.
 
         Values are populated from the given year
         (intercommunalities are only created or modified on the 1st january
         so close has to be on the 31st december from the previous year)
-        Optionnal successors can be provided in case of change.
+        Optionnal successors can be provided in case of change,
+        with their respective overlaps in case of merge.
         """
-        return self._replace(end_date=date(year, 12, 31),
+        return self.end_at(date(year, 12, 31), reason, successors, overlaps)
+
+    def end_at(self, end_date, reason, successors=None, overlaps=None):
+        """Same as `end_on` but at any (included) `end_date`."""
+        return self._replace(end_date=end_date,
                              end_reason=reason,
-                             successors=successors or [])
+                             successors=successors or [],
+                             overlaps=overlaps or [])
 
     @property
     def start_datetime(self):
@@ -0,0 +1,128 @@
+"""
+Random access to the rows of a given SIREN within an EPCI year file.
+
+A JSON index is stored next to each year file (`2017.csv.idx`), mapping
+each SIREN to the byte offset and length of its contiguous rows. It is
+built once and validated against the SHA-256 hash of the year file, any
+change of the source leading to a rebuild. The hash is only computed
+again if the size or the modification time of the file changed.
+
+Readers `mmap` the year file and only decode the requested rows,
+reading kilobytes instead of the whole file.
+"""
+import csv
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+
+log = logging.getLogger(__name__)
+
+
+def index_filename_for(filename):
+    """Return the offsets index filename of a given year `filename`."""
+    return filename + '.idx'
+
+
+def hash_file(filename):
+    """Return the SHA-256 hex digest of `filename`."""
+    file_hash = hashlib.sha256()
+    with open(filename, 'rb') as source:
+        for chunk in iter(lambda: source.read(1 << 16), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def build_offsets(filename):
+    """
+    Return the offsets index of `filename` as a dict.
+
+    Rows of a given SIREN are expected to be contiguous (rows
+    themselves should not contain line breaks), a `ValueError`
+    is raised otherwise.
+    """
+    sirens = {}
+    with open(filename, 'rb') as source:
+        header = source.readline()
+        offset = len(header)
+        siren = None
+        for line in source:
+            line_siren = line.split(b';', 1)[0].strip(b'"').decode('utf-8')
+            if line_siren != siren:
+                if line_siren in sirens:
+                    raise ValueError('{filename}: rows of {siren} are not '
+                                     'contiguous'.format(filename=filename,
+                                                         siren=line_siren))
+                sirens[line_siren] = [offset, 0]
+                siren = line_siren
+            sirens[siren][1] += len(line)
+            offset += len(line)
+    stat = os.stat(filename)
+    return {
+        'sha256': hash_file(filename),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'header': [0, len(header)],
+        'sirens': sirens,
+    }
+
+
+def write_offsets(index_filename, offsets):
+    """Write the `offsets` index to `index_filename`."""
+    log.debug('Writing offsets index to %s', index_filename)
+    with open(index_filename, 'w') as index_file:
+        json.dump(offsets, index_file)
+
+
+def load_offsets(filename):
+    """
+    Return the offsets index of `filename`, (re)building it if needed.
+
+    The index is rebuilt if it does not exist or if the hash of
+    `filename` changed since it has been built. If only the size or
+    the modification time changed, they are updated in the index to
+    keep skipping the hash on later loads.
+    """
+    index_filename = index_filename_for(filename)
+    if os.path.exists(index_filename):
+        with open(index_filename) as index_file:
+            offsets = json.load(index_file)
+        stat = os.stat(filename)
+        if (offsets['size'], offsets['mtime']) == (stat.st_size,
+                                                   stat.st_mtime):
+            return offsets
+        if offsets['sha256'] == hash_file(filename):
+            offsets.update(size=stat.st_size, mtime=stat.st_mtime)
+            write_offsets(index_filename, offsets)
+            return offsets
+        log.info('%s changed, rebuilding its offsets index', filename)
+    offsets = build_offsets(filename)
+    write_offsets(index_filename, offsets)
+    return offsets
+
+
+def read_rows(filename, sirens, offsets=None, **reader_options):
+    """
+    Return `{siren: rows}` of the given `sirens` of `filename`.
+
+    Rows are dicts, as returned by `csv.DictReader`, unknown SIRENs are
+    omitted. You can pass already loaded `offsets` to avoid validating
+    the index for each lookup.
+    """
+    offsets = offsets or load_offsets(filename)
+    results = {}
+    with open(filename, 'rb') as source, \
+            mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start, length = offsets['header']
+        header = data[start:start + length].decode('utf-8')
+        fieldnames = next(csv.reader(io.StringIO(header), **reader_options))
+        for siren in sirens:
+            if siren not in offsets['sirens']:
+                continue
+            start, length = offsets['sirens'][siren]
+            content = io.StringIO(data[start:start + length].decode('utf-8'))
+            results[siren] = list(csv.DictReader(
+                content, fieldnames=fieldnames, **reader_options))
+    return results
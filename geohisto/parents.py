@@ -1,16 +1,132 @@
+"""
+Temporal resolution of towns parents.
+
+Counties versions of each INSEE code do not overlap, their validity
+intervals are stored as sorted lists of starts and ends, allowing to
+retrieve the versions overlapping any interval with binary searches.
+Regions are resolved the same way through the `parents` of counties
+and the transitive `successors` of these regions.
+"""
 import logging
 
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from .constants import DELTA, END_DATETIME
+from .utils import depcom_to_dep, split_ids
+
 log = logging.getLogger(__name__)
 
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def validity_of(line):
+    """Return the validity `(start, end)` of a county or region line."""
+    start = datetime.strptime(line['start_datetime'], DATETIME_FORMAT)
+    end = datetime.strptime(line['end_datetime'], DATETIME_FORMAT)
+    # Exported end datetimes are truncated to the second.
+    return start, end.replace(microsecond=END_DATETIME.microsecond)
+
+
+def with_successors(ids, successors):
+    """Return `ids` followed by their transitive `successors`, once."""
+    found = []
+    stack = list(reversed(ids))
+    while stack:
+        id_ = stack.pop()
+        if id_ in found:
+            continue
+        found.append(id_)
+        stack.extend(reversed(successors.get(id_, [])))
+    return found
+
+
+class CountyIndex:
+    """
+    Validity intervals of counties indexed by INSEE code.
+
+    If `regions` (as returned by `load_regions`) are given, regions of
+    counties are resolved with their own validity too. Counties only
+    list the regions they belonged to when exported, successors of
+    these regions (renamed or merged ones, e.g. Centre-Val de Loire in
+    2015) are regions of the county too.
+    """
+
+    def __init__(self, counties, regions=None):
+        successors = {region_id: split_ids(line['successors'])
+                      for region_id, line in (regions or {}).items()}
+        self.validities = {}
+        self.ancestors = {}
+        self.regions = {}
+        self.starts = {}
+        self.ends = {}
+        self.ids = {}
+        for code, lines in counties.items():
+            intervals = sorted(validity_of(line) + (line['id'],)
+                               for line in lines)
+            self.starts[code] = [start for start, _, _ in intervals]
+            self.ends[code] = [end for _, end, _ in intervals]
+            self.ids[code] = [id_ for _, _, id_ in intervals]
+            for line in lines:
+                self.ancestors[line['id']] = split_ids(line['ancestors'])
+                self.validities[line['id']] = validity_of(line)
+                self.regions[line['id']] = with_successors(
+                    split_ids(line['parents']), successors)
+        for region_id, line in (regions or {}).items():
+            self.validities[region_id] = validity_of(line)
+
+    def overlapping(self, code, start, end):
+        """Return ids of counties of `code` overlapping `start`-`end`."""
+        if code not in self.ids:
+            return []
+        # Intervals do not overlap so ends are sorted too.
+        first = bisect_left(self.ends[code], start)
+        last = bisect_right(self.starts[code], end)
+        return self.ids[code][first:last]
+
+    def overlaps(self, id_, start, end):
+        """Check that the county or region `id_` overlaps `start`-`end`."""
+        return (id_ in self.validities and
+                self.validities[id_][0] <= end and
+                start <= self.validities[id_][1])
+
+    def parents_of(self, code, start, end):
+        """
+        Return ids of counties of a town of `code` within `start`-`end`.
+
+        Before the creation of their county code (e.g. `2A` in 1976),
+        towns get the overlapping ancestors of that county, followed
+        by the versions of their code for the rest of their validity.
+        """
+        parents = self.overlapping(code, start, end)
+        if code not in self.ids or start >= self.starts[code][0]:
+            return parents
+        first_id = self.ids[code][0]
+        before = min(end, self.starts[code][0] - DELTA)
+        return [ancestor_id for ancestor_id in self.ancestors[first_id]
+                if self.overlaps(ancestor_id, start, before)] + parents
+
+    def regions_of(self, county_id, start, end):
+        """Return ids of regions of `county_id` overlapping `start`-`end`."""
+        return [region_id for region_id in self.regions[county_id]
+                if self.overlaps(region_id, start, end)]
+
 
 def compute_parents(counties, towns):
-    """Update the parents for each town."""
+    """
+    Update the parents for each town.
+
+    Only counties versions overlapping the validity of each town
+    version are kept. Parents are computed once per county code and
+    validity, most towns sharing the same ones.
+    """
     log.info('Updating parents')
-    for _, town in towns.items():
-        dep = town.depcom[:2]
-        if dep == '97':  # DROM have 3-digits codes.
-            dep = town.depcom[:3]
-        parents = ';'.join(county['id'] for county in counties[dep])
-        town = town.set_parents(parents)
-        towns.upsert(town)
+    index = CountyIndex(counties)
+    parents = {}
+    for town in towns.values():
+        key = (depcom_to_dep(town.depcom), town.start_datetime,
+               town.end_datetime)
+        if key not in parents:
+            parents[key] = ';'.join(index.parents_of(*key))
+        towns.upsert(town.set_parents(parents[key]))
     return towns
@@ -1,62 +1,276 @@
-def compute_population(populations, population_id,
-                       towns, town=None, key='metropole'):
+import logging
+
+from array import array
+from datetime import date, datetime
+from operator import attrgetter
+
+from .utils import split_ids
+
+log = logging.getLogger(__name__)
+
+# Census columns available in sources (not all sources have all
+# columns) with their reference dates, the first one is the default.
+CENSUSES = (
+    ('PMUN13', date(2013, 1, 1)),
+    ('PMUN08', date(2008, 1, 1)),
+    ('PSDC99', date(1999, 1, 1)),
+    ('PSDC90', date(1990, 1, 1)),
+    ('PSDC82', date(1982, 1, 1)),
+    ('PSDC74', date(1974, 1, 1)),
+    ('PSDC67', date(1967, 1, 1)),
+    ('PSDC61', date(1961, 1, 1)),
+)
+CENSUS_NAMES = tuple(census for census, _ in CENSUSES)
+CENSUS_DATES = dict(CENSUSES)
+DEFAULT_CENSUS = CENSUS_NAMES[0]
+
+# Sources of populations by precedence, dead towns are handled apart.
+POPULATION_SOURCES = ('metropole', 'arrondissements', 'dom')
+
+# Arrays of integers cannot hold `None`.
+NULL_POPULATION = -1
+
+
+class PopulationStore:
+    """
+    Populations of all censuses, stored as one column per census.
+
+    Rows are indexed by `depcom` + name keys and columns are arrays of
+    integers, unknown populations being stored as `NULL_POPULATION`.
+    """
+
+    def __init__(self, censuses=CENSUS_NAMES):
+        self.censuses = tuple(censuses)
+        self.index = {}
+        self.columns = {census: array('l') for census in self.censuses}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def fill(self, key, census, population):
+        """Set the `population` of `key` for `census` if still unknown."""
+        if key not in self.index:
+            self.index[key] = len(self.index)
+            for column in self.columns.values():
+                column.append(NULL_POPULATION)
+        column = self.columns[census]
+        if column[self.index[key]] == NULL_POPULATION:
+            column[self.index[key]] = population
+
+    def get(self, key, census=DEFAULT_CENSUS):
+        """Return the population of `key` for `census`, `None` if unknown."""
+        if key not in self.index:
+            return None
+        population = self.columns[census][self.index[key]]
+        return None if population == NULL_POPULATION else population
+
+    def row(self, key):
+        """Return the populations of `key` for all censuses as a list."""
+        if key not in self.index:
+            return [None] * len(self.censuses)
+        return [self.get(key, census) for census in self.censuses]
+
+
+def index_populations(populations):
+    """
+    Merge the `populations` dicts into a single `PopulationStore`.
+
+    Each source is a `{key: {census: population}}` dict. Sources are
+    merged by precedence (see `POPULATION_SOURCES`), null populations
+    are skipped. Listed dead towns (`mortes`) get a population of `0`
+    for the default census: it is only used if no population can be
+    computed from ancestors.
+    """
+    store = PopulationStore()
+    for source in POPULATION_SOURCES:
+        for key, censuses in populations[source].items():
+            for census, population in censuses.items():
+                if int(population):
+                    store.fill(key, census, int(population))
+    for key in populations['mortes']:
+        store.fill(key, DEFAULT_CENSUS, 0)
+    return store
+
+
+def renamed_successor(towns, town):
+    """
+    Return the id of the successor of `town` if it is only renamed.
+
+    It has the same INSEE code and `town` as single ancestor, hence
+    the same territory, `None` otherwise.
+    """
+    successors = split_ids(town.successors)
+    if len(successors) != 1 or successors[0] not in towns:
+        return None
+    successor = towns[successors[0]]
+    if (successor.depcom != town.depcom or
+            split_ids(successor.ancestors) != [town.id]):
+        return None
+    return successor.id
+
+
+def lookup_populations(towns, store):
+    """
+    Return populations of the `store` of all `towns` versions.
+
+    Populations are lists with a value per census of the `store`,
+    retrieved using the `depcom` + `nccenr` key of each version.
+    Sources being keyed by current names, censuses performed within
+    the validity of a version renamed later are retrieved from the
+    renamed version (same territory) if missing.
+    """
+    census_datetimes = [
+        datetime.combine(CENSUS_DATES[census], datetime.min.time())
+        for census in store.censuses]
+    rows = {}
+    # Renamed versions are looked up before the versions they replace.
+    for town in sorted(towns.values(), key=attrgetter('start_datetime'),
+                       reverse=True):
+        populations = store.row(town.depcom + town.nccenr)
+        successor_id = renamed_successor(towns, town)
+        if successor_id is not None and None in populations:
+            populations = [
+                renamed if population is None and town.valid_at(census_at)
+                else population
+                for population, renamed, census_at in zip(
+                    populations, rows[successor_id], census_datetimes)]
+        rows[town.id] = populations
+    return rows
+
+
+def sort_by_ancestors(towns):
+    """
+    Return ids of `towns` sorted topologically, ancestors first.
+
+    Performed with an explicit stack, ancestors being visited (cycles)
+    are ignored with a warning.
+    """
+    order = []
+    visiting = set()
+    done = set()
+    for town_id in towns:
+        stack = [(town_id, False)]
+        while stack:
+            town_id, expanded = stack.pop()
+            if expanded:
+                visiting.discard(town_id)
+                done.add(town_id)
+                order.append(town_id)
+                continue
+            if town_id in visiting or town_id in done:
+                continue
+            visiting.add(town_id)
+            stack.append((town_id, True))
+            for ancestor_id in split_ids(towns[town_id].ancestors):
+                if ancestor_id in visiting:
+                    log.warning('Cycle of ancestors from %s to %s',
+                                town_id, ancestor_id)
+                elif ancestor_id in towns and ancestor_id not in done:
+                    stack.append((ancestor_id, False))
+    return order
+
+
+def resolve_populations(towns, store):
+    """
+    Return populations of all `towns` as `{town id: populations}`.
+
+    Populations are lists with a value per census of the `store`,
+    looked up for each version (see `lookup_populations`). If missing
+    (or null), it is the sum of populations of ancestors (renames +
+    merges) for that census, themselves resolved the same way. Unknown
+    ones are `None`.
+
+    Towns are sorted once in topological order over ancestors, then
+    each census is resolved as an array column in a single pass: it is
+    linear in the number of towns plus ancestors relations.
     """
-    Retrieve the population from `populations` dict cast as an integer.
+    rows = lookup_populations(towns, store)
+    order = sort_by_ancestors(towns)
+    positions = {town_id: position for position, town_id in enumerate(order)}
+    # Only ancestors sorted before (not within a cycle) are summed.
+    ancestors = [
+        [positions[ancestor_id]
+         for ancestor_id in split_ids(towns[town_id].ancestors)
+         if positions.get(ancestor_id, position) < position]
+        for position, town_id in enumerate(order)]
+    columns = []
+    for index in range(len(store.censuses)):
+        column = array('l', (
+            NULL_POPULATION if rows[town_id][index] is None
+            else rows[town_id][index] for town_id in order))
+        for position, ancestor_positions in enumerate(ancestors):
+            if column[position] > 0 or not ancestor_positions:
+                continue
+            total = sum(column[ancestor] for ancestor in ancestor_positions
+                        if column[ancestor] > 0)
+            if total:
+                column[position] = total
+        columns.append(column)
+    return {
+        town_id: [None if column[position] == NULL_POPULATION
+                  else column[position] for column in columns]
+        for position, town_id in enumerate(order)
+    }
 
-    Fallback on `arrondissements` and `dom` if no population is found.
-    Finally, a population of `0` is added for listed dead towns.
-    In case of unknown population the value `NULL` is returned.
 
-    If the `population_id` is missing and `town` is available, we try
-    to compute the population based on ancestors (renames + merges).
-    The `key` is useful for the recursivity of the function in order to
-    explore different `populations` sub-dictionnaries.
+def compute_populations(store, towns, census=DEFAULT_CENSUS,
+                        resolved=None):
+    """
+    Update the population for each town.
+
+    The population of the given `census` is used, whatever the validity
+    of the town, see `compute_census_populations` otherwise. Populations
+    already `resolved` by `resolve_populations` can be given to only
+    resolve them once.
 
     WARNING: you have to compute population AFTER computing ancestors.
     """
-    # If the population is already available, return it.
-    population = int(populations[key].get(population_id, 0))
-    if population:
-        return population
-    elif town is None:
-        return 'NULL'
-
-    # Otherwise sum populations from ancestors towns.
-    population = 0
-    if town.ancestors:
-        for ancestor_id in town.ancestors.split(';'):
-            ancestor = towns.retrieve(ancestor_id)
-            population_id = ancestor.depcom + ancestor.nccenr
-            try:
-                population += compute_population(
-                    populations, population_id, towns)
-            except TypeError:  # Returned population equals 'NULL'
-                pass
-
-    if not population:
-        try:
-            population += compute_population(
-                populations, population_id, towns, key='arrondissements')
-        except TypeError:  # Returned population equals 'NULL'
-            pass
-    if not population:
-        try:
-            population += compute_population(
-                populations, population_id, towns, key='dom')
-        except TypeError:  # Returned population equals 'NULL'
-            pass
-    if not population and population_id not in populations['mortes']:
-        population = 'NULL'
-
-    return population
-
-
-def compute_populations(populations, towns):
-    """Update the population for each town."""
-    for _, town in towns.items():
-        population_id = town.depcom + town.nccenr
-        population = compute_population(
-            populations, population_id, towns, town)
-        town = town.set_population(population)
-        towns.upsert(town)
+    log.info('Computing populations')
+    index = store.censuses.index(census)
+    if resolved is None:
+        resolved = resolve_populations(towns, store)
+    for town_id, populations in resolved.items():
+        towns.upsert(towns[town_id].set_population(populations[index]))
+    return towns
+
+
+def compute_census_populations(store, towns, resolved=None):
+    """
+    Set the `censuses` of each town to `{census: population}`.
+
+    Only censuses performed within the validity of each town version
+    are kept. Like `compute_populations`, populations `resolved` by
+    `resolve_populations` can be given.
+    """
+    log.info('Computing censuses populations')
+    if resolved is None:
+        resolved = resolve_populations(towns, store)
+    census_datetimes = [
+        (index, census,
+         datetime.combine(CENSUS_DATES[census], datetime.min.time()))
+        for index, census in enumerate(store.censuses)]
+    for town_id, populations in resolved.items():
+        town = towns[town_id]
+        towns.upsert(town.set_censuses({
+            census: populations[index]
+            for index, census, census_datetime in census_datetimes
+            if town.valid_at(census_datetime)}))
+    return towns
+
+
+def set_census_populations(store, towns, census):
+    """
+    Set the population of each town to the one of the given `census`.
+
+    Towns not valid at the time of the census get a `None` population,
+    useful to export a given census. Censuses are computed first if
+    needed (see `compute_census_populations`).
+    """
+    if any(town.censuses is None for town in towns.values()):
+        compute_census_populations(store, towns)
+    for town in towns.values():
+        towns.upsert(town.set_population(town.censuses.get(census)))
     return towns
@@ -0,0 +1,227 @@
+"""
+Redirections from any historic town to the towns valid at a target date.
+
+Every town id, and thus every (INSEE code, date) pair that ever existed,
+is mapped to the towns valid at the target date (by default the current
+ones) it ended up in. Chains of successors are resolved once with path
+compression: each town directly references its final towns, shared with
+its predecessors.
+
+The table is exported as CSV and as a compact binary file (ids and CSR
+arrays of redirections) for a single lookup per request:
+
+    redirects = load_redirects('exports/communes/redirects.bin')
+    redirects.get('fr:commune:14475@1942-01-01')
+    redirects.at('14475', date(1950, 1, 1))
+"""
+import csv
+import logging
+import struct
+import sys
+
+from array import array
+from bisect import bisect_right
+
+from .constants import END_DATETIME, SEPARATOR
+from .utils import depcom_from_id, split_ids, to_datetime
+
+log = logging.getLogger(__name__)
+
+REDIRECT_FIELDS = (
+    'id', 'insee_code', 'start_datetime', 'end_datetime', 'redirects'
+)
+
+# Magic string, ids count, redirects count and ids blob length.
+BINARY_HEADER = struct.Struct('<4sIII')
+BINARY_MAGIC = b'GHR1'
+
+
+def resolve_redirects(towns, at=END_DATETIME):
+    """
+    Return `{town id: ids of towns valid at `at`}` of all `towns`.
+
+    A town valid `at` redirects to itself, an ended town to the towns
+    valid `at` among its transitive successors (in order, without
+    duplicates), including towns later restored from a valid one, like
+    `Lineage.current`. Towns created after `at` or ended without
+    successors redirect to nothing. Towns are resolved with an explicit
+    stack, each one only once.
+    """
+    at = to_datetime(at)
+    # Towns valid `at` reachable from each town, including itself.
+    reachable = {}
+    for town_id in towns:
+        stack = [(town_id, False)]
+        pending = set()
+        while stack:
+            town_id, expanded = stack.pop()
+            if town_id in reachable:
+                continue
+            town = towns[town_id]
+            successors = [successor_id
+                          for successor_id in split_ids(town.successors)
+                          if successor_id in towns]
+            if town.start_datetime > at:
+                reachable[town_id] = ()
+                continue
+            itself = (town_id,) if town.valid_at(at) else ()
+            if not successors:
+                reachable[town_id] = itself
+                continue
+            if not expanded:
+                # Resolve successors first, then come back to that town.
+                pending.add(town_id)
+                stack.append((town_id, True))
+                stack.extend((successor_id, False)
+                             for successor_id in successors
+                             if successor_id not in reachable and
+                             successor_id not in pending)
+                continue
+            redirects = [reachable.get(successor_id, ())
+                         for successor_id in successors]
+            if len(redirects) == 1 and not itself:
+                # Share the very same tuple along the chain.
+                reachable[town_id] = redirects[0]
+            else:
+                # Keep the first occurrence of each id, in order.
+                seen = set()
+                ids = []
+                for redirect_id in itself + tuple(
+                        redirect_id for redirect_ids in redirects
+                        for redirect_id in redirect_ids):
+                    if redirect_id not in seen:
+                        seen.add(redirect_id)
+                        ids.append(redirect_id)
+                reachable[town_id] = tuple(ids)
+    return {town_id: (town_id,) if towns[town_id].valid_at(at) else ids
+            for town_id, ids in reachable.items()}
+
+
+class RedirectTable:
+    """
+    Redirections of sorted town ids as CSR arrays of ids indexes.
+
+    Ids being sorted, versions of an INSEE code are contiguous and
+    ordered by start date. Each code is indexed as the index of its
+    first version and the sorted start dates of its versions.
+    """
+
+    def __init__(self, ids, offsets, targets):
+        self.ids = ids
+        self.offsets = offsets
+        self.targets = targets
+        self.indexes = {id_: index for index, id_ in enumerate(ids)}
+        self.codes = {}
+        for index, id_ in enumerate(ids):
+            _, starts = self.codes.setdefault(depcom_from_id(id_),
+                                              (index, []))
+            starts.append(id_.split(SEPARATOR, 1)[1])
+
+    @classmethod
+    def from_redirects(cls, redirects):
+        ids = sorted(redirects)
+        indexes = {id_: index for index, id_ in enumerate(ids)}
+        offsets = array('I', [0])
+        targets = array('I')
+        for id_ in ids:
+            targets.extend(indexes[target] for target in redirects[id_])
+            offsets.append(len(targets))
+        return cls(ids, offsets, targets)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, town_id):
+        return town_id in self.indexes
+
+    def _redirects(self, index):
+        return [self.ids[target] for target in
+                self.targets[self.offsets[index]:self.offsets[index + 1]]]
+
+    def get(self, town_id):
+        """Return ids the town `town_id` redirects to, `None` if unknown."""
+        index = self.indexes.get(town_id)
+        return None if index is None else self._redirects(index)
+
+    def at(self, insee_code, date_):
+        """
+        Return ids the town with `insee_code` at `date_` redirects to.
+
+        The version of the town starting last before `date_` is used,
+        `None` if there is none.
+        """
+        if insee_code not in self.codes:
+            return None
+        first, starts = self.codes[insee_code]
+        position = bisect_right(starts, to_datetime(date_).date().isoformat())
+        if not position:
+            return None
+        return self._redirects(first + position - 1)
+
+
+def build_redirects(towns, at=END_DATETIME):
+    """Return the `RedirectTable` of `towns` to towns valid `at`."""
+    log.info('Resolving redirects')
+    return RedirectTable.from_redirects(resolve_redirects(towns, at))
+
+
+def write_redirects_on(filename, towns, table):
+    """Write the redirect `table` of `towns` as CSV to `filename`."""
+    log.info('Writing redirects file to %s', filename)
+    with open(filename, 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=REDIRECT_FIELDS)
+        writer.writeheader()
+        for town_id in table.ids:
+            town = towns[town_id]
+            writer.writerow({
+                'id': town_id,
+                'insee_code': town.depcom,
+                'start_datetime': town.start_datetime,
+                'end_datetime': town.end_datetime.replace(microsecond=0),
+                'redirects': ';'.join(table.get(town_id)),
+            })
+
+
+def little_endian(values):
+    """Return a copy of an `array` in little endian byte order."""
+    values = array(values.typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def write_redirects_binary_on(filename, table):
+    """
+    Write the redirect `table` to `filename` in a compact binary format.
+
+    A header (see `BINARY_HEADER`) is followed by the `\\n`-joined ids
+    then offsets and targets of redirections (indexes of ids), all as
+    little endian 32 bits integers.
+    """
+    log.info('Writing binary redirects file to %s', filename)
+    blob = '\n'.join(table.ids).encode('utf-8')
+    with open(filename, 'wb') as binary:
+        binary.write(BINARY_HEADER.pack(BINARY_MAGIC, len(table.ids),
+                                        len(table.targets), len(blob)))
+        binary.write(blob)
+        little_endian(table.offsets).tofile(binary)
+        little_endian(table.targets).tofile(binary)
+
+
+def load_redirects(filename):
+    """Load a `RedirectTable` written by `write_redirects_binary_on`."""
+    with open(filename, 'rb') as binary:
+        magic, count, targets_count, blob_length = BINARY_HEADER.unpack(
+            binary.read(BINARY_HEADER.size))
+        if magic != BINARY_MAGIC:
+            raise ValueError('{0} is not a redirects file'.format(filename))
+        blob = binary.read(blob_length).decode('utf-8')
+        ids = blob.split('\n') if blob else []
+        offsets = array('I')
+        offsets.fromfile(binary, count + 1)
+        targets = array('I')
+        targets.fromfile(binary, targets_count)
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+        targets.byteswap()
+    return RedirectTable(ids, offsets, targets)
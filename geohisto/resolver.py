@@ -0,0 +1,241 @@
+"""
+Bulk resolution of (INSEE code, date) pairs to the towns valid then.
+
+Versions of each INSEE code are stored as parallel lists of start dates,
+end dates and ids sorted by start, dates being ISO `YYYY-MM-DD` strings
+(towns always start at midnight, a day is enough to find the version).
+Queries are sorted by code and date then merge-joined against these
+lists, with the same results as `Towns.get_current`:
+
+    resolver = Resolver.from_csv('exports/communes/communes.csv')
+    resolver.resolve(['14475', '14475'], ['1950-01-01', date(2017, 1, 1)])
+
+Large CSV streams are resolved by chunks across a pool of processes,
+see `stream_resolve` and `python -m geohisto resolve`. Resolvers loaded
+from a CSV file are only sent to workers as their filename, each worker
+loading it once on its first chunk.
+"""
+import csv
+import io
+import logging
+import os
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+log = logging.getLogger(__name__)
+
+# Number of lines resolved at once by each process.
+CHUNK_SIZE = 50000
+
+# Resolver of the current worker process (see `worker_resolver`).
+_resolver = None
+
+
+def iso_date(date_):
+    """Return the `YYYY-MM-DD` day of a string, date or datetime."""
+    if isinstance(date_, str):
+        return date_[:10]
+    return date_.isoformat()[:10]
+
+
+class Resolver:
+    """
+    Versions of towns indexed by INSEE code.
+
+    `versions` is an iterable of `(id, insee_code, start, end)` tuples,
+    `start` and `end` being ISO dates, in the order of ids.
+    """
+
+    # CSV file the resolver was loaded from, if any.
+    filename = None
+
+    def __init__(self, versions):
+        self.versions = {}
+        self.latest = {}
+        for id_, code, start, end in versions:
+            self.versions.setdefault(code, []).append((start, end, id_))
+            # Like `Towns.latest`, the first one with the latest end.
+            if code not in self.latest or end > self.latest[code][0]:
+                self.latest[code] = (end, id_)
+        for code, versions_ in self.versions.items():
+            versions_.sort()
+            self.versions[code] = tuple(
+                [version[index] for version in versions_]
+                for index in range(3))
+        self.latest = {code: id_ for code, (_, id_) in self.latest.items()}
+        log.info('Indexed %s INSEE codes to resolve', len(self.versions))
+
+    def __len__(self):
+        return len(self.versions)
+
+    def __contains__(self, code):
+        return code in self.versions
+
+    @classmethod
+    def from_towns(cls, towns):
+        """Return the `Resolver` of computed `towns`."""
+        return cls((town.id, town.depcom,
+                    town.start_datetime.date().isoformat(),
+                    town.end_datetime.date().isoformat())
+                   for town in towns.values())
+
+    @classmethod
+    def from_csv(cls, filename):
+        """Return the `Resolver` of towns exported to `filename`."""
+        log.info('Loading towns to resolve from %s', filename)
+        with open(filename) as csvfile:
+            resolver = cls((line['id'], line['insee_code'],
+                            line['start_datetime'][:10],
+                            line['end_datetime'][:10])
+                           for line in csv.DictReader(csvfile))
+        resolver.filename = filename
+        return resolver
+
+    @property
+    def source(self):
+        """
+        Return what to send to workers to get that resolver back.
+
+        The filename of resolvers loaded from a CSV file (see
+        `worker_resolver`), the resolver itself otherwise.
+        """
+        return self.filename or self
+
+    def resolve(self, codes, dates):
+        """
+        Return ids of towns of `codes` valid at `dates`, in order.
+
+        Like `Towns.get_current`, the latest version of a code is
+        returned if none is valid at that date, `None` for unknown codes.
+        """
+        codes = list(codes)
+        dates = [iso_date(date_) for date_ in dates]
+        # Sorting strings is way faster than tuples, codes never
+        # contain a null character so versions of a code are contiguous.
+        keys = [code + '\0' + date_ for code, date_ in zip(codes, dates)]
+        results = [None] * len(keys)
+        previous = versions = None
+        for index in sorted(range(len(keys)), key=keys.__getitem__):
+            code = codes[index]
+            if code != previous:
+                previous = code
+                versions = self.versions.get(code)
+                position = 0
+            if versions is None:
+                continue
+            date_ = dates[index]
+            starts, ends, ids = versions
+            # Dates being sorted by code, versions are only walked once.
+            while position < len(ends) - 1 and ends[position] < date_:
+                position += 1
+            if starts[position] <= date_ <= ends[position]:
+                results[index] = ids[position]
+            else:
+                results[index] = self.latest[code]
+        return results
+
+    def resolve_lines(self, lines, code_index, date_index):
+        """
+        Return CSV `lines` with the resolved id appended to each row.
+
+        Codes and dates are read from the `code_index` and `date_index`
+        columns, unresolved rows get an empty id.
+        """
+        rows = list(csv.reader(lines))
+        ids = self.resolve([row[code_index] for row in rows],
+                           [row[date_index] for row in rows])
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        for row, id_ in zip(rows, ids):
+            row.append(id_ or '')
+            writer.writerow(row)
+        return output.getvalue()
+
+
+def worker_resolver(source):
+    """
+    Return the resolver of `source` (see `Resolver.source`) in a worker.
+
+    Resolvers given by filename are loaded on the first chunk of each
+    worker process then kept in a module global for the next ones.
+    """
+    global _resolver
+    if isinstance(source, Resolver):
+        return source
+    if _resolver is None or _resolver.filename != source:
+        _resolver = Resolver.from_csv(source)
+    return _resolver
+
+
+def resolve_lines(source, lines, code_index, date_index):
+    """Resolve `lines` with the resolver of `source` in a worker."""
+    return worker_resolver(source).resolve_lines(lines, code_index,
+                                                 date_index)
+
+
+def resolve_chunk(source, codes, dates):
+    """Resolve `codes` and `dates` with the resolver of `source`."""
+    return worker_resolver(source).resolve(codes, dates)
+
+
+def iter_chunks(lines, chunk_size=CHUNK_SIZE):
+    """Return a generator of lists of at most `chunk_size` `lines`."""
+    lines = iter(lines)
+    return iter(lambda: list(islice(lines, chunk_size)), [])
+
+
+def bulk_resolve(resolver, codes, dates, workers=None,
+                 chunk_size=CHUNK_SIZE):
+    """
+    Return ids of towns of `codes` valid at `dates` using processes.
+
+    Queries are resolved by chunks of `chunk_size` across `workers`
+    processes (one per CPU by default).
+    """
+    chunks = [(codes[start:start + chunk_size],
+               dates[start:start + chunk_size])
+              for start in range(0, len(codes), chunk_size)]
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(chunks) < 2:
+        return resolver.resolve(codes, dates)
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(resolve_chunk, resolver.source, *chunk)
+                   for chunk in chunks]
+        return [id_ for future in futures for id_ in future.result()]
+
+
+def stream_resolve(resolver, input_, output, code_column='insee_code',
+                   date_column='date', id_column='town_id', workers=None,
+                   chunk_size=CHUNK_SIZE):
+    """
+    Copy the CSV `input_` to `output` adding the resolved `id_column`.
+
+    Chunks of lines are resolved across `workers` processes (one per
+    CPU by default) and written in order, only a few chunks being
+    in flight at once. Rows must not contain line breaks.
+    """
+    header = next(csv.reader([input_.readline()]), [])
+    for column in (code_column, date_column):
+        if column not in header:
+            raise ValueError('Missing `{0}` column'.format(column))
+    code_index = header.index(code_column)
+    date_index = header.index(date_column)
+    csv.writer(output, lineterminator='\n').writerow(header + [id_column])
+    chunks = iter_chunks(input_, chunk_size)
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        for lines in chunks:
+            output.write(resolver.resolve_lines(lines, code_index,
+                                                date_index))
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for lines in chunks:
+            pending.append(executor.submit(resolve_lines, resolver.source,
+                                           lines, code_index, date_index))
+            if len(pending) > 2 * workers:
+                output.write(pending.popleft().result())
+        while pending:
+            output.write(pending.popleft().result())
@@ -0,0 +1,227 @@
+"""
+Populations and counts of towns rolled up by parent at any date.
+
+For each parent (county, region or intercommunality), the validity
+intervals of its towns are turned into sorted events (`+population`
+at the start of the interval, `-population` right after its end)
+accumulated into prefix sums. A roll-up at a given date is then a
+binary search over the events of that parent:
+
+    cube = build_rollups(towns, counties, regions, intercommunalities)
+    cube.at('fr:departement:01', date(2010, 1, 1))
+    # (population, count)
+
+Parents are keyed by their id without the start date (the code of
+counties and regions, the SIREN of intercommunalities), successive
+versions of a parent sharing the same events. Populations at a date
+are the ones of the latest census of each town at that date (see
+`population_periods`).
+"""
+import logging
+
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime
+
+from .constants import DELTA, END_DATETIME, SEPARATOR
+from .parents import CountyIndex
+from .populations import CENSUS_DATES
+from .utils import split_ids, to_datetime
+
+log = logging.getLogger(__name__)
+
+
+def parent_key(parent_id):
+    """Return the key of a parent, its `parent_id` without start date."""
+    return parent_id.split(SEPARATOR, 1)[0]
+
+
+def intersect(start, end, other_start, other_end):
+    """Return the intersection of two intervals, `None` if empty."""
+    start, end = max(start, other_start), min(end, other_end)
+    return (start, end) if start <= end else None
+
+
+class RollupCube:
+    """
+    Prefix sums of populations and counts of towns per parent.
+
+    Built from `(parent id, start, end, population)` intervals,
+    `start` and `end` being inclusive datetimes.
+    """
+
+    def __init__(self, intervals):
+        events = defaultdict(list)
+        for parent_id, start, end, population in intervals:
+            population = population or 0
+            parent_id = parent_key(parent_id)
+            events[parent_id].append((start, population, 1))
+            if end < END_DATETIME:
+                events[parent_id].append((end + DELTA, -population, -1))
+        self.datetimes = {}
+        self.populations = {}
+        self.counts = {}
+        for parent_id, parent_events in events.items():
+            parent_events.sort(key=lambda event: event[0])
+            datetimes = []
+            populations = array('q')
+            counts = array('l')
+            population = count = 0
+            for datetime_, population_delta, count_delta in parent_events:
+                population += population_delta
+                count += count_delta
+                if datetimes and datetimes[-1] == datetime_:
+                    populations[-1] = population
+                    counts[-1] = count
+                else:
+                    datetimes.append(datetime_)
+                    populations.append(population)
+                    counts.append(count)
+            self.datetimes[parent_id] = datetimes
+            self.populations[parent_id] = populations
+            self.counts[parent_id] = counts
+        log.info('Rolled up towns of %s parents', len(self.datetimes))
+
+    def __contains__(self, parent_id):
+        return parent_key(parent_id) in self.datetimes
+
+    def _at(self, parent_id, datetime_, lo=0):
+        parent_id = parent_key(parent_id)
+        index = bisect_right(self.datetimes[parent_id], datetime_, lo) - 1
+        if index < 0:
+            return index, (0, 0)
+        return index, (self.populations[parent_id][index],
+                       self.counts[parent_id][index])
+
+    def at(self, parent_id, date_):
+        """
+        Return `(population, count)` of towns of `parent_id` at `date_`.
+
+        `parent_id` is either a key (`fr:departement:01`) or the id of
+        any version of the parent, the version valid at `date_` being
+        the one rolled up. Unknown parents have no towns: `(0, 0)`.
+        """
+        if parent_id not in self:
+            return 0, 0
+        return self._at(parent_id, to_datetime(date_))[1]
+
+    def population_at(self, parent_id, date_):
+        return self.at(parent_id, date_)[0]
+
+    def count_at(self, parent_id, date_):
+        return self.at(parent_id, date_)[1]
+
+    def bulk_at(self, parent_ids, date_):
+        """Return a `{parent id: (population, count)}` dict at `date_`."""
+        return {parent_id: self.at(parent_id, date_)
+                for parent_id in parent_ids}
+
+    def series(self, parent_id, dates):
+        """
+        Return `(population, count)` of `parent_id` for many `dates`.
+
+        Results follow the order of `dates`, sorted dates are looked up
+        in a single pass, each search starting from the previous one.
+        """
+        if parent_id not in self:
+            return [(0, 0)] * len(dates)
+        datetimes = [to_datetime(date_) for date_ in dates]
+        results = [None] * len(datetimes)
+        lo = 0
+        for position in sorted(range(len(datetimes)),
+                               key=datetimes.__getitem__):
+            index, results[position] = self._at(
+                parent_id, datetimes[position], lo)
+            lo = max(index, 0)
+        return results
+
+
+def population_periods(town):
+    """
+    Return `(start, end, population)` periods of `town`.
+
+    The validity of `town` is split at the reference dates of its
+    known censuses, each census applying until the next one, periods
+    being contiguous to count the town once at any date. The
+    earliest census also applies before its date, there is no other
+    figure for these years. Towns without computed `censuses` or
+    without any known census within their validity (e.g. created
+    after the last census) keep their `population` field over their
+    whole validity.
+    """
+    censuses = sorted(
+        (to_datetime(CENSUS_DATES[census]), population)
+        for census, population in (town.censuses or {}).items()
+        if population is not None)
+    if not censuses:
+        return [(town.start_datetime, town.end_datetime, town.population)]
+    periods = []
+    start = town.start_datetime
+    for (_, population), (next_datetime, _) in zip(censuses, censuses[1:]):
+        periods.append((start, next_datetime - DELTA, population))
+        start = next_datetime
+    periods.append((start, town.end_datetime, censuses[-1][1]))
+    return periods
+
+
+def iter_periods(town, start, end):
+    """Generate `(start, end, population)` of `town` within an interval."""
+    for period_start, period_end, population in population_periods(town):
+        interval = intersect(period_start, period_end, start, end)
+        if interval is not None:
+            yield interval + (population,)
+
+
+def iter_county_intervals(towns, counties, regions=None):
+    """
+    Generate `(parent id, start, end, population)` of towns by parent.
+
+    Parents are the counties listed in `parents` of towns and, if
+    `regions` are given, the regions of these counties. Intervals are
+    restricted to the validity of both the town and its parents.
+    """
+    index = CountyIndex(counties, regions)
+    validities = index.validities
+    for town in towns.values():
+        for county_id in split_ids(town.parents):
+            interval = intersect(town.start_datetime, town.end_datetime,
+                                 *validities[county_id])
+            if interval is None:
+                continue
+            for period in iter_periods(town, *interval):
+                yield (county_id,) + period
+            if regions is None:
+                continue
+            for region_id in index.regions_of(county_id, *interval):
+                for period in iter_periods(town, *intersect(
+                        *interval, *validities[region_id])):
+                    yield (region_id,) + period
+
+
+def iter_intercommunality_intervals(towns, intercommunalities):
+    """Generate `(EPCI id, start, end, population)` of member towns."""
+    for intercommunality in intercommunalities.values():
+        start = to_datetime(intercommunality.start_date)
+        end = datetime.combine(intercommunality.end_date,
+                               END_DATETIME.time())
+        for town_id in intercommunality.towns:
+            town = towns[town_id]
+            for period in iter_periods(town, start, end):
+                yield (intercommunality.id,) + period
+
+
+def build_rollups(towns, counties, regions=None, intercommunalities=None):
+    """
+    Return a `RollupCube` of `towns` by county, region and EPCI.
+
+    WARNING: you have to build it AFTER computing parents and censuses
+    (see `compute_census_populations`), otherwise the `population`
+    field of towns applies at any date.
+    """
+    log.info('Rolling up populations')
+    intervals = list(iter_county_intervals(towns, counties, regions))
+    if intercommunalities:
+        intervals.extend(iter_intercommunality_intervals(
+            towns, intercommunalities))
+    return RollupCube(intervals)
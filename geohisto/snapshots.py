@@ -0,0 +1,77 @@
+"""
+Generate many dated snapshots with a single sweep over validity events.
+
+Instead of checking the validity of every item for each requested date,
+start and end events are sorted once and flags of valid items are
+maintained incrementally while moving forward in time. Each snapshot
+still scans these flags (in C, with `itertools.compress`) to return
+valid items in their original order.
+"""
+import calendar
+import logging
+
+from datetime import date
+from itertools import compress
+from operator import attrgetter
+
+log = logging.getLogger(__name__)
+
+FREQUENCIES = ('year', 'month')
+
+
+def iter_dates(from_date, to_date, every):
+    """
+    Generate dates from `from_date` to `to_date` (included).
+
+    The `every` parameter is one of `FREQUENCIES`, the day of the month
+    is kept from `from_date` and clamped to the end of shorter months.
+    """
+    if every not in FREQUENCIES:
+        raise ValueError('Unknown frequency: {every}'.format(every=every))
+    step = 12 if every == 'year' else 1
+    months = from_date.year * 12 + from_date.month - 1
+    while True:
+        year, month = divmod(months, 12)
+        month += 1
+        last_day = calendar.monthrange(year, month)[1]
+        current = date(year, month, min(from_date.day, last_day))
+        if current > to_date:
+            break
+        yield current
+        months += step
+
+
+def sweep(items, moments,
+          start=attrgetter('start_datetime'), end=attrgetter('end_datetime')):
+    """
+    Yield `(moment, valid_items)` for each of the given `moments`.
+
+    An item is valid at a given moment if `start(item) <= moment <= end(item)`
+    (same as `Item.valid_at`). Valid items are returned in the order
+    of the original `items` iterable to produce the same exports as
+    a filter with `valid_at`, flags of valid items being kept in that
+    order to avoid sorting them for each moment.
+
+    Events are sorted once, then each moment costs a scan of the flags
+    of all items: most items being valid at any moment, it is cheaper
+    than sorting the indexes of valid ones.
+    """
+    items = list(items)
+    starts = sorted(range(len(items)), key=lambda i: start(items[i]))
+    ends = sorted(range(len(items)), key=lambda i: end(items[i]))
+    active = bytearray(len(items))
+    count = 0
+    start_index = end_index = 0
+    for moment in sorted(moments):
+        while (start_index < len(starts) and
+               start(items[starts[start_index]]) <= moment):
+            active[starts[start_index]] = 1
+            count += 1
+            start_index += 1
+        while (end_index < len(ends) and
+               end(items[ends[end_index]]) < moment):
+            count -= active[ends[end_index]]
+            active[ends[end_index]] = 0
+            end_index += 1
+        log.debug('%s items valid at %s', count, moment)
+        yield moment, list(compress(items, active))
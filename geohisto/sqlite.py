@@ -0,0 +1,204 @@
+"""
+Export towns and intercommunalities into an indexed SQLite database.
+
+Validity ranges are indexed with an R*Tree (using julian days) when the
+SQLite build supports it, allowing temporal range queries like:
+
+    SELECT towns.*
+    FROM towns JOIN towns_validity ON towns_validity.id = towns.rowid
+    WHERE towns_validity.start <= julianday('1975-01-01')
+      AND towns_validity.end >= julianday('1975-01-01')
+      AND towns.dep = '14';
+
+Note that the R*Tree stores 32-bits floats and may return a few extra
+rows around the boundaries, add a condition on `start_datetime` and
+`end_datetime` if you need exact results.
+"""
+import logging
+import os
+import sqlite3
+
+from .utils import depcom_to_dep, split_ids, to_nullable_int
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE towns (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    insee_code TEXT NOT NULL,
+    dep TEXT NOT NULL,
+    name TEXT NOT NULL,
+    start_datetime TEXT NOT NULL,
+    end_datetime TEXT NOT NULL,
+    population INTEGER,
+    insee_modification TEXT
+);
+CREATE TABLE town_successors (town_id TEXT, successor_id TEXT);
+CREATE TABLE town_ancestors (town_id TEXT, ancestor_id TEXT);
+CREATE TABLE town_parents (town_id TEXT, parent_id TEXT);
+CREATE TABLE intercommunalities (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    siren TEXT NOT NULL,
+    name TEXT,
+    acronym TEXT,
+    kind TEXT,
+    taxmodel TEXT,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    end_reason TEXT,
+    population INTEGER
+);
+CREATE TABLE intercommunality_successors (
+    intercommunality_id TEXT, successor_id TEXT, overlap REAL);
+CREATE TABLE intercommunality_ancestors (
+    intercommunality_id TEXT, ancestor_id TEXT);
+CREATE TABLE intercommunality_towns (
+    intercommunality_id TEXT, town_id TEXT);
+'''
+
+# Indexes are created after bulk inserts, it is way faster.
+INDEXES = '''
+CREATE INDEX towns_insee_code ON towns (insee_code);
+CREATE INDEX towns_name ON towns (name);
+CREATE INDEX towns_dep ON towns (dep);
+CREATE INDEX town_successors_town_id ON town_successors (town_id);
+CREATE INDEX town_successors_successor_id ON town_successors (successor_id);
+CREATE INDEX town_ancestors_town_id ON town_ancestors (town_id);
+CREATE INDEX town_ancestors_ancestor_id ON town_ancestors (ancestor_id);
+CREATE INDEX town_parents_town_id ON town_parents (town_id);
+CREATE INDEX town_parents_parent_id ON town_parents (parent_id);
+CREATE INDEX intercommunalities_siren ON intercommunalities (siren);
+CREATE INDEX intercommunalities_name ON intercommunalities (name);
+CREATE INDEX intercommunality_successors_id
+    ON intercommunality_successors (intercommunality_id);
+CREATE INDEX intercommunality_ancestors_id
+    ON intercommunality_ancestors (intercommunality_id);
+CREATE INDEX intercommunality_towns_id
+    ON intercommunality_towns (intercommunality_id);
+CREATE INDEX intercommunality_towns_town_id
+    ON intercommunality_towns (town_id);
+'''
+
+VALIDITY_TABLES = ('towns_validity', 'intercommunalities_validity')
+
+
+def create_validity_index(connection, table):
+    """
+    Create a validity `table`, an R*Tree if available.
+
+    Fallback on a regular table with an index on bounds otherwise,
+    queries are the same but slower.
+    """
+    try:
+        connection.execute(
+            'CREATE VIRTUAL TABLE {table} USING rtree(id, start, end)'.format(
+                table=table))
+        return True
+    except sqlite3.OperationalError:
+        log.warning('R*Tree is not available, using a regular index')
+        connection.executescript('''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY, start REAL, end REAL);
+            CREATE INDEX {table}_bounds ON {table} (start, end);
+        '''.format(table=table))
+        return False
+
+
+def edges_from(id_, ids):
+    """Generate `(id_, other_id)` tuples from a list of `ids`."""
+    return ((id_, other_id) for other_id in split_ids(ids))
+
+
+def insert_towns(connection, towns):
+    """Bulk insert `towns` and related edges."""
+    log.info('Inserting %s towns', len(towns))
+    rows, validities = [], []
+    successors, ancestors, parents = [], [], []
+    for rowid, town in enumerate(towns.values(), 1):
+        start_datetime = str(town.start_datetime)
+        # Same as CSV exports, `julianday` does not handle END_DATETIME.
+        end_datetime = str(town.end_datetime.replace(microsecond=0))
+        rows.append((
+            rowid, town.id, town.depcom, depcom_to_dep(town.depcom),
+            town.nccenr, start_datetime, end_datetime,
+            to_nullable_int(town.population), str(town.modification)))
+        validities.append((rowid, start_datetime, end_datetime))
+        successors.extend(edges_from(town.id, town.successors))
+        ancestors.extend(edges_from(town.id, town.ancestors))
+        parents.extend(edges_from(town.id, town.parents))
+    connection.executemany(
+        'INSERT INTO towns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    connection.executemany(
+        'INSERT INTO towns_validity VALUES (?, julianday(?), julianday(?))',
+        validities)
+    connection.executemany('INSERT INTO town_successors VALUES (?, ?)',
+                           successors)
+    connection.executemany('INSERT INTO town_ancestors VALUES (?, ?)',
+                           ancestors)
+    connection.executemany('INSERT INTO town_parents VALUES (?, ?)', parents)
+
+
+def insert_intercommunalities(connection, intercommunalities):
+    """Bulk insert `intercommunalities`, related edges and memberships."""
+    log.info('Inserting %s intercommunalities', len(intercommunalities))
+    rows, validities = [], []
+    successors, ancestors, memberships = [], [], []
+    for rowid, item in enumerate(intercommunalities.values(), 1):
+        rows.append((
+            rowid, item.id, item.siren, item.name, item.acronym, item.kind,
+            item.taxmodel, item.start_date.isoformat(),
+            item.end_date.isoformat(), item.end_reason,
+            to_nullable_int(item.population)))
+        # End dates are inclusive, the whole last day is valid.
+        validities.append((rowid, item.start_date.isoformat(),
+                           item.end_date.isoformat() + ' 23:59:59'))
+        # Overlaps are only known for merges.
+        overlaps = item.overlaps or [None] * len(item.successors)
+        successors.extend((item.id, successor_id, overlap)
+                          for successor_id, overlap
+                          in zip(item.successors, overlaps))
+        ancestors.extend(edges_from(item.id, item.ancestors))
+        memberships.extend(edges_from(item.id, sorted(item.towns)))
+    connection.executemany(
+        'INSERT INTO intercommunalities '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    connection.executemany(
+        'INSERT INTO intercommunalities_validity '
+        'VALUES (?, julianday(?), julianday(?))', validities)
+    connection.executemany(
+        'INSERT INTO intercommunality_successors VALUES (?, ?, ?)',
+        successors)
+    connection.executemany(
+        'INSERT INTO intercommunality_ancestors VALUES (?, ?)', ancestors)
+    connection.executemany(
+        'INSERT INTO intercommunality_towns VALUES (?, ?)', memberships)
+
+
+def write_sqlite_on(filename, towns, intercommunalities=None):
+    """
+    Write the `filename` SQLite database from scratch.
+
+    All inserts are performed within a single transaction, then indexes
+    are built.
+    """
+    log.info('Writing SQLite database to %s', filename)
+    if os.path.exists(filename):
+        os.remove(filename)
+    connection = sqlite3.connect(filename)
+    try:
+        # The database is generated from scratch, no need for a journal.
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.executescript(SCHEMA)
+        for table in VALIDITY_TABLES:
+            create_validity_index(connection, table)
+        with connection:
+            insert_towns(connection, towns)
+            if intercommunalities:
+                insert_intercommunalities(connection, intercommunalities)
+        connection.executescript(INDEXES)
+        connection.execute('ANALYZE')
+    finally:
+        connection.close()
@@ -7,6 +7,7 @@ https://www.insee.fr/fr/information/2114819#titre-bloc-10
 import csv
 import logging
 
+from array import array
 from datetime import date, datetime
 from functools import wraps
 
@@ -58,6 +59,13 @@ def convert_datetime(string):
     return datetime.combine(convert_date(string), datetime.min.time())
 
 
+def to_datetime(date_):
+    """Convert a `date` to a `datetime` at midnight, keep datetimes."""
+    if isinstance(date_, datetime):
+        return date_
+    return datetime.combine(date_, datetime.min.time())
+
+
 def convert_name_with_article(source, ncc_key='NCCENR', tncc_key='TNCC'):
     """Return the `source` name with optional article.
 
@@ -83,24 +91,113 @@ def compute_id(depcom, start_date):
         start_date=start_date.isoformat())
 
 
+def depcom_from_id(id):
+    """Return the `depcom` part of a town `id`, reverse of `compute_id`."""
+    return id[len(GEOID_PREFIX):].split(SEPARATOR, 1)[0]
+
+
+def to_nullable_int(value):
+    """Convert a population-like `value` to an integer or `None`."""
+    if value is None or value == 'NULL' or value == '':
+        return None
+    return int(value)
+
+
+def split_ids(value):
+    """Convert a `;`-joined string or an iterable of ids to a list."""
+    if isinstance(value, str):
+        return value.split(';') if value else []
+    return list(value)
+
+
+def depcom_to_dep(depcom):
+    """Return the county code of a given `depcom`, DROM have 3-digits codes."""
+    if depcom.startswith('97'):
+        return depcom[:3]
+    return depcom[:2]
+
+
 def compute_ancestors(towns):
     """
     Reverse the tree of successors to have ancestors.
 
     Useful to compute new populations for instance.
+
+    Successors are turned once into CSR arrays (edges of each town
+    being `targets[offsets[i]:offsets[i + 1]]`), validated in bulk and
+    transposed into ancestors, in order. Each town is then updated at
+    most once: it is linear in the number of towns and successors.
     """
     log.info('Computing ancestors')
+    # Only towns with successors and their successors are indexed.
+    items = []
+    indexes = {}
+
+    def index(town):
+        if town.id not in indexes:
+            indexes[town.id] = len(items)
+            items.append(town)
+        return indexes[town.id]
+
+    sources = array('l')
+    offsets = array('l', [0])
+    targets = array('l')
     for town in towns.with_successors():
+        sources.append(index(town))
         for successor_id in town.successors.split(';'):
-            successor = towns.retrieve(successor_id)
-            if successor:
-                # Avoid weird parenthood relations.
-                if (town.id not in town.successors and
-                        town.end_datetime <= successor.end_datetime):
-                    successor = successor.add_ancestor(town.id)
-                    towns.upsert(successor)
-                else:
-                    town = town.remove_successor(successor.id)
-                    towns.upsert(town)
-            else:
+            successor = towns.get(successor_id)
+            targets.append(-1 if successor is None else index(successor))
+        offsets.append(len(targets))
+
+    # Validate edges, following the order of successors as removing
+    # one may change the outcome for the next ones.
+    kept = bytearray(len(targets))
+    successors = {}
+    for position, source in enumerate(sources):
+        town = items[source]
+        current = town.successors.split(';')
+        for edge in range(offsets[position], offsets[position + 1]):
+            if targets[edge] < 0:
                 log.warning('Successor not found for %s', town.repr_insee)
+                continue
+            successor = items[targets[edge]]
+            # Avoid weird parenthood relations.
+            if (town.id not in ';'.join(current) and
+                    town.end_datetime <= successor.end_datetime):
+                kept[edge] = 1
+            else:
+                current = [successor_id for successor_id in current
+                           if successor_id != successor.id]
+                successors[source] = ';'.join(current)
+
+    # Transpose kept edges with a (stable) counting sort by target.
+    ancestors_offsets = array('l', [0]) * (len(items) + 1)
+    for edge, target in enumerate(targets):
+        if kept[edge]:
+            ancestors_offsets[target + 1] += 1
+    for position in range(len(items)):
+        ancestors_offsets[position + 1] += ancestors_offsets[position]
+    ancestors = array('l', [0]) * ancestors_offsets[-1]
+    filled = ancestors_offsets[:-1]
+    for position, source in enumerate(sources):
+        for edge in range(offsets[position], offsets[position + 1]):
+            if kept[edge]:
+                target = targets[edge]
+                ancestors[filled[target]] = source
+                filled[target] += 1
+
+    # Write back with a single update per affected town.
+    for position, town in enumerate(items):
+        changes = {}
+        if position in successors:
+            changes['successors'] = successors[position]
+        first = ancestors_offsets[position]
+        last = ancestors_offsets[position + 1]
+        if first < last:
+            town_ancestors = ';'.join(items[ancestor].id
+                                      for ancestor in ancestors[first:last])
+            if town.ancestors:
+                town_ancestors = town.ancestors + ';' + town_ancestors
+            changes['ancestors'] = town_ancestors
+        if changes:
+            towns.upsert(town._replace(**changes))
@@ -12,9 +12,9 @@ from geohisto.utils import compute_id
 
 def towns_factory(*town_factories):
     """Generate a `Towns` orderedlist from `town_factory` objects."""
-    return Towns({
-        town_factory.id: town_factory for town_factory in town_factories
-    })
+    # Pairs rather than a dict to keep the order on Python < 3.6.
+    return Towns((town_factory.id, town_factory)
+                 for town_factory in town_factories)
 
 
 def town_factory(**custom):
@@ -29,8 +29,9 @@ def town_factory(**custom):
         'successors': '',
         'start_date': START_DATE,
         'end_date': END_DATE,
-        'population': 'NULL',
-        'parents': ''
+        'population': None,
+        'parents': '',
+        'censuses': None
     }
     custom['depcom'] = custom['dep'] + custom['com']
     params.update(custom)
@@ -1,4 +1,9 @@
 """Tests related to ancestors and populations."""
+from datetime import date
+
+from geohisto.utils import compute_ancestors
+
+from .factories import town_factory, towns_factory
 
 
 def test_ancestors(towns):
@@ -16,8 +21,8 @@ def test_with_ancestors_population(towns):
     # We cannot compute old populations.
     bragelogne, bragelogne_beauvoir = list(towns.filter(depcom='10058'))
     beauvoir_sur_sarce = next(towns.filter(depcom='10036'))
-    assert bragelogne.population == 'NULL'
-    assert beauvoir_sur_sarce.population == 'NULL'
+    assert bragelogne.population is None
+    assert beauvoir_sur_sarce.population is None
     assert bragelogne_beauvoir.population == 249
 
     # But we can guess current population from fusions.
@@ -26,3 +31,29 @@ def test_with_ancestors_population(towns):
     assert saint_martin.population == 64
     assert saint_aubin.population == 517
     assert val_ocre.population == 581
+
+
+def test_compute_ancestors_edges():
+    """Weird relations are removed, ancestors keep the towns order."""
+    merged = town_factory(dep='01', com='003', nccenr='Merged')
+    other = town_factory(dep='01', com='001', nccenr='Other',
+                         successors=merged.id)
+    first = town_factory(dep='01', com='002', nccenr='First',
+                         end_date=date(2015, 12, 31),
+                         successors=merged.id + ';fr:commune:01404@1942-01-01')
+    second = town_factory(dep='01', com='004', nccenr='Second',
+                          end_date=date(2015, 12, 31), successors=merged.id)
+    towns = towns_factory(merged, other, first, second)
+    compute_ancestors(towns)
+    assert towns[merged.id].ancestors == ';'.join([other.id, first.id,
+                                                   second.id])
+    # Unknown successors are kept as is.
+    assert towns[first.id].successors == first.successors
+
+    itself = town_factory(dep='01', com='005', nccenr='Itself')
+    itself = itself._replace(successors=itself.id + ';' + merged.id)
+    towns = towns_factory(merged, itself)
+    compute_ancestors(towns)
+    # Once removed, the town is not part of its successors anymore.
+    assert towns[itself.id].successors == merged.id
+    assert towns[merged.id].ancestors == itself.id
@@ -0,0 +1,58 @@
+from datetime import date
+
+import pytest
+
+from geohisto.columnar import (
+    write_intercommunalities_columnar_on, write_towns_columnar_on
+)
+from geohisto.models import Intercommunalities, Intercommunality
+
+from .factories import town_factory, towns_factory
+
+pyarrow = pytest.importorskip('pyarrow')
+pytest.importorskip('pyarrow.parquet')
+
+
+def test_towns_columnar(tmpdir):
+    old = town_factory(dep='01', com='001', nccenr='Old',
+                       end_date=date(1973, 12, 31), modification='310;100')
+    new = town_factory(dep='01', com='001', nccenr='New', population=42,
+                       start_date=date(1974, 1, 1), ancestors=old.id)
+    old = old._replace(successors=new.id)
+    guadeloupe = town_factory(dep='971', com='05', nccenr='Basse-Terre',
+                              parents='fr:departement:971@1946-03-19')
+    basename = str(tmpdir.join('communes'))
+    write_towns_columnar_on(basename, towns_factory(guadeloupe, old, new))
+
+    parquet = pyarrow.parquet.ParquetFile(basename + '.parquet')
+    assert parquet.metadata.num_row_groups == 2  # One per county.
+    table = parquet.read()
+    assert table.column('dep').to_pylist() == ['01', '01', '971']
+    assert table.column('population').to_pylist() == [None, 42, None]
+    assert table.column('successors').to_pylist() == [[new.id], [], []]
+    assert table.column('ancestors').to_pylist() == [[], [old.id], []]
+    assert table.column('insee_modification').to_pylist() == [
+        [310, 100], [], []]
+    assert table.schema.field('start_datetime').type == pyarrow.timestamp('us')
+
+    with pyarrow.memory_map(basename + '.arrow') as source:
+        reader = pyarrow.ipc.open_file(source)
+        assert reader.num_record_batches == 2
+        assert reader.read_all().equals(table)
+
+
+def test_intercommunalities_columnar(tmpdir):
+    intercommunality = Intercommunality(
+        siren='240100156', name='Montrevel', kind='DISTRICT',
+        taxmodel='4TX', population='12611',
+        towns={'fr:commune:01115@1942-01-01'}).create_on(1999)
+    intercommunalities = Intercommunalities()
+    intercommunalities.upsert(intercommunality)
+    basename = str(tmpdir.join('epci'))
+    write_intercommunalities_columnar_on(basename, intercommunalities)
+
+    table = pyarrow.parquet.read_table(basename + '.parquet')
+    assert table.column('population').to_pylist() == [12611]
+    assert table.column('start_date').to_pylist() == [date(1999, 1, 1)]
+    assert table.column('towns').to_pylist() == [
+        ['fr:commune:01115@1942-01-01']]
@@ -0,0 +1,66 @@
+import csv
+import gzip
+
+from datetime import date
+
+import pytest
+
+from geohisto.compressed import (
+    cached_block_index, compress_rows, load_block_index, read_department,
+    read_insee_code, write_compressed_results_on
+)
+
+from .factories import town_factory, towns_factory
+
+
+def test_compressed_export(tmpdir):
+    towns = towns_factory(
+        town_factory(dep='01', com='001', nccenr='Old',
+                     end_date=date(1973, 12, 31)),
+        town_factory(dep='01', com='001', nccenr='New',
+                     start_date=date(1974, 1, 1)),
+        town_factory(dep='01', com='002', nccenr='Other'),
+        town_factory(dep='01', com='003', nccenr='Another'),
+        town_factory(dep='971', com='05', nccenr='Basse-Terre'),
+    )
+    filename = str(tmpdir.join('communes.csv.gz'))
+    write_compressed_results_on(filename, towns, rows_per_block=2)
+
+    index = load_block_index(filename)
+    assert [(block.dep, block.rows) for block in index] == [
+        ('', 0), ('01', 2), ('01', 2), ('971', 1)]
+
+    # Blocks are concatenated gzip members, it is still a regular file.
+    with gzip.open(filename, 'rt') as content:
+        rows = list(csv.DictReader(content))
+    assert len(rows) == 5
+
+    assert [row['name'] for row in read_department(filename, '01')] == [
+        'Old', 'New', 'Other', 'Another']
+    assert [row['name'] for row in read_insee_code(filename, '01001')] == [
+        'Old', 'New']
+    assert [row['name'] for row in read_insee_code(filename, '97105')] == [
+        'Basse-Terre']
+    assert read_insee_code(filename, '02001') == []
+
+
+def test_compressed_blocks_reproducible():
+    assert compress_rows([], header=True) == compress_rows([], header=True)
+    # Null modification time in the gzip header.
+    assert compress_rows([])[4:8] == b'\x00\x00\x00\x00'
+
+
+def test_compressed_index_cached(tmpdir):
+    towns = towns_factory(town_factory(dep='01', com='001', nccenr='Old'))
+    filename = str(tmpdir.join('communes.csv.gz'))
+    write_compressed_results_on(filename, towns)
+    cached_block_index.cache_clear()
+    read_insee_code(filename, '01001')
+    read_department(filename, '01')
+    assert cached_block_index.cache_info().misses == 1
+    assert cached_block_index.cache_info().hits == 1
+    # The shared index cannot be modified by a caller.
+    index = load_block_index(filename)
+    assert isinstance(index, tuple)
+    with pytest.raises(AttributeError):
+        index[1].offset = 0
@@ -1,6 +1,13 @@
 """Tests related to counting towns in results."""
+from collections import Counter
 from datetime import datetime
 
+from geohisto.loaders import load_counties
+from geohisto.models import Towns
+from geohisto.parents import compute_parents, validity_of
+from geohisto.rollups import build_rollups, parent_key
+from geohisto.utils import split_ids
+
 
 def len_at_date(towns, year, month, day):
     return len(list(towns.valid_at(datetime(year, month, day))))
@@ -78,3 +85,29 @@ def test_counts(towns):
     }
     for year in expected:
         assert expected[year][0] - expected[year][1] == current_diff[year]
+
+
+def test_rollup_counts(towns):
+    """Counts rolled up by county are the ones computed by brute force."""
+    counties = load_counties()
+    # Parents are computed on a copy to keep the shared fixture intact.
+    towns = compute_parents(counties, Towns(towns))
+    cube = build_rollups(towns, counties)
+    validities = {county['id']: validity_of(county)
+                  for lines in counties.values() for county in lines}
+    keys = {parent_key(county_id) for county_id in validities}
+    for year in (1962, 1975, 1999, 2016, 2017):
+        valid_datetime = datetime(year, 1, 1)
+        expected = Counter(
+            parent_key(county_id)
+            for town in towns.valid_at(valid_datetime)
+            for county_id in split_ids(town.parents)
+            if validities[county_id][0] <= valid_datetime <=
+            validities[county_id][1])
+        counts = {key: count for key, (_, count)
+                  in cube.bulk_at(keys, valid_datetime).items() if count}
+        assert counts == expected
+    # Since 2015 all towns belong to a single county.
+    assert sum(count for _, count in cube.bulk_at(
+        keys, datetime(2017, 1, 1)).values()) == len_at_date(
+        towns, 2017, 1, 1)
@@ -0,0 +1,114 @@
+from datetime import date
+
+from geohisto.entities import (
+    COLLECTIVITY, COUNTY, INTERCOMMUNALITY, REGION, TOWN, build_store
+)
+from geohisto.loaders import load_collectivites, load_counties, load_regions
+from geohisto.models import Intercommunalities, Intercommunality
+
+from .factories import town_factory, towns_factory
+
+
+def line(id, code, start, end, ancestors='', parents='', chef_lieu='',
+         successors=''):
+    return {'id': id, 'insee_code': code, 'name': code,
+            'start_datetime': start + ' 00:00:00',
+            'end_datetime': end + ' 23:59:59', 'ancestors': ancestors,
+            'parents': parents, 'chef_lieu': chef_lieu,
+            'successors': successors}
+
+
+def make_store():
+    towns = towns_factory(
+        town_factory(dep='01', com='053', nccenr='Bourg',
+                     end_date=date(1955, 3, 30)),
+        town_factory(dep='01', com='053', nccenr='Bourg-en-Bresse',
+                     start_date=date(1955, 3, 31)),
+        town_factory(dep='01', com='001', nccenr='Other'),
+        town_factory(dep='975', com='01', nccenr='Miquelon'),
+    )
+    counties = {
+        '01': [line('fr:departement:01@1860-07-01', '01', '1860-07-01',
+                    '9999-12-31',
+                    parents='fr:region:82@1970-01-09;fr:region:84@2016-01-01',
+                    chef_lieu='fr:commune:01053@1942-01-01;'
+                              'fr:commune:01053@1955-03-31')],
+        '975': [line('fr:departement:975@1976-07-19', '975', '1976-07-19',
+                     '2003-03-27')],
+    }
+    regions = {
+        'fr:region:82@1970-01-09': line('fr:region:82@1970-01-09', '82',
+                                        '1970-01-09', '2015-12-31'),
+        'fr:region:84@2016-01-01': line('fr:region:84@2016-01-01', '84',
+                                        '2016-01-01', '9999-12-31'),
+    }
+    collectivites = {
+        'fr:collectivite-outre-mer:975@2003-03-28': line(
+            'fr:collectivite-outre-mer:975@2003-03-28', '975', '2003-03-28',
+            '9999-12-31', ancestors='fr:departement:975@1976-07-19'),
+    }
+    intercommunalities = Intercommunalities()
+    intercommunalities.upsert(Intercommunality(
+        siren='200000001', name='CC', towns={'fr:commune:01001@1942-01-01'}
+    ).create_on(2010))
+    return build_store(towns, counties, regions, collectivites,
+                       intercommunalities)
+
+
+def test_store_registry():
+    store = make_store()
+    assert len(store) == 10
+    assert store['fr:region:84@2016-01-01'].level == REGION
+    assert store.get('fr:region:00@2016-01-01') is None
+    assert store.at(TOWN, '01053', date(1950, 1, 1)).name == 'Bourg'
+    assert store.at(TOWN, '01053', date(1960, 1, 1)).name == \
+        'Bourg-en-Bresse'
+    assert store.at(COUNTY, '975', date(1970, 1, 1)) is None
+    assert store.at(INTERCOMMUNALITY, '200000001', date(2010, 1, 1)).id == \
+        'fr:epci:200000001@2010-01-01'
+
+
+def test_store_cross_levels():
+    store = make_store()
+    town_id = 'fr:commune:01001@1942-01-01'
+    assert [region.id for region in store.parents_at(
+        town_id, REGION, date(2000, 1, 1))] == ['fr:region:82@1970-01-09']
+    assert [region.id for region in store.parents_at(
+        town_id, REGION, date(2016, 1, 1))] == ['fr:region:84@2016-01-01']
+    assert store.parents_at(town_id, REGION, date(1960, 1, 1)) == []
+    assert [epci.id for epci in store.parents_at(
+        town_id, INTERCOMMUNALITY, date(2017, 1, 1))] == [
+        'fr:epci:200000001@2010-01-01']
+    assert sorted(town.name for town in store.children_at(
+        'fr:region:82@1970-01-09', TOWN, date(2000, 1, 1))) == [
+        'Bourg-en-Bresse', 'Other']
+    miquelon = 'fr:commune:97501@1942-01-01'
+    assert [county.id for county in store.parents_at(
+        miquelon, COUNTY, date(2000, 1, 1))] == [
+        'fr:departement:975@1976-07-19']
+    assert [collectivity.id for collectivity in store.parents_at(
+        miquelon, COLLECTIVITY, date(2010, 1, 1))] == [
+        'fr:collectivite-outre-mer:975@2003-03-28']
+
+
+def test_store_chef_lieu():
+    store = make_store()
+    county_id = 'fr:departement:01@1860-07-01'
+    assert store.chef_lieu_at(county_id, date(1950, 1, 1)).name == 'Bourg'
+    assert store.chef_lieu_at(county_id, date(2000, 1, 1)).name == \
+        'Bourg-en-Bresse'
+    assert store.chef_lieu_at('fr:region:84@2016-01-01',
+                              date(2000, 1, 1)) is None
+
+
+def test_store_renamed_region():
+    """Counties are related to successors of their listed regions."""
+    bourges = town_factory(dep='18', com='033', nccenr='Bourges')
+    store = build_store(towns_factory(bourges), load_counties(),
+                        load_regions(), load_collectivites())
+    assert [region.id for region in store.parents_at(
+        bourges.id, REGION, date(2000, 1, 1))] == ['fr:region:24@1970-01-09']
+    assert [region.id for region in store.parents_at(
+        bourges.id, REGION, date(2017, 1, 1))] == ['fr:region:24@2015-01-17']
+    assert bourges.id in [town.id for town in store.children_at(
+        'fr:region:24@2015-01-17', TOWN, date(2017, 1, 1))]
@@ -0,0 +1,85 @@
+from itertools import islice
+
+import pytest
+
+from geohisto.external_sort import external_sort, is_sorted, iter_groups
+from geohisto.external_sort import spill as original_spill
+
+
+def write_csv(tmpdir, *lines):
+    csv_file = tmpdir.join('rows.csv')
+    csv_file.write('\n'.join(('siren;insee',) + lines) + '\n')
+    return str(csv_file)
+
+
+def test_iter_groups_sorted(tmpdir):
+    filename = write_csv(tmpdir, '1;01001', '1;01002', '2;01003')
+    assert is_sorted(filename, 'siren', delimiter=';')
+    groups = [(siren, [row['insee'] for row in rows]) for siren, rows
+              in iter_groups(filename, 'siren', delimiter=';')]
+    assert groups == [('1', ['01001', '01002']), ('2', ['01003'])]
+
+
+def record_spills(monkeypatch):
+    """Return the list of spill files created from now on."""
+    spill_files = []
+
+    def spill(*args, **kwargs):
+        spill_files.append(original_spill(*args, **kwargs))
+        return spill_files[-1]
+
+    monkeypatch.setattr('geohisto.external_sort.spill', spill)
+    return spill_files
+
+
+def test_iter_groups_unsorted(tmpdir, monkeypatch):
+    spill_files = record_spills(monkeypatch)
+    filename = write_csv(tmpdir, '2;01003', '1;01001', '3;01004',
+                         '2;01005', '1;01002')
+    assert not is_sorted(filename, 'siren', delimiter=';')
+    spill_directory = tmpdir.mkdir('spill')
+    # Two rows per chunk, three spill files.
+    groups = [(siren, [row['insee'] for row in rows]) for siren, rows
+              in iter_groups(filename, 'siren', buffer_size=2,
+                             directory=str(spill_directory), delimiter=';')]
+    # The original order is kept within each group.
+    assert groups == [('1', ['01001', '01002']), ('2', ['01003', '01005']),
+                      ('3', ['01004'])]
+    assert len(spill_files) == 3
+    assert all(spill_file.closed for spill_file in spill_files)
+
+
+def test_external_sort_is_stable(tmpdir):
+    filename = write_csv(tmpdir, *('{0};{1:05}'.format(3 - index % 3, index)
+                                   for index in range(10)))
+    rows = list(external_sort(filename, 'siren', buffer_size=3,
+                              delimiter=';'))
+    assert [row['siren'] for row in rows] == ['1'] * 3 + ['2'] * 3 + \
+        ['3'] * 4
+    assert [row['insee'] for row in rows[:3]] == ['00002', '00005', '00008']
+
+
+def test_external_sort_fan_in(tmpdir, monkeypatch):
+    spill_files = record_spills(monkeypatch)
+    filename = write_csv(tmpdir, '2;01003', '1;01001', '3;01004',
+                         '2;01005', '1;01002')
+    rows = external_sort(filename, 'siren', buffer_size=1, fan_in=2,
+                         delimiter=';')
+    assert [row['insee'] for row in rows] == [
+        '01001', '01002', '01003', '01005', '01004']
+    # Five chunks, merged by two into three then two files.
+    assert len(spill_files) == 8
+    assert all(spill_file.closed for spill_file in spill_files)
+    with pytest.raises(ValueError):
+        next(external_sort(filename, 'siren', fan_in=1, delimiter=';'))
+
+
+def test_iter_groups_not_contiguous(tmpdir, monkeypatch):
+    filename = write_csv(tmpdir, '1;01001', '2;01002', '1;01003')
+    # Pretend the file is sorted, e.g. modified after the check.
+    monkeypatch.setattr('geohisto.external_sort.is_sorted',
+                        lambda *args, **kwargs: True)
+    groups = iter_groups(filename, 'siren', delimiter=';')
+    assert [siren for siren, _ in islice(groups, 2)] == ['1', '2']
+    with pytest.raises(ValueError):
+        next(groups)
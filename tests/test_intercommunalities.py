@@ -1,6 +1,8 @@
 import pytest
 
-from geohisto.intercommunalities import extract_name, extract_acronym
+from geohisto.intercommunalities import (
+    extract_acronym, extract_name, normalize_name
+)
 
 NAMES = (
     # Correct name is left unchanged
@@ -83,6 +85,14 @@ def test_extract_name(line, expected):
     assert extract_name(line) == expected
 
 
+def test_extract_name_is_cached():
+    line = {'nature': 'CC', 'nom': 'CC DU BUGEY SUD'}
+    extract_name(line)
+    hits = normalize_name.cache_info().hits
+    assert extract_name(line) == 'Communauté de Communes du Bugey Sud'
+    assert normalize_name.cache_info().hits == hits + 1
+
+
 ACRONYMS = (
     ('Territoire de la Côte Ouest (tco)', 'TCO'),
     ('Territoire de la Côte Ouest', None),
@@ -0,0 +1,289 @@
+import csv
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+import pytest
+
+from geohisto.constants import (
+    END_DATE, INTERCOMMUNALITY_INNER_CHANGE, INTERCOMMUNALITY_MERGED,
+    INTERCOMMUNALITY_REMOVED, INTERCOMMUNALITY_RENAMED
+)
+from geohisto.exports import write_results_on
+from geohisto.intercommunalities import (
+    changes_within, check_fusions, find_absorbers, index_members,
+    index_town_changes, index_town_versions, join_intercommunalities,
+    load_fusions, load_intercommunalities, parse_intercommunalities_from,
+    submit_intercommunalities_parsing, town_ids_at
+)
+from geohisto.models import Intercommunalities, Intercommunality, TownTable
+
+from .factories import town_factory, towns_factory
+
+HEADER = ('siren;nom;nature;fiscalite;nb_com;ptot;pmun;insee;'
+          'siren_com;nom_com;ptot_com;pmun_com')
+
+
+def write_year(directory, year, *lines):
+    directory.join('{0}.csv'.format(year)).write(
+        '\n'.join((HEADER,) + lines) + '\n')
+
+
+@pytest.fixture
+def towns():
+    return towns_factory(
+        town_factory(dep='01', com='001', nccenr='First'),
+        town_factory(dep='01', com='002', nccenr='Second',
+                     end_date=date(2016, 5, 31)),
+        town_factory(dep='01', com='002', nccenr='Second Renamed',
+                     start_date=date(2016, 6, 1)),
+        town_factory(dep='01', com='003', nccenr='Third'),
+        town_factory(dep='01', com='004', nccenr='Fourth'),
+    )
+
+
+@pytest.fixture
+def directory(tmpdir):
+    write_year(tmpdir, 2015,
+               '200000001;CC DU VALROMEY;CC;FA;2;300;290;1001;;First;100;95',
+               '200000001;CC DU VALROMEY;CC;FA;2;300;290;1002;;Second;200;195',
+               '200000003;CC Merged;CC;FA;1;50;50;1003;;Third;50;50',
+               '200000004;CC Removed;CC;FA;1;10;10;1004;;Fourth;10;10')
+    write_year(tmpdir, 2016,
+               '200000001;CC Val Romey;CC;FA;2;310;300;1001;;First;105;100',
+               '200000001;CC Val Romey;CC;FA;2;310;300;1002;;Second;205;200',
+               '200000002;CC de la Vallière;CC;FPU;1;50;50;1003;;Third;50;50')
+    write_year(tmpdir, 2017,
+               '200000001;CC Val Romey;CC;FA;2;320;310;1001;;First;110;105',
+               '200000001;CC Val Romey;CC;FA;2;320;310;1002;;Second;210;205',
+               '200000002;CC de la Vallière;CC;FPU;1;55;55;1003;;Third;55;55')
+    return tmpdir
+
+
+def test_parse_intercommunalities_from(directory):
+    records = parse_intercommunalities_from(str(directory.join('2016.csv')))
+    assert [record.siren for record in records] == ['200000001', '200000002']
+    assert records[0].name == 'Val Romey'
+    assert records[0].insees == ('01001', '01002')
+    assert records[1].name == 'Communauté de Communes de la Vallière'
+    records_2017 = parse_intercommunalities_from(
+        str(directory.join('2017.csv')))
+    # Population changes are not taken into account.
+    assert records[0].fingerprint == records_2017[0].fingerprint
+
+
+def test_parse_blank_town_populations(tmpdir, towns):
+    write_year(tmpdir, 2015,
+               '200000001;CC Blank;CC;FA;2;300;290;1001;;First;;',
+               '200000001;CC Blank;CC;FA;2;300;290;1002;;Second;200;195')
+    records = parse_intercommunalities_from(str(tmpdir.join('2015.csv')))
+    assert records[0].ptots == (None, 200)
+    assert records[0].pmuns == (None, 195)
+    first, second = list(towns.values())[:2]
+    intercommunalities = load_intercommunalities(
+        towns, str(tmpdir), start=2015, end=2015, workers=1)
+    populations = intercommunalities.town_populations
+    assert populations.get(first.id, 2015) is None
+    assert populations.get(second.id, 2015) == 195
+
+
+def test_latest_intercommunality_by_siren():
+    intercommunalities = Intercommunalities()
+    ended = Intercommunality(siren='200000001', name='Ended').create_on(
+        2015).end_on(2015, INTERCOMMUNALITY_RENAMED)
+    other = Intercommunality(siren='200000002', name='Other').create_on(2015)
+    current = Intercommunality(siren='200000001', name='Current').create_on(
+        2016)
+    for intercommunality in (ended, other, current):
+        intercommunalities.upsert(intercommunality)
+    assert intercommunalities.latest('200000001') == current
+    assert intercommunalities.latest('200000002') == other
+    # Criteria are combined, not any of them.
+    assert list(intercommunalities.filter(siren='200000001',
+                                          end_date=END_DATE)) == [current]
+    assert list(intercommunalities.filter(siren='200000002',
+                                          name='Other')) == [other]
+
+
+def test_update_ends_the_previous_year():
+    intercommunalities = Intercommunalities()
+    current = Intercommunality(siren='200000001', name='Old').create_on(2015)
+    intercommunalities.upsert(current)
+    assert intercommunalities.update(current._replace(name='New'), 2016)
+    ended = intercommunalities[current.id]
+    new = intercommunalities.latest('200000001')
+    assert ended.end_date == date(2015, 12, 31)
+    assert ended.end_reason == INTERCOMMUNALITY_RENAMED
+    assert new.start_date == date(2016, 1, 1)
+    assert ended.successors == [new.id]
+    assert not intercommunalities.update(new, 2017)
+
+
+def test_load_intercommunalities(directory, towns):
+    first, second, second_renamed, third, fourth = towns.values()
+    intercommunalities = load_intercommunalities(
+        towns, str(directory), start=2015, end=2017, workers=2)
+    assert sorted(intercommunalities) == [
+        'fr:epci:200000001@2015-01-01',
+        'fr:epci:200000001@2016-01-01',
+        'fr:epci:200000001@2016-06-01',
+        'fr:epci:200000002@2016-01-01',
+        'fr:epci:200000003@2015-01-01',
+        'fr:epci:200000004@2015-01-01',
+    ]
+    old = intercommunalities['fr:epci:200000001@2015-01-01']
+    new = intercommunalities['fr:epci:200000001@2016-01-01']
+    assert old.name == 'Communauté de Communes du Valromey'
+    assert old.end_date == date(2015, 12, 31)
+    assert old.end_reason == INTERCOMMUNALITY_RENAMED
+    assert old.successors == [new.id]
+    assert new.ancestors == [old.id]
+    assert new.towns == {first.id, second.id}
+    # Same members are shared between versions.
+    assert new.towns is old.towns
+    assert first.id in new.towns and third.id not in new.towns
+
+    # A member town has been renamed within the year, the 2017 file
+    # being the same, the intermediate state is still valid.
+    newest = intercommunalities['fr:epci:200000001@2016-06-01']
+    assert new.end_date == date(2016, 5, 31)
+    assert new.end_reason == INTERCOMMUNALITY_INNER_CHANGE
+    assert new.successors == [newest.id]
+    assert newest.ancestors == [new.id]
+    assert newest.name == new.name
+    assert newest.towns == {first.id, second_renamed.id}
+    assert newest.end_date == END_DATE
+
+    # Unchanged from 2016 to 2017.
+    created = intercommunalities['fr:epci:200000002@2016-01-01']
+    assert created.towns == {third.id}
+    assert created.taxmodel == 'FPU'
+    assert created.end_date == END_DATE
+
+    # Its only town is now part of another intercommunality.
+    merged = intercommunalities['fr:epci:200000003@2015-01-01']
+    assert merged.end_date == date(2015, 12, 31)
+    assert merged.end_reason == INTERCOMMUNALITY_MERGED
+    assert merged.successors == [created.id]
+    assert merged.overlaps == [1.0]
+    assert created.ancestors == [merged.id]
+
+    removed = intercommunalities['fr:epci:200000004@2015-01-01']
+    assert removed.end_date == date(2015, 12, 31)
+    assert removed.end_reason == INTERCOMMUNALITY_REMOVED
+    assert removed.successors == []
+
+
+def test_join_intercommunalities_parsed_beforehand(directory, towns):
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        # Parsing is submitted before towns are needed.
+        parsing = submit_intercommunalities_parsing(
+            executor, str(directory), start=2015, end=2017)
+        assert [year for year, _ in parsing] == [2015, 2016, 2017]
+        intercommunalities = join_intercommunalities(towns, parsing)
+    loaded = load_intercommunalities(
+        towns, str(directory), start=2015, end=2017, workers=2)
+    assert intercommunalities == loaded
+
+
+def test_find_absorbers_follows_merged_towns(directory):
+    old = town_factory(dep='01', com='001', nccenr='Old',
+                       end_date=date(2015, 12, 31),
+                       successors='fr:commune:01002@1942-01-01')
+    other = town_factory(dep='01', com='002', nccenr='Other')
+    towns = towns_factory(old, other)
+    records = parse_intercommunalities_from(str(directory.join('2016.csv')))
+    members = index_members(records)
+    assert members == {'01001': '200000001', '01002': '200000001',
+                       '01003': '200000002'}
+    previous_towns = {'01001': old, '01002': other}
+    del members['01001']
+    assert find_absorbers(('01001', '01003', '01004'), members,
+                          towns, previous_towns) == {
+        '200000001': 0.3333, '200000002': 0.3333}
+
+
+def test_check_fusions(tmpdir, caplog):
+    tmpdir.join('fusions.csv').write(
+        'date;siren_source;nom_source;siren_cible;nom_cible;Details\n'
+        '2016-01-01;200000003;CC Merged;200000002;CC de la Vallière;\n'
+        '2016-01-01;200000004;CC Removed;200000002;CC de la Vallière;\n')
+    fusions = load_fusions(str(tmpdir.join('fusions.csv')))
+    assert fusions == {(2016, '200000003'): {'200000002'},
+                       (2016, '200000004'): {'200000002'}}
+    check_fusions(2016, {'200000003': ['200000002']}, fusions)
+    warnings = [record.getMessage() for record in caplog.records]
+    assert warnings == [
+        'Declared merge of 200000004 into 200000002 in 2016 not detected']
+
+
+def test_changes_within(towns):
+    first, second, second_renamed, third, fourth = towns.values()
+    changes = index_town_changes(towns)
+    assert list(changes_within(changes, 2015)) == []
+    # Both the end of the previous version and the start of the new one.
+    assert list(changes_within(changes, 2016)) == [
+        (datetime(2016, 6, 1), '01002'), (datetime(2016, 6, 1), '01002')]
+    versions = index_town_versions(towns)
+    assert town_ids_at(['01002', '01005'], versions,
+                       datetime(2016, 6, 1)) == [second_renamed.id]
+
+
+def test_town_table_members():
+    table = TownTable()
+    members = table.members(['fr:commune:01002@1942-01-01',
+                             'fr:commune:01001@1942-01-01'])
+    assert list(members.indexes) == [0, 1]
+    assert table.members(['fr:commune:01001@1942-01-01',
+                          'fr:commune:01002@1942-01-01']) is members
+    other = table.members(['fr:commune:01003@1942-01-01'])
+    assert other != members
+    assert len(members) == 2
+    assert sorted(members) == ['fr:commune:01001@1942-01-01',
+                               'fr:commune:01002@1942-01-01']
+    assert members == {'fr:commune:01001@1942-01-01',
+                       'fr:commune:01002@1942-01-01'}
+    assert 'fr:commune:01003@1942-01-01' not in members
+    # Equal members hash the same, whatever their table.
+    other_table = TownTable()
+    other_table.members(['fr:commune:01003@1942-01-01'])
+    elsewhere = other_table.members(['fr:commune:01001@1942-01-01',
+                                     'fr:commune:01002@1942-01-01'])
+    assert list(elsewhere.indexes) == [1, 2]
+    assert elsewhere == members
+    assert hash(elsewhere) == hash(members)
+    assert frozenset(members) in {members: None}
+
+
+def test_town_populations(directory, towns):
+    first, second, second_renamed, third, fourth = towns.values()
+    intercommunalities = load_intercommunalities(
+        towns, str(directory), start=2015, end=2017, workers=2)
+    populations = intercommunalities.town_populations
+    assert populations.years == [2015, 2016, 2017]
+    assert populations.get(first.id, 2016) == 100
+    assert populations.get(first.id, 2016, 'ptot') == 105
+    assert populations.get(first.id, 2014) is None
+    assert populations.series(first.id) == [
+        (2015, 95), (2016, 100), (2017, 105)]
+    # The 2017 file is matched with the renamed town.
+    assert populations.series(second.id) == [(2015, 195), (2016, 200)]
+    assert populations.series(second_renamed.id) == [(2017, 205)]
+    # Populations are sums of municipal populations of members.
+    old = intercommunalities['fr:epci:200000001@2015-01-01']
+    new = intercommunalities['fr:epci:200000001@2016-01-01']
+    assert old.population == 95 + 195
+    assert new.population == 100 + 200
+    assert populations.sum(new.towns, 2017) == 105
+
+
+def test_write_yearly_populations(directory, towns):
+    intercommunalities = load_intercommunalities(
+        towns, str(directory), start=2015, end=2017, workers=2)
+    filename = str(directory.join('communes.csv'))
+    write_results_on(filename, towns, town_populations=(
+        intercommunalities.town_populations))
+    with open(filename) as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert rows[0]['yearly_populations'] == '2015:95;2016:100;2017:105'
+    assert rows[-1]['yearly_populations'] == '2015:10'
@@ -0,0 +1,50 @@
+from datetime import date
+
+from geohisto.lineage import Lineage
+
+from .factories import town_factory, towns_factory
+
+
+def make_towns():
+    """Two towns merged in 1970 into a third one, renamed in 2016."""
+    renamed = town_factory(dep='01', com='003', nccenr='Renamed',
+                           start_date=date(2016, 1, 1))
+    merged = town_factory(dep='01', com='003', nccenr='Merged',
+                          start_date=date(1970, 1, 1),
+                          end_date=date(2015, 12, 31), successors=renamed.id)
+    first = town_factory(dep='01', com='001', nccenr='First',
+                         end_date=date(1969, 12, 31), successors=merged.id)
+    second = town_factory(dep='01', com='002', nccenr='Second',
+                          end_date=date(1969, 12, 31), successors=merged.id)
+    return towns_factory(first, second, merged, renamed)
+
+
+def test_lineage_transitive():
+    towns = make_towns()
+    first, second, merged, renamed = towns.values()
+    lineage = Lineage(towns)
+    assert lineage.descendants(first.id) == [merged.id, renamed.id]
+    assert lineage.descendants(first.id, until=date(2000, 1, 1)) == [
+        merged.id]
+    assert lineage.current(first.id) == [renamed.id]
+    assert lineage.current(first.id, at=date(2000, 1, 1)) == [merged.id]
+    assert lineage.current(renamed.id) == [renamed.id]
+    assert sorted(lineage.ancestors(renamed.id)) == sorted([
+        merged.id, first.id, second.id])
+    assert lineage.ancestors(renamed.id, since=date(2000, 1, 1)) == [
+        merged.id]
+    assert lineage.bulk_current([first.id, second.id]) == {
+        first.id: [renamed.id], second.id: [renamed.id]}
+    assert lineage.walk.cache_info().hits
+
+
+def test_lineage_path_and_cycles():
+    towns = make_towns()
+    first, second, merged, renamed = towns.values()
+    lineage = Lineage(towns)
+    assert lineage.path(first.id, renamed.id) == [
+        first.id, merged.id, renamed.id]
+    assert lineage.path(first.id, second.id) is None
+    assert lineage.cycles() == []
+    towns.upsert(renamed._replace(successors=merged.id))
+    assert Lineage(towns).cycles() == [[merged.id, renamed.id]]
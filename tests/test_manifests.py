@@ -0,0 +1,65 @@
+import csv
+import os
+
+from datetime import date
+from functools import partial
+
+from geohisto.exports import write_results_on
+from geohisto.manifests import (
+    Manifest, delta_filename_for, partition_by_county, write_incrementally
+)
+
+from .factories import town_factory, towns_factory
+
+
+def read_delta(filename):
+    with open(delta_filename_for(filename)) as delta:
+        return [(row['id'], row['change']) for row in csv.DictReader(delta)]
+
+
+def test_incremental_exports(tmpdir):
+    manifest = Manifest.load(str(tmpdir.join('manifest.json')))
+    filename = str(tmpdir.join('communes.csv'))
+    old = town_factory(dep='01', com='001', nccenr='Old')
+    other = town_factory(dep='02', com='001', nccenr='Other')
+    towns = towns_factory(old, other)
+    write_incrementally(filename, partial(write_results_on, towns=towns),
+                        manifest, partition_by_county)
+    assert read_delta(filename) == [(old.id, 'added'), (other.id, 'added')]
+    first_entry = manifest[filename]
+    assert sorted(first_entry['partitions']) == ['01', '02']
+
+    # Unchanged content does not touch the file.
+    os.utime(filename, (0, 0))
+    write_incrementally(filename, partial(write_results_on, towns=towns),
+                        manifest, partition_by_county)
+    assert os.path.getmtime(filename) == 0
+    assert manifest[filename] == first_entry
+
+    renamed = old._replace(nccenr='Renamed', end_date=date(2016, 12, 31))
+    new = town_factory(dep='01', com='001', nccenr='New',
+                       start_date=date(2017, 1, 1))
+    towns = towns_factory(renamed, new)
+    write_incrementally(filename, partial(write_results_on, towns=towns),
+                        manifest, partition_by_county)
+    assert os.path.getmtime(filename) != 0
+    assert read_delta(filename) == [
+        (old.id, 'modified'), (new.id, 'added'), (other.id, 'removed')]
+    entry = manifest[filename]
+    assert entry['delta_from'] == first_entry['sha256']
+    assert list(entry['partitions']) == ['01']
+    assert entry['partitions']['01'] != first_entry['partitions']['01']
+
+    manifest.save()
+    assert Manifest.load(manifest.filename) == manifest
+
+
+def test_incremental_without_delta(tmpdir):
+    manifest = Manifest.load(str(tmpdir.join('manifest.json')))
+    filename = str(tmpdir.join('communes_head.csv'))
+    towns = towns_factory(town_factory(dep='01', com='001', nccenr='Old'))
+    write_incrementally(filename, partial(write_results_on, towns=towns),
+                        manifest, delta=False)
+    assert not os.path.exists(delta_filename_for(filename))
+    assert manifest[filename]['delta'] is None
+    assert os.listdir(str(tmpdir)) == ['communes_head.csv']
@@ -0,0 +1,69 @@
+from datetime import date, datetime
+
+from geohisto.memberships import MembershipIndex
+from geohisto.models import Intercommunalities, Intercommunality
+
+
+def make_intercommunalities():
+    intercommunalities = Intercommunalities()
+    first = Intercommunality(
+        siren='200000001', towns={'fr:commune:01001@1942-01-01',
+                                  'fr:commune:01002@1942-01-01'}
+    ).create_on(2000).end_on(2004, 'inner')
+    second = Intercommunality(
+        siren='200000001', towns={'fr:commune:01001@1942-01-01'}
+    ).create_on(2005).end_on(2009, 'merged')
+    third = Intercommunality(
+        siren='200000002', towns={'fr:commune:01001@1942-01-01',
+                                  'fr:commune:01003@2012-01-01'}
+    ).create_on(2012)
+    for item in (first, second, third):
+        intercommunalities.upsert(item)
+    return intercommunalities
+
+
+def test_membership_at():
+    memberships = MembershipIndex(make_intercommunalities())
+    town_id = 'fr:commune:01001@1942-01-01'
+    assert memberships.at(town_id, date(1999, 12, 31)) is None
+    assert memberships.at(town_id, date(2000, 1, 1)) == \
+        'fr:epci:200000001@2000-01-01'
+    assert memberships.at(town_id, date(2004, 12, 31)) == \
+        'fr:epci:200000001@2000-01-01'
+    assert memberships.at(town_id, datetime(2005, 1, 1, 12)) == \
+        'fr:epci:200000001@2005-01-01'
+    assert memberships.at(town_id, date(2010, 6, 1)) is None
+    assert memberships.at('01001', date(2017, 1, 1)) == \
+        'fr:epci:200000002@2012-01-01'
+    assert memberships.at('01003', date(2017, 1, 1)) == \
+        'fr:epci:200000002@2012-01-01'
+    assert memberships.at('01004', date(2017, 1, 1)) is None
+
+
+def test_membership_between():
+    memberships = MembershipIndex(make_intercommunalities())
+    assert memberships.between('01001', date(2003, 1, 1),
+                               date(2012, 1, 1)) == [
+        'fr:epci:200000001@2000-01-01',
+        'fr:epci:200000001@2005-01-01',
+        'fr:epci:200000002@2012-01-01',
+    ]
+    assert memberships.between('01002', date(2005, 1, 1),
+                               date(2017, 1, 1)) == []
+    assert memberships.between('01004', date(2005, 1, 1),
+                               date(2017, 1, 1)) == []
+
+
+def test_membership_bulk():
+    memberships = MembershipIndex(make_intercommunalities())
+    assert memberships.bulk_at(['01001', '01002', '01003'],
+                               date(2001, 1, 1)) == {
+        '01001': 'fr:epci:200000001@2000-01-01',
+        '01002': 'fr:epci:200000001@2000-01-01',
+        '01003': None,
+    }
+    assert memberships.bulk_between(['01002', '01003'], date(2004, 1, 1),
+                                    date(2012, 1, 1)) == {
+        '01002': ['fr:epci:200000001@2000-01-01'],
+        '01003': ['fr:epci:200000002@2012-01-01'],
+    }
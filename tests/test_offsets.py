@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from geohisto.intercommunalities import (
+    parse_intercommunalities_from, read_intercommunality_records
+)
+from geohisto.offsets import (
+    build_offsets, index_filename_for, load_offsets, read_rows
+)
+
+HEADER = ('siren;nom;nature;fiscalite;nb_com;ptot;pmun;insee;nom_com;'
+          'ptot_com;pmun_com')
+
+
+@pytest.fixture
+def year_file(tmpdir):
+    year_file = tmpdir.join('2017.csv')
+    year_file.write('\n'.join((
+        HEADER,
+        '200000001;CC du Valromey;CC;FA;2;300;290;1001;First;100;95',
+        '200000001;CC du Valromey;CC;FA;2;300;290;1002;Second;200;195',
+        '200000002;CC de la Vallière;CC;FPU;1;50;50;1003;Troisième;50;50',
+    )) + '\n')
+    return str(year_file)
+
+
+def test_build_offsets(year_file):
+    offsets = build_offsets(year_file)
+    assert offsets['header'] == [0, len(HEADER) + 1]
+    first_offset, first_length = offsets['sirens']['200000001']
+    second_offset, second_length = offsets['sirens']['200000002']
+    assert first_offset == len(HEADER) + 1
+    assert second_offset == first_offset + first_length
+    with open(year_file, 'rb') as source:
+        source.seek(second_offset)
+        assert source.read(second_length).decode('utf-8').startswith(
+            '200000002;CC de la Vallière')
+
+
+def test_build_offsets_not_contiguous(tmpdir):
+    year_file = tmpdir.join('2017.csv')
+    year_file.write('\n'.join((HEADER, '1;A;CC;FA;1;1;1;1001;A',
+                               '2;B;CC;FA;1;1;1;1002;B',
+                               '1;A;CC;FA;1;1;1;1003;C')) + '\n')
+    with pytest.raises(ValueError):
+        build_offsets(str(year_file))
+
+
+def test_load_offsets_rebuilt_on_change(year_file, tmpdir):
+    offsets = load_offsets(year_file)
+    assert tmpdir.join('2017.csv.idx').check()
+    assert index_filename_for(year_file) == year_file + '.idx'
+    assert load_offsets(year_file) == offsets
+    with open(year_file, 'a') as source:
+        source.write('200000003;CC Other;CC;FA;1;10;10;1004;Fourth;10;10\n')
+    assert sorted(load_offsets(year_file)['sirens']) == [
+        '200000001', '200000002', '200000003']
+
+
+def test_load_offsets_touched(year_file, monkeypatch):
+    offsets = load_offsets(year_file)
+    os.utime(year_file, (0, 0))
+    # Same content, the new modification time is written back.
+    assert load_offsets(year_file)['sirens'] == offsets['sirens']
+    assert load_offsets(year_file)['mtime'] == 0
+
+    def hash_file(filename):
+        raise AssertionError('Hashed again')
+
+    monkeypatch.setattr('geohisto.offsets.hash_file', hash_file)
+    assert load_offsets(year_file)['sirens'] == offsets['sirens']
+
+
+def test_read_rows(year_file):
+    rows = read_rows(year_file, ['200000002', '404'], delimiter=';')
+    assert list(rows) == ['200000002']
+    assert rows['200000002'][0]['nom_com'] == 'Troisième'
+
+
+def test_read_intercommunality_records(year_file):
+    records = read_intercommunality_records(year_file, ['200000001'])
+    assert records == {
+        '200000001': parse_intercommunalities_from(year_file)[0]}
+    assert records['200000001'].insees == ('01001', '01002')
+    assert records['200000001'].pmuns == (95, 195)
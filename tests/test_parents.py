@@ -0,0 +1,75 @@
+from datetime import date, datetime
+
+from geohisto.parents import CountyIndex, compute_parents
+
+from .factories import town_factory, towns_factory
+
+
+def county_line(id, start, end, ancestors='', parents='', successors=''):
+    return {'id': id, 'start_datetime': start + ' 00:00:00',
+            'end_datetime': end + ' 23:59:59', 'ancestors': ancestors,
+            'parents': parents, 'successors': successors}
+
+
+COUNTIES = {
+    '04': [county_line('fr:departement:04@1970-04-13', '1970-04-13',
+                       '9999-12-31', parents='fr:region:93@1970-01-09'),
+           county_line('fr:departement:04@1860-07-01', '1860-07-01',
+                       '1970-04-12', parents='fr:region:93@1970-01-09')],
+    '20': [county_line('fr:departement:20@1860-07-01', '1860-07-01',
+                       '1975-12-31')],
+    '2A': [county_line('fr:departement:2A@1976-01-01', '1976-01-01',
+                       '9999-12-31',
+                       ancestors='fr:departement:20@1860-07-01')],
+}
+
+
+def test_compute_parents():
+    towns = towns_factory(
+        town_factory(dep='04', com='001', nccenr='Always'),
+        town_factory(dep='04', com='002', nccenr='Old',
+                     end_date=date(1960, 12, 31)),
+        town_factory(dep='04', com='003', nccenr='New',
+                     start_date=date(1980, 1, 1)),
+        town_factory(dep='2A', com='001', nccenr='Corsican',
+                     end_date=date(1970, 12, 31)),
+        town_factory(dep='2A', com='002', nccenr='Still Corsican'),
+    )
+    always, old, new, corsican, still_corsican = compute_parents(
+        COUNTIES, towns).values()
+    assert always.parents == ('fr:departement:04@1860-07-01;'
+                              'fr:departement:04@1970-04-13')
+    assert old.parents == 'fr:departement:04@1860-07-01'
+    assert new.parents == 'fr:departement:04@1970-04-13'
+    # Disappeared before the creation of its county.
+    assert corsican.parents == 'fr:departement:20@1860-07-01'
+    # Survived the split of Corsica.
+    assert still_corsican.parents == ('fr:departement:20@1860-07-01;'
+                                      'fr:departement:2A@1976-01-01')
+
+
+def test_county_index_before_creation():
+    index = CountyIndex(COUNTIES)
+    assert index.parents_of('2A', datetime(1970, 1, 1),
+                            datetime(1970, 1, 1)) == [
+        'fr:departement:20@1860-07-01']
+    assert index.parents_of('2A', datetime(1980, 1, 1),
+                            datetime(1980, 1, 1)) == [
+        'fr:departement:2A@1976-01-01']
+
+
+def test_county_index_regions():
+    regions = {'fr:region:93@1970-01-09': county_line(
+        'fr:region:93@1970-01-09', '1970-01-09', '9999-12-31')}
+    index = CountyIndex(COUNTIES, regions)
+    assert index.overlapping('04', datetime(1970, 4, 13),
+                             datetime(1980, 1, 1)) == [
+        'fr:departement:04@1970-04-13']
+    assert index.overlapping('99', datetime(1970, 4, 13),
+                             datetime(1980, 1, 1)) == []
+    assert index.regions_of('fr:departement:04@1860-07-01',
+                            datetime(1942, 1, 1),
+                            datetime(1969, 12, 31)) == []
+    assert index.regions_of('fr:departement:04@1860-07-01',
+                            datetime(1942, 1, 1), datetime(1970, 4, 12)) == [
+        'fr:region:93@1970-01-09']
@@ -1,3 +1,14 @@
+from datetime import date
+
+from geohisto.exports import format_censuses
+from geohisto.populations import (
+    compute_census_populations, compute_populations, index_populations,
+    resolve_populations, set_census_populations
+)
+
+from .factories import town_factory, towns_factory
+
+
 def test_metropole_population(towns):
     arles = next(towns.filter(depcom='13004'))
     assert arles.population == 52566
@@ -20,9 +31,127 @@ def test_mortes_population(towns):
 
 def test_unknown_population(towns):
     amareins = next(towns.filter(depcom='01003'))
-    assert amareins.population == 'NULL'
+    assert amareins.population is None
 
 
 def test_computed_population(towns):
     val_ocre = list(towns.filter(depcom='89334'))[1]
     assert val_ocre.population == 581
+
+
+def test_resolve_populations_over_ancestors():
+    first = town_factory(dep='01', com='001', nccenr='First',
+                         end_date=date(1999, 12, 31))
+    second = town_factory(dep='01', com='002', nccenr='Second',
+                          end_date=date(1999, 12, 31))
+    merged = town_factory(dep='01', com='001', nccenr='Merged',
+                          start_date=date(2000, 1, 1),
+                          end_date=date(2009, 12, 31),
+                          ancestors=';'.join([first.id, second.id]))
+    renamed = town_factory(dep='01', com='001', nccenr='Renamed',
+                           start_date=date(2010, 1, 1), ancestors=merged.id)
+    dead = town_factory(dep='01', com='003', nccenr='Dead')
+    towns = towns_factory(renamed, merged, first, second, dead)
+    populations = {
+        'metropole': {'01001First': {'PMUN13': '100', 'PMUN08': '90'},
+                      '01002Second': {'PMUN13': '0', 'PMUN08': '0'}},
+        'arrondissements': {'01002Second': {'PMUN13': '20'}},
+        'dom': {'01001Renamed': {'PMUN13': '0', 'PSDC99': '80'}},
+        'mortes': {'01003Dead': {'PMUN13': '0'}},
+    }
+    store = index_populations(populations)
+    assert len(store) == 4
+    assert store.get('01001First') == 100
+    assert store.get('01001First', 'PMUN08') == 90
+    assert store.get('01002Second') == 20
+    assert store.get('01002Second', 'PMUN08') is None
+    assert store.get('01003Dead') == 0
+    assert store.get('01004Unknown') is None
+    resolved = resolve_populations(towns, store)
+    # Only PMUN13, PMUN08 and PSDC99 are set.
+    assert [populations[:3] for populations in (
+        resolved[first.id], resolved[second.id], resolved[merged.id],
+        resolved[renamed.id], resolved[dead.id])] == [
+        [100, 90, None], [20, None, None], [120, 90, None],
+        [120, 90, 80], [0, None, None]]
+
+    compute_populations(store, towns)
+    assert towns[merged.id].population == 120
+    compute_populations(store, towns, census='PMUN08')
+    assert towns[merged.id].population == 90
+
+
+def test_resolve_populations_with_cycle(caplog):
+    first = town_factory(dep='01', com='001', nccenr='First')
+    second = town_factory(dep='01', com='002', nccenr='Second',
+                          ancestors=first.id)
+    # Cyclic ancestors, with the same end.
+    first = first._replace(ancestors=second.id)
+    other = town_factory(dep='01', com='003', nccenr='Other')
+    merged = town_factory(dep='01', com='004', nccenr='Merged',
+                          ancestors=';'.join([first.id, other.id]))
+    towns = towns_factory(first, second, other, merged)
+    store = index_populations({
+        'metropole': {'01003Other': {'PMUN13': '10'}},
+        'arrondissements': {}, 'dom': {}, 'mortes': {},
+    })
+    resolved = resolve_populations(towns, store)
+    assert resolved[first.id][0] is None
+    assert resolved[second.id][0] is None
+    assert resolved[merged.id][0] == 10
+    assert 'Cycle of ancestors' in caplog.text
+
+
+def test_compute_census_populations():
+    old = town_factory(dep='01', com='001', nccenr='Old',
+                       end_date=date(2009, 12, 31))
+    new = town_factory(dep='01', com='001', nccenr='New',
+                       start_date=date(2010, 1, 1), ancestors=old.id)
+    towns = towns_factory(old, new)
+    store = index_populations({
+        'metropole': {'01001New': {'PMUN13': '120', 'PMUN08': '110'}},
+        'arrondissements': {},
+        'dom': {'01001Old': {'PMUN13': '0', 'PMUN08': '0',
+                             'PSDC99': '90'}},
+        'mortes': {},
+    })
+    compute_census_populations(store, towns)
+    assert towns[old.id].censuses == {'PMUN08': None, 'PSDC99': 90,
+                                      'PSDC90': None, 'PSDC82': None,
+                                      'PSDC74': None, 'PSDC67': None,
+                                      'PSDC61': None}
+    assert towns[new.id].censuses == {'PMUN13': 120}
+    assert format_censuses(towns[old.id]) == 'PSDC99:90'
+    set_census_populations(store, towns, 'PSDC99')
+    assert towns[old.id].population == 90
+    assert towns[new.id].population is None
+
+
+def test_census_populations_of_renamed_town(monkeypatch):
+    renamed = town_factory(dep='97', com='101', nccenr='Renamed',
+                           start_date=date(1970, 1, 1))
+    old = town_factory(dep='97', com='101', nccenr='Old',
+                       end_date=date(1969, 12, 31), successors=renamed.id)
+    renamed = renamed._replace(ancestors=old.id)
+    towns = towns_factory(old, renamed)
+    # Sources are keyed by the current name only.
+    store = index_populations({
+        'metropole': {}, 'arrondissements': {}, 'mortes': {},
+        'dom': {'97101Renamed': {'PMUN13': '300', 'PSDC99': '250',
+                                 'PSDC67': '200', 'PSDC61': '150'}},
+    })
+    # Populations are resolved once for both computations.
+    resolved = resolve_populations(towns, store)
+    monkeypatch.setattr('geohisto.populations.resolve_populations', None)
+    compute_census_populations(store, towns, resolved)
+    # Historic censuses go to the version valid at that time.
+    assert towns[old.id].censuses['PSDC61'] == 150
+    assert towns[old.id].censuses['PSDC67'] == 200
+    assert 'PSDC99' not in towns[old.id].censuses
+    assert towns[renamed.id].censuses['PSDC99'] == 250
+    assert towns[renamed.id].censuses['PMUN13'] == 300
+    assert format_censuses(towns[old.id]) == 'PSDC61:150;PSDC67:200'
+    # The default population is only the one of the renamed version.
+    compute_populations(store, towns, resolved=resolved)
+    assert towns[old.id].population is None
+    assert towns[renamed.id].population == 300
@@ -0,0 +1,80 @@
+from datetime import date
+
+import pytest
+
+from geohisto.redirects import build_redirects, load_redirects
+from geohisto.redirects import resolve_redirects, write_redirects_binary_on
+from geohisto.redirects import write_redirects_on
+
+from .factories import town_factory, towns_factory
+
+
+def make_towns():
+    """A town merged in 1970 then renamed in 2016, the other one split."""
+    renamed = town_factory(dep='01', com='003', nccenr='Renamed',
+                           start_date=date(2016, 1, 1))
+    merged = town_factory(dep='01', com='003', nccenr='Merged',
+                          start_date=date(1970, 1, 1),
+                          end_date=date(2015, 12, 31), successors=renamed.id)
+    first = town_factory(dep='01', com='001', nccenr='First',
+                         end_date=date(1969, 12, 31), successors=merged.id)
+    split = town_factory(dep='01', com='004', nccenr='Split',
+                         start_date=date(1980, 1, 1))
+    second = town_factory(dep='01', com='002', nccenr='Second',
+                          end_date=date(1979, 12, 31),
+                          successors=';'.join([merged.id, split.id]))
+    return towns_factory(first, second, merged, renamed, split)
+
+
+def test_resolve_redirects():
+    towns = make_towns()
+    first, second, merged, renamed, split = towns.values()
+    redirects = resolve_redirects(towns)
+    assert redirects[renamed.id] == (renamed.id,)
+    assert redirects[merged.id] == (renamed.id,)
+    # Chains are compressed, sharing the final redirections.
+    assert redirects[first.id] is redirects[merged.id]
+    assert redirects[second.id] == (renamed.id, split.id)
+    redirects = resolve_redirects(towns, date(1975, 1, 1))
+    assert redirects[first.id] == (merged.id,)
+    assert redirects[second.id] == (second.id,)
+    assert redirects[renamed.id] == ()
+    assert redirects[split.id] == ()
+
+
+def test_redirect_table():
+    towns = make_towns()
+    first, second, merged, renamed, split = towns.values()
+    table = build_redirects(towns)
+    assert len(table) == 5
+    assert table.get(second.id) == [renamed.id, split.id]
+    assert table.get('fr:commune:01999@1942-01-01') is None
+    assert table.at('01003', date(1950, 1, 1)) is None
+    assert table.at('01003', date(1970, 1, 1)) == [renamed.id]
+    assert table.at('01003', date(2017, 1, 1)) == [renamed.id]
+    assert table.at('01001', date(1950, 1, 1)) == [renamed.id]
+    assert table.at('01999', date(1950, 1, 1)) is None
+
+
+def test_write_redirects(tmpdir):
+    towns = make_towns()
+    first, second, merged, renamed, split = towns.values()
+    table = build_redirects(towns)
+    filename = str(tmpdir.join('redirects.csv'))
+    write_redirects_on(filename, towns, table)
+    with open(filename) as csvfile:
+        lines = csvfile.read().splitlines()
+    assert lines[0] == (
+        'id,insee_code,start_datetime,end_datetime,redirects')
+    assert lines[2] == (
+        '{id},01002,1942-01-01 00:00:00,1979-12-31 23:59:59,{redirects}'
+        .format(id=second.id, redirects=';'.join([renamed.id, split.id])))
+    filename = str(tmpdir.join('redirects.bin'))
+    write_redirects_binary_on(filename, table)
+    loaded = load_redirects(filename)
+    assert loaded.ids == table.ids
+    assert loaded.offsets == table.offsets
+    assert loaded.targets == table.targets
+    assert loaded.at('01002', date(1950, 1, 1)) == [renamed.id, split.id]
+    with pytest.raises(ValueError):
+        load_redirects(str(tmpdir.join('redirects.csv')))
@@ -0,0 +1,71 @@
+import io
+
+from datetime import date, datetime
+
+import pytest
+
+from geohisto.exports import write_results_on
+from geohisto.resolver import Resolver, bulk_resolve, stream_resolve
+from geohisto.resolver import worker_resolver
+
+from .factories import town_factory, towns_factory
+
+
+def make_towns():
+    """A town renamed in 1970, another one created in 1980."""
+    renamed = town_factory(dep='01', com='001', nccenr='Renamed',
+                           start_date=date(1970, 1, 1))
+    first = town_factory(dep='01', com='001', nccenr='First',
+                         end_date=date(1969, 12, 31), successors=renamed.id)
+    created = town_factory(dep='01', com='002', nccenr='Created',
+                           start_date=date(1980, 1, 1),
+                           end_date=date(1989, 12, 31))
+    return towns_factory(first, renamed, created)
+
+
+def test_resolve():
+    towns = make_towns()
+    first, renamed, created = towns.values()
+    resolver = Resolver.from_towns(towns)
+    codes = ['01001', '01002', '01001', '01999', '01001', '01002']
+    dates = ['2000-01-01', '1985-06-01', date(1969, 12, 31), '2000-01-01',
+             datetime(1970, 1, 1, 12), '1950-01-01']
+    assert resolver.resolve(codes, dates) == [
+        renamed.id, created.id, first.id, None, renamed.id, created.id]
+    # Same results as `Towns.get_current`, falling back on the latest.
+    for code, date_, id_ in zip(codes, dates, resolver.resolve(codes, dates)):
+        if code in resolver:
+            datetime_ = datetime.strptime(str(date_)[:10], '%Y-%m-%d')
+            assert towns.get_current(code, datetime_).id == id_
+    assert bulk_resolve(resolver, codes * 3, dates * 3, workers=2,
+                        chunk_size=4) == resolver.resolve(codes * 3, dates * 3)
+
+
+def test_stream_resolve(tmpdir):
+    towns = make_towns()
+    first, renamed, created = towns.values()
+    filename = str(tmpdir.join('communes.csv'))
+    write_results_on(filename, towns)
+    resolver = Resolver.from_csv(filename)
+    assert len(resolver) == 2
+    input_ = io.StringIO(
+        'value,insee_code,date\n'
+        'a,01001,1950-01-01\n'
+        '"b, c",01001,2000-01-01\n'
+        'd,01999,2000-01-01\n')
+    output = io.StringIO()
+    stream_resolve(resolver, input_, output, workers=1, chunk_size=2)
+    assert output.getvalue() == (
+        'value,insee_code,date,town_id\n'
+        'a,01001,1950-01-01,{first}\n'
+        '"b, c",01001,2000-01-01,{renamed}\n'
+        'd,01999,2000-01-01,\n'.format(first=first.id, renamed=renamed.id))
+    with pytest.raises(ValueError):
+        stream_resolve(resolver, io.StringIO('code,date\n'), io.StringIO())
+    # Workers load the resolver from its file on their first chunk.
+    assert resolver.source == filename
+    assert worker_resolver(filename) is worker_resolver(filename)
+    parallel = io.StringIO()
+    input_.seek(0)
+    stream_resolve(resolver, input_, parallel, workers=2, chunk_size=1)
+    assert parallel.getvalue() == output.getvalue()
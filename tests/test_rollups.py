@@ -0,0 +1,147 @@
+from datetime import date, datetime
+
+from geohisto.constants import END_DATETIME
+from geohisto.models import Intercommunalities, Intercommunality
+from geohisto.rollups import RollupCube, build_rollups, population_periods
+
+from .factories import town_factory, towns_factory
+
+COUNTY_ID = 'fr:departement:01@1860-07-01'
+REGION_ID = 'fr:region:84@2016-01-01'
+
+
+def county_line(id, start, end, parents='', successors=''):
+    return {'id': id, 'start_datetime': start + ' 00:00:00',
+            'end_datetime': end + ' 23:59:59', 'ancestors': '',
+            'parents': parents, 'successors': successors}
+
+
+def make_towns():
+    return towns_factory(
+        town_factory(dep='01', com='001', nccenr='First', population=100,
+                     parents=COUNTY_ID),
+        town_factory(dep='01', com='002', nccenr='Second', population=20,
+                     end_date=date(2015, 12, 31), parents=COUNTY_ID),
+        town_factory(dep='01', com='003', nccenr='Third', population=3,
+                     start_date=date(2016, 1, 1), parents=COUNTY_ID),
+        town_factory(dep='01', com='004', nccenr='Unknown', population=None,
+                     parents=COUNTY_ID),
+    )
+
+
+def test_rollup_cube():
+    cube = RollupCube([
+        ('parent', datetime(2000, 1, 1), datetime(2009, 12, 31, 23, 59), 10),
+        ('parent', datetime(2005, 1, 1), END_DATETIME, 5),
+        # Versions of a parent share the same key.
+        ('parent@2020-01-01', datetime(2020, 1, 1), END_DATETIME, 1),
+    ])
+    assert cube.at('parent', date(1999, 12, 31)) == (0, 0)
+    assert cube.at('parent', date(2000, 1, 1)) == (10, 1)
+    assert cube.at('parent', date(2005, 1, 1)) == (15, 2)
+    assert cube.at('parent', datetime(2009, 12, 31, 12)) == (15, 2)
+    assert cube.at('parent', date(2010, 1, 1)) == (5, 1)
+    assert cube.at('unknown', date(2010, 1, 1)) == (0, 0)
+    assert cube.at('parent@1999-01-01', date(2020, 1, 1)) == (6, 2)
+    assert cube.series('parent', [date(2010, 1, 1), date(1990, 1, 1),
+                                  date(2006, 1, 1)]) == [
+        (5, 1), (0, 0), (15, 2)]
+
+
+def test_build_rollups():
+    towns = make_towns()
+    counties = {'01': [county_line(COUNTY_ID, '1860-07-01', '9999-12-31',
+                                   REGION_ID)]}
+    regions = {REGION_ID: county_line(REGION_ID, '2016-01-01',
+                                      '9999-12-31')}
+    intercommunalities = Intercommunalities()
+    intercommunalities.upsert(Intercommunality(
+        siren='200000001', towns={'fr:commune:01001@1942-01-01',
+                                  'fr:commune:01002@1942-01-01'}
+    ).create_on(2010))
+    cube = build_rollups(towns, counties, regions, intercommunalities)
+    assert cube.at(COUNTY_ID, date(2015, 1, 1)) == (120, 3)
+    assert cube.at(COUNTY_ID, date(2016, 1, 1)) == (103, 3)
+    assert cube.bulk_at([COUNTY_ID, REGION_ID], date(2015, 1, 1)) == {
+        COUNTY_ID: (120, 3), REGION_ID: (0, 0)}
+    assert cube.population_at(REGION_ID, date(2016, 1, 1)) == 103
+    epci_id = 'fr:epci:200000001@2010-01-01'
+    assert cube.count_at(epci_id, date(2009, 1, 1)) == 0
+    assert cube.at(epci_id, date(2015, 1, 1)) == (120, 2)
+    # The second town ends while still being a member.
+    assert cube.at(epci_id, date(2016, 1, 1)) == (100, 1)
+
+
+def test_build_rollups_with_censuses():
+    """Rolled up populations are the ones of the census of each date."""
+    towns = make_towns()
+    first, second, third, unknown = towns.values()
+    towns.upsert(first.set_censuses({'PSDC99': 90, 'PMUN08': None,
+                                     'PMUN13': 100}))
+    towns.upsert(third.set_censuses({'PMUN13': None}))
+    assert population_periods(towns[first.id]) == [
+        (first.start_datetime, datetime(2012, 12, 31, 23, 59, 59, 999999),
+         90),
+        (datetime(2013, 1, 1), first.end_datetime, 100)]
+    counties = {'01': [
+        county_line(COUNTY_ID, '1860-07-01', '2009-12-31', REGION_ID),
+        county_line('fr:departement:01@2010-01-01', '2010-01-01',
+                    '9999-12-31', REGION_ID)]}
+    regions = {REGION_ID: county_line(REGION_ID, '1860-07-01',
+                                      '9999-12-31')}
+    for town in towns.values():
+        towns.upsert(town.set_parents(';'.join([
+            COUNTY_ID, 'fr:departement:01@2010-01-01'])))
+    cube = build_rollups(towns, counties, regions)
+    # The earliest census applies before its date.
+    assert cube.at('fr:departement:01', date(1990, 1, 1)) == (110, 3)
+    assert cube.at('fr:departement:01', date(2012, 1, 1)) == (110, 3)
+    assert cube.at('fr:departement:01', date(2013, 1, 1)) == (120, 3)
+    # Without census within its validity, the population applies.
+    assert cube.at('fr:departement:01', date(2016, 1, 1)) == (103, 3)
+    assert cube.at(REGION_ID, date(2013, 1, 1)) == (120, 3)
+    assert cube.at('fr:region:84', date(2016, 1, 1)) == (103, 3)
+
+
+def test_build_rollups_after_last_census():
+    """Towns created after the last census are not lost."""
+    merged = town_factory(dep='01', com='001', nccenr='Merged',
+                          population=150, start_date=date(2016, 1, 1),
+                          parents=COUNTY_ID)
+    towns = towns_factory(
+        town_factory(dep='01', com='001', nccenr='First', population=100,
+                     end_date=date(2015, 12, 31), parents=COUNTY_ID,
+                     successors=merged.id),
+        town_factory(dep='01', com='002', nccenr='Second', population=50,
+                     end_date=date(2015, 12, 31), parents=COUNTY_ID,
+                     successors=merged.id),
+        merged)
+    first, second, merged = towns.values()
+    towns.upsert(first.set_censuses({'PMUN13': 100}))
+    towns.upsert(second.set_censuses({'PMUN13': 50}))
+    towns.upsert(merged.set_censuses({}))
+    counties = {'01': [county_line(COUNTY_ID, '1860-07-01', '9999-12-31')]}
+    cube = build_rollups(towns, counties)
+    assert cube.at('fr:departement:01', date(2015, 1, 1)) == (150, 2)
+    assert cube.at('fr:departement:01', date(2016, 1, 1)) == (150, 1)
+
+
+def test_build_rollups_renamed_region():
+    """Counties belong to the successors of their listed regions."""
+    towns = towns_factory(
+        town_factory(dep='18', com='033', nccenr='Bourges', population=60,
+                     parents='fr:departement:18@1860-07-01'))
+    counties = {'18': [county_line('fr:departement:18@1860-07-01',
+                                   '1860-07-01', '9999-12-31',
+                                   'fr:region:24@1970-01-09')]}
+    regions = {
+        'fr:region:24@1970-01-09': county_line(
+            'fr:region:24@1970-01-09', '1970-01-09', '2015-01-16',
+            successors='fr:region:24@2015-01-17'),
+        'fr:region:24@2015-01-17': county_line(
+            'fr:region:24@2015-01-17', '2015-01-17', '9999-12-31'),
+    }
+    cube = build_rollups(towns, counties, regions)
+    assert cube.at('fr:region:24', date(2000, 1, 1)) == (60, 1)
+    assert cube.at('fr:region:24', date(2017, 1, 1)) == (60, 1)
+    assert cube.at('fr:region:24@2015-01-17', date(2017, 1, 1)) == (60, 1)
@@ -0,0 +1,32 @@
+from datetime import date, datetime
+
+from geohisto.snapshots import iter_dates, sweep
+
+from .factories import town_factory, towns_factory
+
+
+def test_iter_dates_every_year():
+    assert list(iter_dates(date(2015, 1, 1), date(2017, 1, 1), 'year')) == [
+        date(2015, 1, 1), date(2016, 1, 1), date(2017, 1, 1)]
+
+
+def test_iter_dates_every_month_clamped():
+    dates = iter_dates(date(2016, 11, 30), date(2017, 3, 1), 'month')
+    assert list(dates) == [date(2016, 11, 30), date(2016, 12, 30),
+                           date(2017, 1, 30), date(2017, 2, 28)]
+
+
+def test_sweep_equals_valid_at():
+    towns = towns_factory(
+        town_factory(dep='01', com='001', nccenr='Old',
+                     end_date=date(1973, 12, 31)),
+        town_factory(dep='01', com='001', nccenr='New',
+                     start_date=date(1974, 1, 1)),
+        town_factory(dep='01', com='002', nccenr='Dead',
+                     end_date=date(1960, 6, 30)),
+        town_factory(dep='01', com='003', nccenr='Alive'),
+    )
+    moments = [datetime(1950, 1, 1), datetime(1973, 12, 31),
+               datetime(1974, 1, 1), datetime(2017, 1, 1)]
+    for moment, valid_towns in sweep(towns.values(), reversed(moments)):
+        assert valid_towns == list(towns.valid_at(moment))
@@ -0,0 +1,57 @@
+import sqlite3
+
+from datetime import date
+
+from geohisto.models import Intercommunalities, Intercommunality
+from geohisto.sqlite import write_sqlite_on
+
+from .factories import town_factory, towns_factory
+
+VALID_AT = '''
+SELECT towns.id
+FROM towns JOIN towns_validity ON towns_validity.id = towns.rowid
+WHERE towns_validity.start <= julianday(:date)
+  AND towns_validity.end >= julianday(:date)
+  AND towns.dep = :dep
+  AND towns.start_datetime <= :date AND towns.end_datetime >= :date
+ORDER BY towns.id
+'''
+
+
+def test_sqlite_export(tmpdir):
+    old = town_factory(dep='14', com='001', nccenr='Old',
+                       end_date=date(1972, 12, 31))
+    new = town_factory(dep='14', com='001', nccenr='New', population=42,
+                       start_date=date(1973, 1, 1), ancestors=old.id)
+    old = old._replace(successors=new.id)
+    other = town_factory(dep='15', com='001', nccenr='Other')
+    towns = towns_factory(old, new, other)
+    intercommunality = Intercommunality(
+        siren='241400001', name='Test', kind='CC', population='42',
+        towns={new.id}).create_on(1999)
+    intercommunalities = Intercommunalities()
+    intercommunalities.upsert(intercommunality)
+    filename = str(tmpdir.join('geohisto.sqlite'))
+    write_sqlite_on(filename, towns, intercommunalities)
+    write_sqlite_on(filename, towns, intercommunalities)  # Overwrite.
+
+    connection = sqlite3.connect(filename)
+    valid_at = [row[0] for row in connection.execute(
+        VALID_AT, {'date': '1972-06-01', 'dep': '14'})]
+    assert valid_at == [old.id]
+    valid_at = [row[0] for row in connection.execute(
+        VALID_AT, {'date': '1975-01-01', 'dep': '14'})]
+    assert valid_at == [new.id]
+    successors = connection.execute(
+        'SELECT successor_id FROM town_successors '
+        'JOIN towns ON towns.id = town_id WHERE insee_code = ?',
+        ('14001',)).fetchall()
+    assert successors == [(new.id,)]
+    population = connection.execute(
+        'SELECT population FROM towns WHERE id = ?', (old.id,)).fetchone()
+    assert population == (None,)
+    memberships = connection.execute(
+        'SELECT intercommunality_id FROM intercommunality_towns '
+        'WHERE town_id = ?', (new.id,)).fetchall()
+    assert memberships == [(intercommunality.id,)]
+    connection.close()